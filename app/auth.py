@@ -60,6 +60,19 @@ def decode_access_token(token: str):
     except JWTError:
         return None
 
+def get_read_db(token: str = Depends(oauth2_scheme)):
+    """Sesión de lectura (réplica o primaria, ver database.ReadSessionLocal) para el usuario del token."""
+    payload = decode_access_token(token)
+    db = database.ReadSessionLocal(payload.get("sub") if payload else None)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_current_user_read(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)):
+    # Igual que get_current_user, pero cargado desde la sesión de lectura del endpoint
+    return get_current_user(token, db)
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
     print(token)
     payload = decode_access_token(token)
@@ -0,0 +1,65 @@
+"""
+Agregación por lotes de listas de la compra y nutrición desde la línea de comandos.
+
+Ejemplos:
+    python -m app.cli.aggregate --user-ids 1,2,3
+    python -m app.cli.aggregate --todos --listas-por-menu --output agregados.ndjson
+    python -m app.cli.aggregate --menus menus.jsonl   # un {"id": ..., "menu": {...}} por línea
+
+Escribe una línea JSON por menú y al final el consolidado; el resumen de tiempos va a stderr.
+"""
+import argparse
+import json
+import sys
+import time
+
+from app.services.aggregation import DEFAULT_CHUNK_SIZE, iter_payload_menus, iter_saved_menus, stream_aggregation
+
+
+def _iter_menus_file(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Agrega listas de la compra y nutrición de muchos menús.")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--user-ids", help="Ids de usuario separados por comas (se usa su menú guardado)")
+    origen.add_argument("--todos", action="store_true", help="Todos los usuarios con menú guardado")
+    origen.add_argument("--menus", help="Fichero JSONL con menús en formato guardado")
+    parser.add_argument("--listas-por-menu", action="store_true", help="Incluir la lista de la compra de cada menú")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--output", help="Fichero de salida NDJSON (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    db = None
+    if args.menus:
+        menus_source = iter_payload_menus(_iter_menus_file(args.menus))
+    else:
+        from app import database
+        db = database.SessionLocal()
+        user_ids = None if args.todos else [int(x) for x in args.user_ids.split(",") if x.strip()]
+        menus_source = iter_saved_menus(db, user_ids, chunk_size=args.chunk_size)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    n_lines = 0
+    try:
+        for line in stream_aggregation(menus_source, args.listas_por_menu, args.chunk_size):
+            out.write(json.dumps(line, ensure_ascii=False) + "\n")
+            n_lines += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if db is not None:
+            db.close()
+
+    elapsed = time.perf_counter() - start
+    n_menus = max(n_lines - 1, 0)
+    print(f"{n_menus} menús procesados en {elapsed:.2f}s ({n_menus / elapsed if elapsed else 0:.0f} menús/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark de serialización de un menú semanal de 7 días × 3 comidas × 4 opciones.
+
+    python -m app.cli.bench_menu_response --iterations 500
+
+Compara, dentro de FastAPI (TestClient, sin red ni Edamam):
+  - legado: devolver {día: DayMealsWithOptions} y dejar que FastAPI lo vuelque y lo revalide
+    entero contra WeeklyMenuWithOptionsResponse (cada RecipeOption se valida dos veces);
+  - actual: WeeklyMenu.to_response_json() (model_construct sin validación + volcado en pydantic-core).
+Comprueba también que ambos caminos producen exactamente los mismos bytes.
+"""
+import argparse
+import contextlib
+import io
+import random
+import statistics
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+
+from app.cli.fake_edamam import fake_recipe
+from app.schemas import DayMealsWithOptions, MealSlotWithOptions, WeeklyMenuWithOptionsResponse
+from app.services.menu_generator import DIAS_SEMANA, _create_recipe_option_from_data
+from app.services.menu_records import MealSlot, WeeklyMenu
+
+COMIDAS = ["desayuno", "comida", "cena"]
+OPCIONES = 4
+
+
+def build_menu(seed: int = 0) -> WeeklyMenu:
+    rnd = random.Random(seed)
+    menu = WeeklyMenu(DIAS_SEMANA)
+    with contextlib.redirect_stdout(io.StringIO()):  # _create_recipe_option_from_data es muy verboso
+        for dia in DIAS_SEMANA:
+            for comida in COMIDAS:
+                opciones = [_create_recipe_option_from_data(fake_recipe(400, 700, "Lunch", rnd)) for _ in range(OPCIONES)]
+                menu.set_slot(dia, comida, MealSlot(options=opciones))
+    return menu
+
+
+def legacy_structure(menu: WeeklyMenu):
+    """Estructura que devolvían antes los generadores: DayMealsWithOptions con slots puestos por setattr."""
+    legado = {}
+    for dia, comidas in menu.days.items():
+        day_obj = DayMealsWithOptions()
+        for comida, slot in comidas.items():
+            setattr(day_obj, comida, MealSlotWithOptions(options=slot.options, error=slot.error))
+        legado[dia] = day_obj
+    return legado
+
+
+def _medir(client: TestClient, ruta: str, iteraciones: int):
+    tiempos = []
+    for _ in range(iteraciones):
+        inicio = time.perf_counter()
+        r = client.get(ruta)
+        r.content
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de la respuesta del menú semanal (7×3×4).")
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args(argv)
+
+    menu = build_menu()
+    app = FastAPI()
+
+    @app.get("/legado", response_model=WeeklyMenuWithOptionsResponse)
+    def legado():
+        return legacy_structure(menu)
+
+    @app.get("/actual", response_model=WeeklyMenuWithOptionsResponse)
+    def actual():
+        return Response(menu.to_response_json(), media_type="application/json")
+
+    client = TestClient(app)
+    if client.get("/legado").content != client.get("/actual").content:
+        raise SystemExit("ERROR: las dos respuestas no coinciden")
+
+    print(f"Menú de {len(DIAS_SEMANA)}×{len(COMIDAS)}×{OPCIONES}, {args.iterations} iteraciones (extremo a extremo, TestClient)")
+    resultados = {}
+    for ruta in ("/legado", "/actual"):
+        _medir(client, ruta, 20)  # Calentamiento
+        tiempos = sorted(_medir(client, ruta, args.iterations))
+        resultados[ruta] = statistics.median(tiempos)
+        print(f"{ruta:<8} mediana {statistics.median(tiempos) * 1000:7.2f} ms   "
+              f"p95 {tiempos[int(0.95 * (len(tiempos) - 1))] * 1000:7.2f} ms")
+    print(f"Mejora: {resultados['/legado'] / resultados['/actual']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
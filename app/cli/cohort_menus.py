@@ -0,0 +1,122 @@
+"""
+Generación de menús recomendados para una cohorte completa de usuarios.
+
+    python -m app.cli.cohort_menus --todos --procesos 4
+    python -m app.cli.cohort_menus --user-ids 1,2,3 --output menus.ndjson
+    python -m app.cli.cohort_menus --csv cohorte.csv --sin-guardar --output menus.ndjson
+
+El CSV lleva cabecera con id, username, bmr, actividad, objetivo y/o target_calories; las filas
+con `id` de un usuario existente se guardan en su `last_generated_menu_json`.
+
+Etapas: carga -> plan (firmas de búsqueda compartidas por la cohorte) -> búsquedas (una vez por
+firma, en paralelo) -> generación (procesos hijos) -> escritura (en bloque, solapada con la
+generación). El informe de tiempos y rendimiento va a stderr.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from app.services import cohort
+from app.services.menu_generator import RECOMMENDED_MAX_SEARCHES_PER_MEAL
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p * (len(sorted_values) - 1))))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera menús recomendados para una cohorte de usuarios.")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--user-ids", help="Ids de usuario separados por comas")
+    origen.add_argument("--todos", action="store_true", help="Todos los usuarios de la base de datos")
+    origen.add_argument("--csv", help="Fichero CSV con los perfiles de la cohorte")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1, help="Procesos de generación")
+    parser.add_argument("--hilos-busqueda", type=int, default=cohort.COHORT_SEARCH_THREADS,
+                        help="Búsquedas simultáneas a Edamam en la etapa de búsquedas")
+    parser.add_argument("--max-busquedas", type=int, default=RECOMMENDED_MAX_SEARCHES_PER_MEAL,
+                        help="Páginas de Edamam como máximo por firma de búsqueda")
+    parser.add_argument("--chunk-size", type=int, default=cohort.COHORT_WRITE_CHUNK_SIZE,
+                        help="Menús por escritura en bloque")
+    parser.add_argument("--sin-guardar", action="store_true", help="No escribe en la base de datos")
+    parser.add_argument("--output", help="Fichero NDJSON con un menú por usuario")
+    parser.add_argument("--verbose", action="store_true", help="No silencia los logs de la generación")
+    args = parser.parse_args(argv)
+
+    timer = cohort.StageTimer()
+    inicio = time.perf_counter()
+    db = None
+    if not args.csv or not args.sin_guardar:
+        from app import database
+        db = database.SessionLocal()
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else None
+    generados = errores = guardados = slots_vacios = 0
+    busquedas_hijos = 0
+    tiempos_menu = []
+    try:
+        with timer.stage("carga"):
+            if args.csv:
+                members = cohort.load_members_from_csv(args.csv)
+            else:
+                user_ids = None if args.todos else [int(x) for x in args.user_ids.split(",") if x.strip()]
+                members = cohort.load_members_from_db(db, user_ids)
+        if not members:
+            print("La cohorte está vacía", file=sys.stderr)
+            return
+
+        with timer.stage("plan"):
+            cohort.resolve_targets(members)
+            plan = cohort.plan_searches(members)
+        with timer.stage("busquedas"):
+            busquedas = cohort.prefetch_pools(plan, cohort.prefetch_target(), args.max_busquedas, args.hilos_busqueda)
+
+        # La escritura de cada bloque se hace mientras los hijos siguen generando los siguientes
+        with timer.stage("generacion"):
+            resultados = cohort.generate_menus(members, args.procesos, plan.keys(), args.verbose)
+            for bloque in cohort.chunked(resultados, args.chunk_size):
+                for r in bloque:
+                    if "error" in r:
+                        errores += 1
+                        print(f"Error generando el menú de {r['username']}: {r['error']}", file=sys.stderr)
+                    else:
+                        generados += 1
+                        slots_vacios += r["slots_sin_recetas"]
+                    tiempos_menu.append(r["segundos"])
+                    busquedas_hijos += r["busquedas_edamam"]
+                with timer.stage("escritura"):
+                    if out is not None:
+                        for r in bloque:
+                            out.write(json.dumps(r, ensure_ascii=False) + "\n")
+                    if not args.sin_guardar:
+                        guardados += cohort.write_menus(db, bloque)
+    finally:
+        if out is not None:
+            out.close()
+        if db is not None:
+            db.close()
+
+    total = time.perf_counter() - inicio
+    # La escritura está solapada con la generación: se descuenta para ver la generación pura
+    timer.stages["generacion"] -= timer.stages.get("escritura", 0.0)
+    tiempos_menu.sort()
+    print(f"Cohorte: {len(members)} usuarios, {len(plan)} firmas de búsqueda "
+          f"({len(members) * len(cohort.RECOMMENDED_MEALS) / len(plan):.1f} comidas por firma)", file=sys.stderr)
+    print(f"Búsquedas a Edamam: {busquedas} compartidas + {int(busquedas_hijos)} durante la generación", file=sys.stderr)
+    print(f"Menús: {generados} generados, {errores} con error, {slots_vacios} comidas sin recetas, "
+          f"{guardados} guardados en la BD", file=sys.stderr)
+    for etapa in ("carga", "plan", "busquedas", "generacion", "escritura"):
+        print(f"  {etapa:<11} {timer.stages.get(etapa, 0.0):8.2f} s", file=sys.stderr)
+    print(f"Por menú (en el hijo): mediana {statistics.median(tiempos_menu) * 1000:.0f} ms, "
+          f"p95 {_percentile(tiempos_menu, 0.95) * 1000:.0f} ms", file=sys.stderr)
+    print(f"Total {total:.2f} s con {args.procesos} procesos: {len(members) / total:.1f} menús/s", file=sys.stderr)
+    if errores:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Servidor HTTP falso que imita la búsqueda de recetas de Edamam (/api/recipes/v2), para pruebas
+de carga sin gastar cuota ni depender de la red.
+
+    python -m app.cli.fake_edamam --port 8765 --latency-ms 150
+    EDAMAM_BASE_URL=http://127.0.0.1:8765/api/recipes/v2 ./start.sh
+
+Devuelve 20 recetas aleatorias dentro del rango de calorías pedido, con los campos que usa la app.
+Respeta los filtros health (etiquetas) y excluded (ingredientes) de la API real; con una etiqueta
+de salud que no conoce responde sin resultados (count 0).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PALABRAS = (
+    "chicken rice salad quinoa avocado oat banana egg tomato pasta beef tofu lentil "
+    "spinach salmon yogurt apple potato chickpea pepper mushroom cheese broccoli"
+).split()
+ETIQUETAS_SALUD = ["Vegan", "Vegetarian", "Gluten-Free", "Dairy-Free", "Peanut-Free", "Low-Sugar"]
+PAGE_SIZE = 20
+
+
+def fake_recipe(min_cal: float, max_cal: float, meal_type: str, rnd: random.Random,
+                health=(), excluded=()) -> dict:
+    raciones = rnd.choice([1, 2, 4])
+    calorias = rnd.uniform(min_cal, max_cal) * raciones
+    palabras = rnd.sample([p for p in PALABRAS if p not in excluded], 4)
+    etiquetas = rnd.sample(ETIQUETAS_SALUD, 3)
+    etiquetas += [h.title() for h in health if h.title() not in etiquetas]
+    rid = rnd.getrandbits(48)
+
+    def nutriente(label, cantidad, unidad):
+        return {"label": label, "quantity": cantidad * raciones, "unit": unidad}
+
+    return {
+        "uri": f"http://www.edamam.com/ontologies/edamam.owl#recipe_{rid:x}",
+        "label": " ".join(p.title() for p in palabras),
+        "image": f"https://example.com/img/{rid:x}.jpg",
+        "source": "Fake Edamam",
+        "url": f"https://example.com/recipes/{rid:x}",
+        "yield": raciones,
+        "ingredientLines": [f"{rnd.randint(1, 3)} cup {p}" for p in palabras],
+        "calories": calorias,
+        "totalTime": rnd.choice([0, 15, 30, 45]),
+        "mealType": [meal_type.lower()] if meal_type else ["lunch/dinner"],
+        "healthLabels": etiquetas,
+        "dietLabels": ["Balanced"],
+        "cuisineType": [rnd.choice(["mediterranean", "american", "asian"])],
+        "dishType": ["main course"],
+        "totalNutrients": {
+            "ENERC_KCAL": {"label": "Energy", "quantity": calorias, "unit": "kcal"},
+            "PROCNT": nutriente("Protein", rnd.uniform(10, 40), "g"),
+            "FAT": nutriente("Fat", rnd.uniform(5, 30), "g"),
+            "CHOCDF": nutriente("Carbs", rnd.uniform(20, 80), "g"),
+            "FIBTG": nutriente("Fiber", rnd.uniform(1, 10), "g"),
+            "NA": nutriente("Sodium", rnd.uniform(100, 800), "mg"),
+            "FASAT": nutriente("Saturated", rnd.uniform(1, 10), "g"),
+            "SUGAR": nutriente("Sugars", rnd.uniform(2, 25), "g"),
+            "CA": nutriente("Calcium", rnd.uniform(50, 400), "mg"),
+            "FE": nutriente("Iron", rnd.uniform(0.5, 5), "mg"),
+            "K": nutriente("Potassium", rnd.uniform(200, 1200), "mg"),
+            "VITC": nutriente("Vitamin C", rnd.uniform(0, 40), "mg"),
+            "VITD": nutriente("Vitamin D", rnd.uniform(0, 3), "µg"),
+        },
+    }
+
+
+def make_handler(latency_ms: float, contador: dict, lock: threading.Lock):
+    class FakeEdamamHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            try:
+                min_cal, max_cal = (float(x) for x in query.get("calories", ["300-700"])[0].split("-"))
+            except ValueError:
+                min_cal, max_cal = 300.0, 700.0
+            meal_type = query.get("mealType", [""])[0]
+            health = query.get("health", [])
+            excluded = [e.lower() for e in query.get("excluded", [])]
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            rnd = random.Random()
+            # Una etiqueta de salud que no conoce deja la búsqueda sin resultados (como un filtro muy estricto)
+            if any(h.title() not in ETIQUETAS_SALUD for h in health):
+                hits, count = [], 0
+            else:
+                hits = [{"recipe": fake_recipe(min_cal, max_cal, meal_type, rnd, health, excluded)} for _ in range(PAGE_SIZE)]
+                count = 10000
+            body = json.dumps({"from": 1, "to": len(hits), "count": count, "hits": hits}).encode("utf-8")
+            with lock:
+                contador["peticiones"] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Sin una línea por petición
+
+    return FakeEdamamHandler
+
+
+def start_server(port: int = 0, latency_ms: float = 0.0):
+    """Arranca el servidor en un hilo. Devuelve (servidor, url_base, contador_de_peticiones)."""
+    contador = {"peticiones": 0}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency_ms, contador, threading.Lock()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-edamam", daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/recipes/v2"
+    return server, url, contador
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor Edamam falso para pruebas de carga.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia añadida a cada respuesta")
+    args = parser.parse_args(argv)
+
+    server, url, contador = start_server(args.port, args.latency_ms)
+    print(f"Edamam falso escuchando en {url} (Ctrl+C para parar)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(f"Peticiones atendidas: {contador['peticiones']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Modelo de Gemini falso para pruebas de carga: misma interfaz que `genai.GenerativeModel`
+en lo que usa gemini_service (`generate_content_async`, con y sin stream=True).
+
+    from app.services import gemini_service
+    gemini_service.set_model(FakeGeminiModel(latency_ms=300))
+"""
+import asyncio
+from typing import AsyncIterator
+
+TEXTO_ALTERNATIVA = (
+    "Receta alternativa: sustituye la fritura por horno, usa aceite de oliva en spray y "
+    "yogur natural en lugar de nata. Información nutricional total: 420 kcal, 12 g de grasas, "
+    "6 g de azúcares. Diferencias con la tradicional: -35% calorías, -50% grasas, -40% azúcares."
+)
+
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _StreamResponse:
+    def __init__(self, partes, pausa: float):
+        self._partes = partes
+        self._pausa = pausa
+
+    async def __aiter__(self) -> AsyncIterator[_Chunk]:
+        for parte in self._partes:
+            await asyncio.sleep(self._pausa)
+            yield _Chunk(parte)
+
+
+class FakeGeminiModel:
+    """Responde siempre el mismo texto tras `latency_ms`; en streaming lo reparte en `chunks` trozos."""
+
+    def __init__(self, latency_ms: float = 300.0, chunks: int = 6):
+        self.latency = latency_ms / 1000
+        self.chunks = max(1, chunks)
+        self.llamadas = 0
+
+    def _texto(self, prompt: str) -> str:
+        return f"{TEXTO_ALTERNATIVA} (petición: {prompt[-60:]})"
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        self.llamadas += 1
+        texto = self._texto(prompt)
+        if stream:
+            tam = -(-len(texto) // self.chunks)
+            partes = [texto[i:i + tam] for i in range(0, len(texto), tam)]
+            return _StreamResponse(partes, self.latency / len(partes))
+        await asyncio.sleep(self.latency)
+        return _Chunk(texto)
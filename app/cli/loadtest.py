@@ -0,0 +1,205 @@
+"""
+Prueba de carga de extremo a extremo, sin servicios externos (Edamam y Gemini falsos).
+
+    python -m app.cli.loadtest                                  # 20 usuarios, 2 iteraciones
+    python -m app.cli.loadtest --users 50 --iterations 3 --json resultados.json
+
+Arranca la app con uvicorn en un proceso aparte (base de datos SQLite temporal, Edamam falso de
+app/cli/fake_edamam.py y FakeGeminiModel de app/cli/fake_gemini.py) y simula usuarios que se
+registran, inician sesión, completan su perfil, generan menús semanales y recomendados, guardan
+el menú, marcan y quitan favoritas, piden la lista de la compra y alternativas a la IA.
+Muestra peticiones/s y p50/p95/p99 por endpoint; con --json se guardan los resultados para
+comparar entre versiones. Sale con código 1 si alguna petición falla.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.cli.fake_edamam import start_server
+from app.cli.worker_scaling import free_port, percentile, wait_ready
+
+PLATOS = ["lasaña de carne", "pizza cuatro quesos", "tarta de chocolate", "hamburguesa con patatas",
+          "croquetas de jamón", "paella", "churros con chocolate", "macarrones con queso"]
+
+
+def _serve(port: int, gemini_latency_ms: float) -> None:
+    """Proceso hijo: la app real con el cliente de Gemini sustituido por el falso."""
+    import uvicorn
+    from app.cli.fake_gemini import FakeGeminiModel
+    from app.main import app
+    from app.services import gemini_service
+
+    gemini_service.set_model(FakeGeminiModel(latency_ms=gemini_latency_ms))
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+class Recorder:
+    def __init__(self):
+        self.muestras = defaultdict(list)  # endpoint -> [(segundos, status)]
+        self._lock = threading.Lock()
+
+    def call(self, session: requests.Session, metodo: str, base_url: str, ruta: str, nombre: str = None, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            r = session.request(metodo, base_url + ruta, timeout=120, **kwargs)
+            _ = r.content  # Incluye la descarga completa (streams) en la latencia
+            status = r.status_code
+        except requests.RequestException:
+            r, status = None, 599
+        with self._lock:
+            self.muestras[nombre or f"{metodo} {ruta.split('?')[0]}"].append((time.perf_counter() - inicio, status))
+        return r
+
+
+def _menu_guardable(menu: dict) -> dict:
+    """Formato que guarda el frontend: la primera opción de cada comida como seleccionada."""
+    guardado = {}
+    for dia, comidas in menu.items():
+        if not comidas:
+            continue
+        guardado[dia] = {}
+        for comida, slot in comidas.items():
+            opciones = (slot or {}).get("options") or []
+            if opciones:
+                guardado[dia][comida] = {"selected": opciones[0], "options": opciones}
+    return {"menu": guardado}
+
+
+def virtual_user(indice: int, iteraciones: int, base_url: str, rec: Recorder) -> None:
+    rnd = random.Random(indice)
+    s = requests.Session()
+    credenciales = {"username": f"carga{indice}", "password": "carga-pw"}
+    rec.call(s, "POST", base_url, "/register", json={**credenciales, "email": f"carga{indice}@example.com"})
+    r = rec.call(s, "POST", base_url, "/login", json=credenciales)
+    if r is None or not r.ok:
+        return
+    s.headers["Authorization"] = f"Bearer {r.json()['access_token']}"
+    rec.call(s, "POST", base_url, "/user-info", json={
+        "edad": rnd.randint(18, 70), "genero": rnd.choice(["masculino", "femenino"]),
+        "altura": rnd.randint(155, 195), "peso": rnd.randint(50, 110),
+        "actividad": rnd.choice(["sedentario", "ligero", "moderado", "activo"]),
+        "objetivo": rnd.choice(["perder", "mantener", "ganar"]),
+    })
+
+    for _ in range(iteraciones):
+        r = rec.call(s, "POST", base_url, "/generate-weekly-menu",
+                     json={"calories": rnd.choice([1600, 1800, 2000, 2200, 2500]), "num_options_per_meal": 3})
+        menu = r.json() if r is not None and r.ok else {}
+        rec.call(s, "POST", base_url, "/generar-menu-recomendado", json={})
+        rec.call(s, "POST", base_url, "/guardar-menu", json=_menu_guardable(menu))
+        rec.call(s, "GET", base_url, "/menu-guardado")
+        rec.call(s, "GET", base_url, "/lista-compra")
+        rec.call(s, "GET", base_url, "/perfil/analisis-nutricional")
+
+        opciones = [o for comidas in menu.values() if comidas for slot in comidas.values() if slot for o in slot.get("options") or []]
+        if opciones:
+            receta = rnd.choice(opciones)
+            favorita = {"recipe_url": receta["url"], "label": receta["label"], "ingredients": receta["ingredients"]}
+            rec.call(s, "POST", base_url, "/guardar-favorita", json=favorita)
+            rec.call(s, "GET", base_url, "/favoritas")
+            if rnd.random() < 0.5:
+                rec.call(s, "POST", base_url, "/eliminar-favorita", json={"recipe_url": receta["url"]})
+
+        plato = rnd.choice(PLATOS)  # Prompts repetidos entre usuarios: ejercita también la caché de la IA
+        rec.call(s, "POST", base_url, "/ia/alternativa", json={"prompt": plato})
+        rec.call(s, "POST", base_url, "/ia/alternativa/stream?formato=sse", nombre="POST /ia/alternativa/stream",
+                 json={"prompt": f"{plato} {indice}"})
+
+
+def resumen(rec: Recorder, duracion: float) -> dict:
+    endpoints = {}
+    for nombre, muestras in sorted(rec.muestras.items()):
+        latencias = [lat for lat, _ in muestras]
+        endpoints[nombre] = {
+            "n": len(muestras),
+            "errores": sum(1 for _, status in muestras if status >= 400),
+            "p50_ms": round(percentile(latencias, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(latencias, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencias, 0.99) * 1000, 1),
+            "media_ms": round(statistics.mean(latencias) * 1000, 1),
+        }
+    total = sum(e["n"] for e in endpoints.values())
+    return {
+        "duracion_s": round(duracion, 2),
+        "peticiones": total,
+        "peticiones_por_s": round(total / duracion, 1) if duracion else 0.0,
+        "errores": sum(e["errores"] for e in endpoints.values()),
+        "endpoints": endpoints,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API con Edamam y Gemini falsos.")
+    parser.add_argument("--users", type=int, default=20, help="Usuarios virtuales simultáneos")
+    parser.add_argument("--iterations", type=int, default=2, help="Ciclos completos por usuario")
+    parser.add_argument("--edamam-latency-ms", type=float, default=50.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300.0)
+    parser.add_argument("--json", dest="json_path", help="Guarda el resumen en este fichero")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)  # Puerto del proceso hijo
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        _serve(args.serve, args.gemini_latency_ms)
+        return
+
+    server, edamam_url, edamam_calls = start_server(latency_ms=args.edamam_latency_ms)
+    tmp = tempfile.mkdtemp(prefix="dieta-loadtest-")
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'app.db')}",
+        IA_CACHE_PATH=os.path.join(tmp, "ia_cache.db"),
+        EDAMAM_BASE_URL=edamam_url,
+        EDAMAM_APP_ID=os.getenv("EDAMAM_APP_ID", "carga"),
+        EDAMAM_APP_KEY=os.getenv("EDAMAM_APP_KEY", "carga"),
+        FRONTEND_URL=os.getenv("FRONTEND_URL", "http://localhost"),
+        PREWARM_ON_STARTUP="false",
+        # Todos los usuarios virtuales salen de la misma IP: se mide la app, no los límites por cliente
+        ADMISSION_ENABLED=os.getenv("ADMISSION_ENABLED", "false"),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "app.cli.loadtest", "--serve", str(port), "--gemini-latency-ms", str(args.gemini_latency_ms)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    rec = Recorder()
+    try:
+        wait_ready(base_url, proc)
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            list(pool.map(lambda i: virtual_user(i, args.iterations, base_url, rec), range(args.users)))
+        duracion = time.perf_counter() - inicio
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        server.shutdown()
+
+    informe = resumen(rec, duracion)
+    informe["edamam_peticiones"] = edamam_calls["peticiones"]
+    print(f"{'endpoint':<36} {'n':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for nombre, e in informe["endpoints"].items():
+        print(f"{nombre:<36} {e['n']:>5} {e['errores']:>4} {e['p50_ms']:>8.0f} {e['p95_ms']:>8.0f} {e['p99_ms']:>8.0f}")
+    print(f"Total: {informe['peticiones']} peticiones en {informe['duracion_s']} s "
+          f"({informe['peticiones_por_s']} pet/s), {informe['errores']} errores, "
+          f"{informe['edamam_peticiones']} búsquedas en Edamam")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+    if informe["errores"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
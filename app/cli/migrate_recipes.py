@@ -0,0 +1,116 @@
+"""
+Migra los menús guardados y favoritos existentes a la tabla `recipes` (recetas por referencia).
+
+    python -m app.cli.migrate_recipes               # todos los usuarios
+    python -m app.cli.migrate_recipes --dry-run     # solo calcula el ahorro
+
+Los blobs ya migrados no cambian (las referencias se conservan), así que puede ejecutarse
+varias veces. Hace commit por bloques de --chunk-size usuarios.
+
+Si la tabla `recipes` es la antigua (una fila por hash del contenido), se renombra a
+`recipes_contenido`, se crea la nueva (una fila por uri) y las referencias a las filas antiguas
+se reescriben contra la nueva; al terminar se borra la antigua (los blobs ilegibles no se pueden
+reescribir y sus referencias se pierden). Hay que ejecutarla antes de
+arrancar la app con la tabla nueva.
+"""
+import argparse
+import json
+from typing import Any, Dict
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import undefer_group
+
+from app.database import SessionLocal, get_engine
+from app.services import recipe_store
+from app.users import User
+
+OLD_TABLE = "recipes_contenido"
+
+
+def _old_layout(engine) -> bool:
+    inspector = inspect(engine)
+    return inspector.has_table(OLD_TABLE) or (
+        inspector.has_table("recipes") and "content_hash" in {c["name"] for c in inspector.get_columns("recipes")}
+    )
+
+
+def _detach_old_table(engine, dry_run: bool) -> Dict[int, Dict[str, Any]]:
+    """{id antiguo: receta} de la tabla por contenido; fuera de dry-run la aparta y crea la nueva."""
+    inspector = inspect(engine)
+    table = OLD_TABLE if inspector.has_table(OLD_TABLE) else "recipes"
+    with engine.begin() as conn:
+        old_rows = {row_id: json.loads(data) for row_id, data in conn.execute(text(f"SELECT id, data FROM {table}"))}
+        if table == "recipes" and not dry_run:
+            # Los índices conservan su nombre al renombrar la tabla y chocarían con los de la nueva
+            for index in inspector.get_indexes("recipes"):
+                conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+            conn.execute(text(f"ALTER TABLE recipes RENAME TO {OLD_TABLE}"))
+    if not dry_run:
+        from app.base import Base
+        from app import recipes  # noqa: F401
+        Base.metadata.create_all(bind=engine)
+    uris = {recipe_store.recipe_uri(r) for r in old_rows.values()}
+    print(f"Tabla por contenido: {len(old_rows)} filas -> {len(uris)} recetas por uri" + (" [dry-run]" if dry_run else ""))
+    return old_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migra menús y favoritos a recetas por referencia.")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="No guarda nada; solo muestra el ahorro")
+    args = parser.parse_args(argv)
+
+    engine = get_engine()
+    old_rows = _detach_old_table(engine, args.dry_run) if _old_layout(engine) else {}
+    if old_rows and args.dry_run:
+        # Con la tabla antigua no se pueden crear filas nuevas sin migrarla
+        print("Ejecuta sin --dry-run para migrar la tabla y los blobs.")
+        return
+
+    db = SessionLocal()
+    antes = despues = usuarios = errores = 0
+    try:
+        ultimo_id = 0
+        while True:
+            # Paginación por id (no yield_per): el commit de cada bloque cerraría el cursor
+            chunk = (db.query(User).options(undefer_group("blobs"))
+                     .filter(User.id > ultimo_id).order_by(User.id).limit(args.chunk_size).all())
+            if not chunk:
+                break
+            ultimo_id = chunk[-1].id
+            for user in chunk:
+                usuarios += 1
+                for campo, dehydrate in (("last_generated_menu_json", recipe_store.dehydrate_menu),
+                                         ("recetas_favoritas", recipe_store.dehydrate_favorites)):
+                    raw = getattr(user, campo)
+                    if not raw:
+                        continue
+                    try:
+                        # Las referencias a la tabla antigua se resuelven y se vuelven a referenciar en la nueva
+                        nuevo = json.dumps(dehydrate(db, recipe_store.inline_refs(json.loads(raw), old_rows)))
+                    except (ValueError, TypeError, AttributeError) as e:
+                        errores += 1
+                        print(f"Usuario {user.id}: {campo} ilegible ({e}), se deja como está")
+                        continue
+                    antes += len(raw)
+                    despues += len(nuevo)
+                    if not args.dry_run and nuevo != raw:
+                        setattr(user, campo, nuevo)
+            if not args.dry_run:
+                db.commit()
+        db.rollback()  # En dry-run descarta las recetas creadas
+    finally:
+        db.close()
+
+    if old_rows:
+        # Ya nada apunta a ella; conservarla haría que otra pasada confundiera ids nuevos con antiguos
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {OLD_TABLE}"))
+
+    ahorro = 100 * (1 - despues / antes) if antes else 0.0
+    print(f"{usuarios} usuarios, {errores} blobs ilegibles. Tamaño de los blobs: {antes} -> {despues} bytes ({ahorro:.1f}% menos)"
+          + (" [dry-run]" if args.dry_run else ""))
+
+
+if __name__ == "__main__":
+    main()
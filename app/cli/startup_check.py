@@ -0,0 +1,68 @@
+"""
+Comprueba el arranque en frío de la aplicación contra el presupuesto COLD_START_BUDGET_MS.
+
+    python -m app.cli.startup_check            # 3 arranques en procesos nuevos
+    python -m app.cli.startup_check --runs 5 --budget-ms 1200
+
+Cada arranque importa app.main en un proceso limpio y ejecuta el startup del lifespan
+(sin precalentamiento de pools, para no depender de la red). Sale con código 1 si la
+mediana supera el presupuesto, de modo que puede usarse en CI.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def _child():
+    from app.services import startup
+    from app.main import app, lifespan
+
+    async def _run_lifespan():
+        async with lifespan(app):
+            pass
+
+    asyncio.run(_run_lifespan())
+    print(json.dumps(startup.report()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide el arranque en frío de app.main.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=None, help="Por defecto COLD_START_BUDGET_MS o 1500")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child()
+        return
+
+    budget_ms = args.budget_ms if args.budget_ms is not None else float(os.getenv("COLD_START_BUDGET_MS", "1500"))
+    env = dict(os.environ, PREWARM_ON_STARTUP="false")
+    arranques = []
+    ultimo_informe = {}
+    for _ in range(args.runs):
+        inicio = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-m", "app.cli.startup_check", "--child"],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        total_ms = (time.perf_counter() - inicio) * 1000
+        ultimo_informe = json.loads(out.strip().splitlines()[-1])
+        arranques.append(ultimo_informe["arranque_ms"])
+        print(f"arranque app: {ultimo_informe['arranque_ms']:.0f} ms (proceso completo: {total_ms:.0f} ms)")
+
+    mediana = statistics.median(arranques)
+    print("Subsistemas (último arranque, ms):")
+    for nombre, ms in sorted(ultimo_informe["subsistemas_ms"].items(), key=lambda kv: -kv[1]):
+        print(f"  {nombre:<24} {ms:8.1f}")
+    print(f"Mediana: {mediana:.0f} ms / presupuesto {budget_ms:.0f} ms")
+    sys.exit(0 if mediana <= budget_ms else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Prueba de carga que mide cómo escala el rendimiento con el número de workers de uvicorn.
+
+    python -m app.cli.worker_scaling                       # 1, 2 y 4 workers
+    python -m app.cli.worker_scaling --workers 1,2,4,8 --requests 400 --concurrency 32
+
+Para cada número de workers arranca `uvicorn --workers N` contra una base de datos SQLite y un
+SHARED_CACHE_PATH temporales y un Edamam falso (app/cli/fake_edamam.py), lanza una mezcla de
+peticiones /generate-weekly-menu y /login (bcrypt) y muestra peticiones/s, p50/p95 y cuántas
+búsquedas llegaron a Edamam (con el pool compartido no crecen con el número de workers).
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.cli.fake_edamam import start_server
+
+CALORIAS = [1800, 2000, 2200]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(base_url: str, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    limite = time.time() + timeout
+    while time.time() < limite:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn terminó al arrancar (código {proc.returncode})")
+        try:
+            if requests.get(f"{base_url}/salud/arranque", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("uvicorn no respondió a tiempo")
+
+
+def percentile(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p * (len(valores) - 1))))]
+
+
+def run_once(workers: int, total: int, concurrency: int, edamam_url: str, edamam_calls: dict) -> dict:
+    tmp = tempfile.mkdtemp(prefix=f"dieta-carga-{workers}w-")
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'app.db')}",
+        SHARED_CACHE_PATH=os.path.join(tmp, "shared_cache.db"),
+        EDAMAM_BASE_URL=edamam_url,
+        EDAMAM_APP_ID=os.getenv("EDAMAM_APP_ID", "carga"),
+        EDAMAM_APP_KEY=os.getenv("EDAMAM_APP_KEY", "carga"),
+        FRONTEND_URL=os.getenv("FRONTEND_URL", "http://localhost"),
+        PREWARM_ON_STARTUP="false",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(base_url, proc)
+        credenciales = {"username": "carga", "password": "carga-pw"}
+        requests.post(f"{base_url}/register", json={**credenciales, "email": "carga@example.com"}, timeout=30)
+        calls_antes = edamam_calls["peticiones"]
+
+        def peticion(i):
+            inicio = time.perf_counter()
+            if i % 4 == 3:
+                r = requests.post(f"{base_url}/login", json=credenciales, timeout=60)
+            else:
+                r = requests.post(f"{base_url}/generate-weekly-menu",
+                                  json={"calories": CALORIAS[i % len(CALORIAS)], "num_options_per_meal": 3}, timeout=120)
+            return time.perf_counter() - inicio, r.status_code
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            resultados = list(pool.map(peticion, range(total)))
+        duracion = time.perf_counter() - inicio
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    latencias = [lat for lat, _ in resultados]
+    return {
+        "workers": workers,
+        "rps": total / duracion,
+        "p50_ms": percentile(latencias, 0.50) * 1000,
+        "p95_ms": percentile(latencias, 0.95) * 1000,
+        "errores": sum(1 for _, status in resultados if status >= 400),
+        "edamam": edamam_calls["peticiones"] - calls_antes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide el rendimiento con distinto número de workers.")
+    parser.add_argument("--workers", default="1,2,4", help="Lista separada por comas (ej. 1,2,4)")
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por ejecución")
+    parser.add_argument("--concurrency", type=int, default=16, help="Clientes simultáneos")
+    parser.add_argument("--edamam-latency-ms", type=float, default=50.0)
+    args = parser.parse_args(argv)
+
+    server, edamam_url, edamam_calls = start_server(latency_ms=args.edamam_latency_ms)
+    try:
+        resultados = [
+            run_once(int(n), args.requests, args.concurrency, edamam_url, edamam_calls)
+            for n in args.workers.split(",") if n.strip()
+        ]
+    finally:
+        server.shutdown()
+
+    base = resultados[0]["rps"] if resultados else 0
+    print(f"{'workers':>7} {'pet/s':>8} {'x':>5} {'p50 ms':>8} {'p95 ms':>8} {'errores':>8} {'edamam':>7}")
+    for r in resultados:
+        print(f"{r['workers']:>7} {r['rps']:>8.1f} {r['rps'] / base:>5.2f} {r['p50_ms']:>8.0f} "
+              f"{r['p95_ms']:>8.0f} {r['errores']:>8} {r['edamam']:>7}")
+    if any(r["errores"] for r in resultados):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+from dotenv import load_dotenv
+
+# Cargar variables de entorno (.env) una sola vez para toda la aplicación.
+# Los módulos que leen os.getenv importan `app.config` antes de hacerlo.
+load_dotenv()
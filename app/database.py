@@ -1,15 +1,156 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import  sessionmaker
 import os
-from dotenv import load_dotenv
-
-# Cargar variables de entorno
-load_dotenv()
+import threading
+from app import config  # Carga .env
+from app.services import startup
 
 #SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"  # Asegúrate de usar la URL correcta para tu base de datos
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Comprobar/crear las tablas la primera vez que se usa la base de datos (no al importar)
+DB_SCHEMA_CHECK = os.getenv("DB_SCHEMA_CHECK", "true").lower() in ("1", "true", "yes")
+
+# Réplica de solo lectura opcional (p. ej. sqlite:///./replica.db en local). Los endpoints de
+# consulta leen de ella; las escrituras, y las lecturas de un usuario durante
+# READ_AFTER_WRITE_SECONDS después de escribir, van a la primaria (DATABASE_URL).
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+READ_AFTER_WRITE_SECONDS = float(os.getenv("READ_AFTER_WRITE_SECONDS", "10"))
+
+_engine = None
+_engine_lock = threading.Lock()
+_session_factory = sessionmaker(autocommit=False, autoflush=False)
+_replica_engine = None
+_replica_session_factory = sessionmaker(autocommit=False, autoflush=False)
+_recent_writers = None
+
+
+def get_engine():
+    """Crea el engine (y comprueba el esquema) en el primer uso, no al importar el módulo."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                with startup.timed("db_engine"):
+                    engine = create_engine(DATABASE_URL)
+                if DB_SCHEMA_CHECK:
+                    with startup.timed("db_schema_check"):
+                        from app.base import Base
+                        from app import recipes, users  # noqa: F401  (registra los modelos en Base.metadata)
+                        Base.metadata.create_all(bind=engine)
+                        _add_missing_columns(engine)
+                        _check_recipes_table(engine)
+                _session_factory.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+
+def SessionLocal():
+    get_engine()
+    return _session_factory()
+
+
+# Columnas añadidas después de crear las tablas (create_all no altera tablas existentes)
+ADDED_COLUMNS = {
+    "users": {"data_version": "INTEGER NOT NULL DEFAULT 0"},
+}
+
+
+def _add_missing_columns(engine) -> None:
+    inspector = inspect(engine)
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for name, ddl in columns.items():
+            if name not in existing:
+                print(f"Esquema: añadiendo la columna {table}.{name}")
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def _check_recipes_table(engine) -> None:
+    # La tabla antigua (por hash del contenido) se migra con app.cli.migrate_recipes, que reescribe los blobs
+    inspector = inspect(engine)
+    if inspector.has_table("recipes_contenido") or "content_hash" in {c["name"] for c in inspector.get_columns("recipes")}:
+        print("ADVERTENCIA: la tabla recipes tiene el formato antiguo; ejecuta python -m app.cli.migrate_recipes")
+
+
+def get_replica_engine():
+    """Engine de la réplica, creado en el primer uso. Su esquema lo gestiona la primaria."""
+    global _replica_engine
+    if _replica_engine is None:
+        with _engine_lock:
+            if _replica_engine is None:
+                with startup.timed("db_replica_engine"):
+                    engine = create_engine(DATABASE_REPLICA_URL)
+                _replica_session_factory.configure(bind=engine)
+                _replica_engine = engine
+    return _replica_engine
+
+
+def _writers():
+    """Usuarios que han escrito hace poco. Con varios workers se comparte en SHARED_CACHE_PATH."""
+    global _recent_writers
+    if _recent_writers is None:
+        with _engine_lock:
+            if _recent_writers is None:
+                from app.services.cache import SqliteCache, TTLCache
+                shared_path = os.getenv("SHARED_CACHE_PATH")
+                if shared_path:
+                    _recent_writers = SqliteCache(shared_path, table="lecturas_primaria", ttl_seconds=READ_AFTER_WRITE_SECONDS)
+                else:
+                    _recent_writers = TTLCache(max_entries=10000, ttl_seconds=READ_AFTER_WRITE_SECONDS)
+    return _recent_writers
+
+
+def recently_wrote(username: str) -> bool:
+    return _writers().get(username) is not None
+
+
+def ReadSessionLocal(username: str = None):
+    """
+    Sesión para consultas: la réplica si está configurada, salvo que `username` haya escrito hace
+    menos de READ_AFTER_WRITE_SECONDS (la réplica podría no tener aún su cambio).
+    """
+    if not DATABASE_REPLICA_URL or (username and recently_wrote(username)):
+        return SessionLocal()
+    get_replica_engine()
+    return _replica_session_factory()
+
+
+@event.listens_for(_session_factory, "after_flush")
+def _track_user_writes(session, flush_context):
+    # En after_flush session.new/dirty aún reflejan lo que se acaba de escribir
+    if not DATABASE_REPLICA_URL:
+        return
+    from app.users import User
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User) and obj.username:
+            session.info.setdefault("usuarios_escritos", set()).add(obj.username)
+
+
+@event.listens_for(_session_factory, "after_commit")
+def _mark_user_writes(session):
+    for username in session.info.pop("usuarios_escritos", ()):
+        _writers().set(username, "1")
+
+
+@event.listens_for(_session_factory, "after_soft_rollback")
+def _forget_user_writes(session, previous_transaction):
+    session.info.pop("usuarios_escritos", None)
+
+
+def dispose_engine(close: bool = True) -> None:
+    # close=False en un proceso hijo (fork): descarta las conexiones heredadas sin cerrarlas
+    if _engine is not None:
+        _engine.dispose(close=close)
+    if _replica_engine is not None:
+        _replica_engine.dispose(close=close)
+
+
+def __getattr__(name):
+    # Compatibilidad: `database.engine` sigue funcionando, pero se crea de forma perezosa
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(name)
 
 
 def get_db():
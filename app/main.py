@@ -1,48 +1,93 @@
-from fastapi import FastAPI, Depends, HTTPException, Body, Request
-from app.models.MenuRequest import MenuRequest
-from fastapi.middleware.cors import CORSMiddleware
-from app.services.menu_generator import generate_weekly_menu, _create_recipe_option_from_data, generate_recommended_weekly_menu
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from . import database, models, schemas, auth
-from fastapi.security import OAuth2PasswordRequestForm
-from .schemas import Token , WeeklyMenuWithOptionsResponse, RecipeOption, FavoritaRequest, FavoritasResponse
-from app.base import Base
-from .users import User
-from fastapi.responses import JSONResponse
+from app.services import startup  # Primero, para medir la importación del resto
+
+with startup.timed("import:framework"):
+    from fastapi import FastAPI, Depends, HTTPException, Body, Request, Header
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import HTMLResponse
+    from fastapi.staticfiles import StaticFiles
+    from sqlalchemy.orm import Session
+    from fastapi.security import OAuth2PasswordRequestForm
+    from fastapi.concurrency import run_in_threadpool
+    from fastapi.responses import JSONResponse, Response, StreamingResponse
+    from pydantic import BaseModel, Field
+
+with startup.timed("import:app"):
+    from app import config  # Carga .env
+    from app.models.MenuRequest import MenuRequest
+    from app.services.menu_generator import generate_weekly_menu, _create_recipe_option_from_data, generate_recommended_weekly_menu, regenerate_slots, daily_target_calories_for_user, DIAS_SEMANA, RECOMMENDED_MEALS, RECOMMENDED_MEAL_RATIOS, RECOMMENDED_NUM_OPTIONS
+    from app.services.shopping_list import build_shopping_list, clean_ingredient, shopping_list_cache
+    from app.services.saved_menu import menu_version, saved_menu_days, filter_day_range, selected_recipes_by_day, normalize_day_name, recipe_urls_in_menu
+    from app.services import admission, deadline, edamam_keys, edamam_service, gemini_service, idempotency, menu_cache, metrics, micronutrients, profiling, recipe_pool, recipe_store, recommender
+    from app.services.menu_records import WeeklyMenu
+    from app.services.aggregation import analyze_menu, iter_saved_menus, iter_payload_menus, stream_aggregation
+    from . import database, models, schemas, auth
+    from .schemas import Token , WeeklyMenuWithOptionsResponse, RecipeOption, FavoritaRequest, FavoritasResponse
+    from .users import User
+
 from typing import Dict, Union , List, Optional, Tuple , Any
 import re
 from collections import defaultdict
-from pydantic import BaseModel, Field
 import requests
-import google.generativeai as genai
+import asyncio
+import contextlib
 import json
 import os
-from dotenv import load_dotenv
+import time
+
 
-# Cargar variables de entorno
-load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL")
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # La base de datos, el cliente de Gemini y la sesión HTTP de Edamam se inicializan
+    # de forma perezosa en su primer uso; aquí solo se arrancan las tareas de fondo.
+    with startup.timed("lifespan_startup"):
+        # Llena en segundo plano los pools de las combinaciones (ventana, comida) más habituales
+        prewarm_stop = recipe_pool.start_prewarm_thread()
+    startup.mark_ready()
+    print(f"Informe de arranque: {startup.report()}")
+    yield
+    if prewarm_stop is not None:
+        prewarm_stop.set()
+    edamam_service.close_http_session()
+    database.dispose_engine()
 
-app = FastAPI()
-Base.metadata.create_all(bind=database.engine)
 
+app = FastAPI(lifespan=lifespan)
 
 
-# Configura tu clave API de Google
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# La clave de Google (GOOGLE_API_KEY) se usa en app/services/gemini_service.py
 FRONTEND_URL = os.getenv("FRONTEND_URL")
-genai.configure(api_key=GOOGLE_API_KEY)
 
 
+# Límites por usuario/IP y cola justa para generación, IA y login/registro (429 con Retry-After).
+# Se añade antes que CORS para que las respuestas 429 también lleven sus cabeceras.
+if admission.ADMISSION_ENABLED:
+    app.add_middleware(admission.AdmissionMiddleware)
+
+# Idempotency-Key y supresión de peticiones repetidas en la generación de menús. Va por fuera del
+# control de admisión: las repetidas no gastan cupo ni hueco, esperan a la original.
+if idempotency.IDEMPOTENCY_ENABLED:
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=FRONTEND_URL,  # dirección del frontend
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "Idempotent-Replayed"],
 )
+
+# Perfilado bajo demanda (X-Profile: <PROFILING_TOKEN>). Sin PROFILING_ENABLED no se añade.
+if profiling.PROFILING_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+def _menu_response(menu: WeeklyMenu, exclude_none: bool = False) -> Response:
+    # Las RecipeOption ya se validaron al crearse: se serializa una sola vez y se devuelve la
+    # respuesta directamente, sin revalidar el menú entero contra WeeklyMenuWithOptionsResponse
+    # (que se mantiene como response_model para la documentación).
+    return Response(menu.to_response_json(exclude_none=exclude_none), media_type="application/json")
+
+
 def get_db():
     db = database.SessionLocal()
     try:
@@ -81,15 +126,25 @@ def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
 @app.post("/generate-weekly-menu", response_model=WeeklyMenuWithOptionsResponse)
 async def weekly_menu_endpoint( # Lo hago async por si futuras llamadas internas lo son
     request: MenuRequest,
+    x_deadline_seconds: Optional[str] = Header(None),
     # current_user: User = Depends(auth.get_current_user) # Descomentar para proteger
 ):
     try:
-        # menu_generator.generate_weekly_menu ahora devuelve un Dict que Pydantic validará
+        # menu_generator.generate_weekly_menu devuelve un WeeklyMenu con RecipeOption ya validadas
         print(f"Received request in /generate-weekly-menu: {request.model_dump_json(indent=2)}")
-        
-        menu_dict = generate_weekly_menu(request)
-        # print("Generated menu dict for response_model:", menu_dict) # Para depuración
-        return menu_dict
+
+        # Mismo MenuRequest (normalizado) que otro reciente: se sirve uno de sus menús ya generados
+        cache_key, variant, cached = menu_cache.lookup(request)
+        if cached is not None:
+            return Response(cached, media_type="application/json", headers={"X-Menu-Cache": "hit"})
+
+        # Con el deadline agotado se devuelven los slots completados y el resto con error de tiempo.
+        # La generación bloquea (requests), así que va al threadpool y no al event loop.
+        menu_deadline = deadline.request_deadline(x_deadline_seconds)
+        menu = await run_in_threadpool(profiling.call_profiled, generate_weekly_menu, request, menu_deadline)
+        body = menu.to_response_json()
+        menu_cache.save(cache_key, variant, menu, body)
+        return Response(body, media_type="application/json", headers={"X-Menu-Cache": "miss"})
     except ValueError as ve: # Errores de validación, ej. ratios no suman 1
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
@@ -97,9 +152,54 @@ async def weekly_menu_endpoint( # Lo hago async por si futuras llamadas internas
         raise HTTPException(status_code=500, detail=f"Error interno del servidor al generar el menú.")
 
 
+# ETag fuerte por recurso y versión de datos del usuario (User.data_version sube en cada escritura).
+# Con If-None-Match coincidente se responde 304 sin cargar ni rehidratar los blobs; "no-cache"
+# obliga al cliente a revalidar siempre, así que nunca sirve una copia vieja.
+CACHE_CONTROL_PRIVATE = "private, no-cache"
+
+
+def _etag(scope: str, user: User) -> str:
+    return f'"{scope}-{user.id}-{user.data_version or 0}"'
+
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    candidates = {c.strip().removeprefix("W/") for c in header.split(",")}
+    if "*" in candidates or etag in candidates:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL_PRIVATE})
+    return None
+
+
+def _set_cache_headers(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL_PRIVATE
+
+
+# Los endpoints de solo lectura usan auth.get_read_db: la réplica (DATABASE_REPLICA_URL) si la hay,
+# o la primaria si el usuario acaba de escribir (p. ej. justo después de /guardar-menu)
 @app.get("/perfil")
-def get_user_profile(current_user: User = Depends(auth.get_current_user)):
+def get_user_profile(request: Request, response: Response, db: Session = Depends(auth.get_read_db), current_user: User = Depends(auth.get_current_user_read)):
+    etag = _etag("perfil", current_user)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    _set_cache_headers(response, etag)
     print(f"sale : ",current_user.recetas_favoritas)
+    # Los blobs guardan referencias a la tabla de recetas: se devuelven rehidratados, como antes
+    menu_json = current_user.last_generated_menu_json
+    if menu_json:
+        try:
+            menu_json = json.dumps(recipe_store.load_saved_menu(db, menu_json))
+        except ValueError:
+            pass
+    favoritas_json = current_user.recetas_favoritas
+    if favoritas_json:
+        try:
+            favoritas_json = json.dumps(recipe_store.load_favorites(db, favoritas_json))
+        except json.JSONDecodeError:
+            pass
     return {
         "usuario": current_user.username,
         "email": current_user.email,
@@ -110,127 +210,70 @@ def get_user_profile(current_user: User = Depends(auth.get_current_user)):
         "actividad": current_user.actividad,
         "objetivo": current_user.objetivo,
         "bmr":current_user.bmr,
-        "last_generated_menu_json":current_user.last_generated_menu_json,
-        "recetas_favoritas":current_user.recetas_favoritas
+        "last_generated_menu_json":menu_json,
+        "recetas_favoritas":favoritas_json
     }
     
 
 @app.get("/perfil/analisis-nutricional")
 async def get_analisis_nutricional_perfil(
-    current_user: User = Depends(auth.get_current_user)
+    db: Session = Depends(auth.get_read_db),
+    current_user: User = Depends(auth.get_current_user_read)
 ):
     if not current_user.last_generated_menu_json:
         raise HTTPException(status_code=404, detail="No hay menú guardado para analizar.")
 
+    # last_generated_menu_json ALMACENA un objeto que tiene una CLAVE "menu"
+    # y el VALOR de esa clave es el diccionario de días y comidas.
+    # ej: {"menu": {"lunes": {"desayuno": {"selected": {...}, "options": [...]}}, ...}}
     try:
-        # last_generated_menu_json ALMACENA un objeto que tiene una CLAVE "menu"
-        # y el VALOR de esa clave es el diccionario de días y comidas.
-        # ej: {"menu": {"lunes": {"desayuno": {"selected": {...}, "options": [...]}}, ...}}
-        parsed_json_object = json.loads(current_user.last_generated_menu_json)
-        
-        # Verificamos que el JSON parseado es un diccionario y contiene la clave "menu"
-        if not isinstance(parsed_json_object, dict) or "menu" not in parsed_json_object:
-            print(f"Formato inesperado de last_generated_menu_json. Contenido: {current_user.last_generated_menu_json[:500]}...") # Log para depurar
-            raise HTTPException(status_code=500, detail="Formato de menú guardado no es el esperado. Falta la clave 'menu' principal.")
+        menu_items = saved_menu_days(recipe_store.load_saved_menu(db, current_user.last_generated_menu_json))
+    except ValueError as e:
+        print(f"Formato inesperado de last_generated_menu_json ({e}). Contenido: {current_user.last_generated_menu_json[:500]}...") # Log para depurar
+        raise HTTPException(status_code=500, detail=f"Formato de menú guardado no es el esperado: {e}")
+
+    # Mismo motor vectorizado que el análisis por lotes (/batch/agregados)
+    return analyze_menu(menu_items)
+
+
+# Micronutrientes (fibra, sodio, vitaminas, minerales...) y % de la ingesta de referencia,
+# calculados sobre total_nutrients_raw de las recetas seleccionadas
+@app.get("/perfil/analisis-micronutrientes")
+def get_analisis_micronutrientes_perfil(
+    desde: Optional[str] = None, # Día inicial del rango (ej. "lunes"), incluido
+    hasta: Optional[str] = None, # Día final del rango (ej. "miercoles"), incluido
+    calorias_referencia: Optional[int] = None, # Por defecto, las calorías objetivo del perfil
+    db: Session = Depends(auth.get_read_db),
+    current_user: User = Depends(auth.get_current_user_read)
+):
+    if not current_user.last_generated_menu_json:
+        raise HTTPException(status_code=404, detail="No hay menú guardado para analizar.")
+    try:
+        menu_items = saved_menu_days(recipe_store.load_saved_menu(db, current_user.last_generated_menu_json))
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=f"Formato de menú guardado no es el esperado: {e}")
+    try:
+        menu_items = filter_day_range(menu_items, desde, hasta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    calorias = daily_target_calories_for_user(current_user, calorias_referencia)
+    return micronutrients.analyze_weeks([menu_items], calorias)
 
-        menu_items = parsed_json_object["menu"] # Este es el diccionario de días: {"lunes": ..., "martes": ...}
-        
-        # Verificamos que menu_items (el contenido de "menu") sea un diccionario
-        if not isinstance(menu_items, dict):
-            print(f"La clave 'menu' no contiene un diccionario de días. Contenido de 'menu': {menu_items}") # Log para depurar
-            raise HTTPException(status_code=500, detail="Formato de menú guardado incorrecto. La clave 'menu' debe ser un diccionario de días.")
-
-    except json.JSONDecodeError:
-        print(f"Error al decodificar JSON de last_generated_menu_json. Contenido: {current_user.last_generated_menu_json[:500]}...") # Log para depurar
-        raise HTTPException(status_code=500, detail="Error al leer el menú guardado (JSON malformado).")
-
-
-    analisis_diario = defaultdict(lambda: {
-        "totalCalorias": 0.0,
-        "macronutrientes": {
-            "proteinas_g": 0.0,
-            "grasas_g": 0.0,
-            "carbohidratos_g": 0.0
-        }
-    })
-
-    total_calorias_semana = 0.0
-    total_proteinas_semana = 0.0
-    total_grasas_semana = 0.0
-    total_carbohidratos_semana = 0.0
-    dias_con_datos_validos = 0 # Contador para días que realmente tienen datos de recetas procesables
-
-    for dia_nombre, comidas_del_dia in menu_items.items():
-        if not isinstance(comidas_del_dia, dict): continue
-
-        calorias_dia_actual = 0.0
-        proteinas_dia_actual = 0.0
-        grasas_dia_actual = 0.0
-        carbos_dia_actual = 0.0
-        dia_tuvo_recetas_procesadas = False
-
-        for tipo_comida, slot_comida in comidas_del_dia.items():
-            if not slot_comida or not isinstance(slot_comida, dict): continue
-
-            receta_seleccionada_data = None
-            if "selected" in slot_comida and isinstance(slot_comida["selected"], dict):
-                receta_seleccionada_data = slot_comida["selected"]
-            elif "options" in slot_comida and isinstance(slot_comida["options"], list) and len(slot_comida["options"]) > 0 and isinstance(slot_comida["options"][0], dict):
-                receta_seleccionada_data = slot_comida["options"][0]
-
-            if receta_seleccionada_data:
-                calorias = float(receta_seleccionada_data.get("calories", 0.0) or 0.0)
-                proteinas = float(receta_seleccionada_data.get("protein_g", 0.0) or 0.0)
-                grasas = float(receta_seleccionada_data.get("fat_g", 0.0) or 0.0)
-                carbos = float(receta_seleccionada_data.get("carbs_g", 0.0) or 0.0)
-
-                # Solo sumar si la receta tiene calorías (indicativo de datos válidos)
-                if calorias > 0 : # Podríamos ser más estrictos (ej. si faltan macros)
-                    calorias_dia_actual += calorias
-                    proteinas_dia_actual += proteinas
-                    grasas_dia_actual += grasas
-                    carbos_dia_actual += carbos
-                    dia_tuvo_recetas_procesadas = True
-        
-        if dia_tuvo_recetas_procesadas:
-            analisis_diario[dia_nombre]["totalCalorias"] = round(calorias_dia_actual, 2)
-            analisis_diario[dia_nombre]["macronutrientes"]["proteinas_g"] = round(proteinas_dia_actual, 2)
-            analisis_diario[dia_nombre]["macronutrientes"]["grasas_g"] = round(grasas_dia_actual, 2)
-            analisis_diario[dia_nombre]["macronutrientes"]["carbohidratos_g"] = round(carbos_dia_actual, 2)
-            
-            total_calorias_semana += calorias_dia_actual
-            total_proteinas_semana += proteinas_dia_actual
-            total_grasas_semana += grasas_dia_actual
-            total_carbohidratos_semana += carbos_dia_actual
-            dias_con_datos_validos += 1
-
-    promedio_calorias_dia = round(total_calorias_semana / dias_con_datos_validos, 2) if dias_con_datos_validos > 0 else 0.0
-    promedio_proteinas_dia = round(total_proteinas_semana / dias_con_datos_validos, 2) if dias_con_datos_validos > 0 else 0.0
-    promedio_grasas_dia = round(total_grasas_semana / dias_con_datos_validos, 2) if dias_con_datos_validos > 0 else 0.0
-    promedio_carbohidratos_dia = round(total_carbohidratos_semana / dias_con_datos_validos, 2) if dias_con_datos_validos > 0 else 0.0
-
-    # Filtrar días sin datos del análisis_diario para no enviar entradas vacías
-    analisis_diario_filtrado = {k: v for k, v in analisis_diario.items() if v["totalCalorias"] > 0 or \
-                               v["macronutrientes"]["proteinas_g"] > 0 or \
-                               v["macronutrientes"]["grasas_g"] > 0 or \
-                               v["macronutrientes"]["carbohidratos_g"] > 0}
 
-    return {
-        "analisisSemanal": {
-            "totalCalorias": round(total_calorias_semana, 2),
-            "promedioCaloriasDia": promedio_calorias_dia,
-            "diasConDatos": dias_con_datos_validos,
-            "macronutrientes": {
-                "total_proteinas_g": round(total_proteinas_semana, 2),
-                "promedio_proteinas_g_dia": promedio_proteinas_dia,
-                "total_grasas_g": round(total_grasas_semana, 2),
-                "promedio_grasas_g_dia": promedio_grasas_dia,
-                "total_carbohidratos_g": round(total_carbohidratos_semana, 2),
-                "promedio_carbohidratos_g_dia": promedio_carbohidratos_dia,
-            }
-        },
-        "analisisDiario": dict(analisis_diario_filtrado)
-    }
+# Mismo análisis para varias semanas enviadas por el cliente (planes de más de una semana)
+@app.post("/analisis-micronutrientes")
+def analisis_micronutrientes(
+    payload: schemas.MicronutrientAnalysisRequest,
+    current_user: User = Depends(auth.get_current_user)
+):
+    weeks = []
+    for i, menu in enumerate(payload.menus, start=1):
+        try:
+            weeks.append(saved_menu_days(menu))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Menú {i} no válido: {e}")
+    calorias = daily_target_calories_for_user(current_user, payload.calorias_referencia)
+    return micronutrients.analyze_weeks(weeks, calorias)
 
 @app.patch("/actualizar-perfil")
 def actualizar_parcial_perfil(
@@ -284,66 +327,6 @@ def update_user_info(
     db.commit()
     return {"message": "Información actualizada correctamente"}
 
-def clean_ingredient(raw: str):
-    import re
-
-    # Diccionario para corregir errores comunes
-    corrections = {
-        "arlic": "garlic",
-        "iol": "oil",
-        "rapes": "grapes",
-        "tumeric": "turmeric",
-        "/head cauliflower": "cauliflower",
-        "juice /lime": "lime juice",
-        "caldo de pollo": "chicken broth",
-        "white/white wine vinegar": "white wine vinegar"
-    }
-
-    # Frases que no deben considerarse ingredientes
-    discard_phrases = [
-        "for brushing vegetables", "into inch florets", "into /inchthick slices",
-        "yield once processed", "with brush stems", "with tails thawed",
-        "the root thinly", "halved lengthways thin", "into small cubes",
-        "into inch pieces", "ribs seeds thinly"
-    ]
-
-    raw = raw.strip().lower()
-
-    # Corregir errores ortográficos
-    for wrong, right in corrections.items():
-        raw = raw.replace(wrong, right)
-
-    # Eliminar frases no relevantes
-    for phrase in discard_phrases:
-        if phrase in raw:
-            return None, 0, ""
-
-    # Limpieza general
-    raw = re.sub(r"[\*\-]", "", raw)
-    raw = re.sub(r"\([^)]*\)", "", raw)
-    raw = re.sub(r"\b(optional|to taste|as desired|depending.*|divided)\b", "", raw)
-    raw = re.sub(r"\b(can|cup|cups|tbsp|tsp|oz|ounce|tablespoon|teaspoon|g|kg|ml|l|container|pkg|bunch|head)\b", "", raw)
-    raw = re.sub(r"\d+\.?\d*\s?(oz|g|ml|kg|lb|cup|cups|tbsp|tsp|tablespoon|teaspoon|container|pkg)?", "", raw)
-    raw = re.sub(r",", "", raw)
-
-    words = raw.split()
-    if not words:
-        return "unknown", 1.0, ""
-
-    # Filtrado de palabras útiles
-    ignore_words = {
-        "and", "or", "with", "cut", "sliced", "diced", "peeled", "each", "few",
-        "shakes", "removed", "washed", "dry", "dried", "thinly", "minced", "chopped"
-    }
-
-    keywords = [w for w in words if len(w) > 2 and w not in ignore_words]
-
-    # Heurística para formar el nombre del ingrediente
-    name = " ".join(keywords[-3:]) if keywords else "unknown"
-
-    return name.strip(), 1.0, ""
-
-
 class ShoppingListRequestPayload(BaseModel):
     # menu: Dict[str, Dict[str, RecipeOption]] # Si RecipeOption es el modelo Pydantic
     # O si el frontend envía un JSON genérico que se parece a RecipeOption:
@@ -351,42 +334,66 @@ class ShoppingListRequestPayload(BaseModel):
 
 @app.post("/generate-shopping-list")
 async def generate_shopping_list_endpoint(payload: ShoppingListRequestPayload):
-    # Tu defaultdict original
-    # shopping_dict = defaultdict(float) -> Cambiado para manejar unidades
-    aggregated_ingredients: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"quantity": 0.0, "units": set()})
-
-    # Acceder a `payload.menu` en lugar de `menu.get("menu", {})`
-    selected_menu_data = payload.menu
-
-    for dia, comidas_del_dia in selected_menu_data.items():
-        for tipo_comida, receta_seleccionada_data in comidas_del_dia.items():
-            # receta_seleccionada_data es un diccionario que debe tener 'ingredients'
-            if receta_seleccionada_data and isinstance(receta_seleccionada_data.get("ingredients"), list):
-                for raw_ingredient_line in receta_seleccionada_data["ingredients"]:
-                    if isinstance(raw_ingredient_line, str): # Asegurar que es una string
-                        name, qty, unit = clean_ingredient(raw_ingredient_line)
-                        if name and name != "unknown": # Ignorar ingredientes no parseados
-                            # Clave para agregar podría ser solo el nombre si manejas unidades de otra forma
-                            # key = f"{name} ({unit})" if unit else name # Tu forma original
-                            # shopping_dict[key] += qty # Tu forma original
-
-                            # Nueva forma para agregar unidades
-                            aggregated_ingredients[name]["quantity"] += qty
-                            if unit: # Añadir la unidad si existe
-                                aggregated_ingredients[name]["units"].add(unit)
-                    # else: print(f"Advertencia: ingrediente no es string: {raw_ingredient_line}")
-            # else: print(f"Advertencia: No hay ingredientes para {dia}-{tipo_comida} o no es una lista.")
-
-    # Formatear la salida final
-    final_list: Dict[str, Dict[str, Any]] = {}
-    for name, data in aggregated_ingredients.items():
-        unit_str = ", ".join(sorted(list(data["units"]))) if data["units"] else "unidad(es)"
-        final_list[name] = {
-            "amount": round(data["quantity"], 2),
-            "unit": unit_str
-        }
-    
-    return dict(sorted(final_list.items())) # Ordenar por nombre de ingrediente
+    return build_shopping_list(payload.menu)
+
+
+# Lista de la compra construida en el servidor a partir del menú guardado (sin reenviar el menú)
+@app.get("/lista-compra")
+def obtener_lista_compra(
+    desde: Optional[str] = None, # Día inicial del rango (ej. "lunes"), incluido
+    hasta: Optional[str] = None, # Día final del rango (ej. "miercoles"), incluido
+    db: Session = Depends(auth.get_read_db),
+    current_user: User = Depends(auth.get_current_user_read)
+):
+    version = menu_version(current_user.last_generated_menu_json)
+    if not version:
+        raise HTTPException(status_code=404, detail="No hay menú guardado.")
+
+    cache_key = (current_user.id, version, desde, hasta)
+    cached_list = shopping_list_cache.get(cache_key)
+    if cached_list is not None:
+        return cached_list
+
+    try:
+        menu_items = saved_menu_days(recipe_store.load_saved_menu(db, current_user.last_generated_menu_json))
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=f"Error al leer el menú guardado: {e}")
+    try:
+        menu_items = filter_day_range(menu_items, desde, hasta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    shopping_list = build_shopping_list(selected_recipes_by_day(menu_items))
+    shopping_list_cache.set(cache_key, shopping_list)
+    return shopping_list
+
+
+# Agregación por lotes (meal-prep / B2B): listas de la compra y nutrición de muchos menús a la vez
+BATCH_API_TOKEN = os.getenv("BATCH_API_TOKEN")
+
+@app.post("/batch/agregados")
+def agregados_por_lotes(
+    payload: schemas.BatchAggregationRequest,
+    x_batch_token: Optional[str] = Header(None)
+):
+    if not BATCH_API_TOKEN or x_batch_token != BATCH_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Token de lotes inválido o API de lotes deshabilitada.")
+    if payload.user_ids is None and payload.menus is None:
+        raise HTTPException(status_code=400, detail="Indica 'user_ids' o 'menus'.")
+
+    def ndjson_lines():
+        db = database.SessionLocal()
+        try:
+            if payload.user_ids is not None:
+                menus_source = iter_saved_menus(db, payload.user_ids, chunk_size=payload.chunk_size)
+            else:
+                menus_source = iter_payload_menus(payload.menus)
+            for line in stream_aggregation(menus_source, payload.incluir_listas_por_menu, payload.chunk_size):
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
 
 
 def calcular_bmr(sexo: str, peso: float, altura: float, edad: int) -> int:
@@ -404,15 +411,88 @@ class PromptInput(BaseModel):
 @app.post("/ia/alternativa")
 async def get_alternativa(data: PromptInput):
     try:
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        response = model.generate_content(f"Eres un nutricionista experto en hacer recetas saludables. Usuario: {data.prompt}. Responde con una receta alternativa más saludable, enfocada en reducir calorías, grasas y azúcares. Incluye información nutricional detallada total(calorías, grasas, azúcares) y las diferencias con la receta tradicional.")
-        return {"resultado": response.text}
+        # Cliente reutilizado, llamada asíncrona, límite de concurrencia y caché por prompt normalizado
+        resultado = await gemini_service.generar_alternativa(data.prompt)
+        return {"resultado": resultado}
     except Exception as e:
         return {
             "error": "Error al generar contenido con Google Gemini",
             "detalle": str(e)
         }
 
+@app.post("/ia/alternativa/stream")
+async def get_alternativa_stream(data: PromptInput, request: Request, formato: str = "sse"):
+    """
+    Igual que /ia/alternativa pero enviando los trozos según los genera Gemini.
+    formato="sse" (Server-Sent Events, por defecto) o "texto" (texto plano por chunks).
+    """
+    if formato not in ("sse", "texto"):
+        raise HTTPException(status_code=400, detail="formato debe ser 'sse' o 'texto'")
+    inicio = time.perf_counter()
+
+    async def trozos():
+        primer_trozo = True
+        try:
+            async with contextlib.aclosing(gemini_service.stream_alternativa(data.prompt)) as partes:
+                async for parte in partes:
+                    if await request.is_disconnected():
+                        # Al salir, aclosing suelta el stream; si no queda nadie leyéndolo se cancela la generación
+                        metrics.inc("gemini_stream_cancelled")
+                        return
+                    if primer_trozo:
+                        metrics.observe("gemini_stream_ttfb_seconds", time.perf_counter() - inicio)
+                        primer_trozo = False
+                    yield f"data: {json.dumps({'texto': parte}, ensure_ascii=False)}\n\n" if formato == "sse" else parte
+            metrics.observe("gemini_stream_total_seconds", time.perf_counter() - inicio)
+            if formato == "sse":
+                yield "event: fin\ndata: {}\n\n"
+        except asyncio.CancelledError:
+            metrics.inc("gemini_stream_cancelled")
+            raise
+        except Exception as e:
+            metrics.inc("gemini_stream_errors")
+            error = {"error": "Error al generar contenido con Google Gemini", "detalle": str(e)}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n" if formato == "sse" else f"\n[{error['error']}: {error['detalle']}]"
+
+    media_type = "text/event-stream" if formato == "sse" else "text/plain; charset=utf-8"
+    return StreamingResponse(trozos(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/metricas")
+def obtener_metricas():
+    # Carga y enfriamiento de cada credencial de Edamam (sin las claves) y estado del control de admisión
+    return dict(metrics.snapshot(), edamam_credenciales=edamam_keys.key_pool.status(), admision=admission.status())
+
+
+# Perfiles guardados por el middleware de perfilado (los más lentos y los últimos)
+@app.get("/perfilado")
+def listar_perfiles(x_profile: Optional[str] = Header(None)):
+    if not profiling.is_authorized(x_profile):
+        raise HTTPException(status_code=403, detail="Token de perfilado inválido o perfilado deshabilitado.")
+    return profiling.store.summary()
+
+
+@app.get("/perfilado/{perfil_id}")
+def obtener_perfil(perfil_id: str, formato: str = "texto", x_profile: Optional[str] = Header(None)):
+    """formato="texto": pstats legible o pilas colapsadas (flamegraph); formato="pstats": fichero para pstats/snakeviz."""
+    if not profiling.is_authorized(x_profile):
+        raise HTTPException(status_code=403, detail="Token de perfilado inválido o perfilado deshabilitado.")
+    perfil = profiling.store.get(perfil_id)
+    if perfil is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    if formato == "pstats":
+        if perfil["pstats"] is None:
+            raise HTTPException(status_code=400, detail="Solo los perfiles en modo cprofile tienen formato pstats.")
+        return Response(perfil["pstats"], media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{perfil_id}.pstats"'})
+    return Response(perfil["texto"], media_type="text/plain; charset=utf-8")
+
+
+# Tiempos de importación/inicialización por subsistema y presupuesto de arranque en frío
+@app.get("/salud/arranque")
+def obtener_informe_arranque():
+    return startup.report()
+
 # Ruta para guardar el menú del usuario
 @app.post("/guardar-menu")
 def guardar_menu_usuario(menu: dict, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
@@ -420,8 +500,8 @@ def guardar_menu_usuario(menu: dict, db: Session = Depends(get_db), current_user
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     try:
-        #menu_string = str(menu)
-        user.last_generated_menu_json = json.dumps(menu)
+        # Las recetas se guardan una sola vez en la tabla `recipes`; el menú solo guarda sus ids
+        user.last_generated_menu_json = json.dumps(recipe_store.dehydrate_menu(db, menu))
         db.commit()
         return {"message": "Menú guardado correctamente."}
     except Exception as e:
@@ -430,10 +510,15 @@ def guardar_menu_usuario(menu: dict, db: Session = Depends(get_db), current_user
         raise HTTPException(status_code=500, detail=f"Error al guardar el menú: {e}")
 # Ruta para obtener el menú guardado del usuario
 @app.get("/menu-guardado")
-def obtener_menu_guardado(db: Session = Depends(get_db), user: User = Depends(auth.get_current_user)):
+def obtener_menu_guardado(request: Request, response: Response, db: Session = Depends(auth.get_read_db), user: User = Depends(auth.get_current_user_read)):
+    etag = _etag("menu", user)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    _set_cache_headers(response, etag)
     if not user.last_generated_menu_json:
         raise HTTPException(status_code=404, detail="No hay menú guardado.")
-    return json.loads(user.last_generated_menu_json)
+    return recipe_store.load_saved_menu(db, user.last_generated_menu_json)
 
 
 @app.post("/marcar-favorita")
@@ -447,11 +532,12 @@ def marcar_receta_favorita(
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
     try:
-        favoritas = json.loads(user.recetas_favoritas)
+        favoritas = recipe_store.hydrate_favorites(db, json.loads(user.recetas_favoritas))
         if request.receta not in favoritas:
             favoritas.append(request.receta)
-            user.recetas_favoritas = json.dumps(favoritas)
+            user.recetas_favoritas = json.dumps(recipe_store.dehydrate_favorites(db, favoritas))
             db.commit()
+            recommender.update_user_taste(user.id, favoritas, user.recetas_favoritas)
         return {"message": "Receta marcada como favorita correctamente."}
     except Exception as e:
         db.rollback()
@@ -459,13 +545,20 @@ def marcar_receta_favorita(
 
 @app.get("/favoritas", response_model=FavoritasResponse)
 def obtener_recetas_favoritas(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(auth.get_current_user)
+    request: Request,
+    response: Response,
+    db: Session = Depends(auth.get_read_db),
+    current_user: User = Depends(auth.get_current_user_read)
 ):
+    etag = _etag("favoritas", current_user)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    _set_cache_headers(response, etag)
     if not current_user.recetas_favoritas:
         return {"favoritas": []}
     try:
-        favoritas = json.loads(current_user.recetas_favoritas)
+        favoritas = recipe_store.load_favorites(db, current_user.recetas_favoritas)
         return {"favoritas": favoritas}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al cargar favoritas: {e}")
@@ -477,15 +570,15 @@ async def guardar_favorita(recipe: dict,db: Session = Depends(get_db), current_u
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
     try:
-        if not user.recetas_favoritas:
-            user.recetas_favoritas = []
-        elif isinstance(user.recetas_favoritas, str):
-            user.recetas_favoritas = json.loads(user.recetas_favoritas)
-        print(f"sale : ",user.recetas_favoritas)
-        user.recetas_favoritas.append(recipe)
-        user.recetas_favoritas = json.dumps(user.recetas_favoritas)
+        # Lista local (no en el atributo del modelo): las consultas a `recipes` hacen autoflush del usuario
+        favoritas_guardadas = json.loads(user.recetas_favoritas) if user.recetas_favoritas else []
+        print(f"sale : ",favoritas_guardadas)
+        favoritas_guardadas.append(recipe)
+        favoritas = recipe_store.hydrate_favorites(db, favoritas_guardadas)
+        user.recetas_favoritas = json.dumps(recipe_store.dehydrate_favorites(db, favoritas_guardadas))
         print(f"sale despues : ",user.recetas_favoritas)
         db.commit()
+        recommender.update_user_taste(user.id, favoritas, user.recetas_favoritas)
         print(f"se guarda : ")
         return {"message": "Receta guardada como favorita"}
     except Exception as e:
@@ -505,7 +598,7 @@ async def eliminar_favorita(recipe: dict,db: Session = Depends(get_db), current_
     user_favorites_list = []
     if db_user.recetas_favoritas: # Cargar desde el campo de la instancia de BD
         try:
-            parsed_favorites = json.loads(db_user.recetas_favoritas)
+            parsed_favorites = recipe_store.hydrate_favorites(db, json.loads(db_user.recetas_favoritas))
             if isinstance(parsed_favorites, list):
                 user_favorites_list = parsed_favorites
             else:
@@ -541,7 +634,7 @@ async def eliminar_favorita(recipe: dict,db: Session = Depends(get_db), current_
 
         # Actualizar el campo de db_user con la nueva lista (convertida a JSON string)
         print(f"[DEBUG] Usuario: {current_user.username}. Lista de favoritos (Python list) ANTES de json.dumps y guardar en db_user: {recetas_actualizadas_python_list}")
-        db_user.recetas_favoritas = json.dumps(recetas_actualizadas_python_list)
+        db_user.recetas_favoritas = json.dumps(recipe_store.dehydrate_favorites(db, recetas_actualizadas_python_list))
         print(f"[DEBUG] Usuario: {current_user.username}. db_user.recetas_favoritas (JSON string) DESPUÉS de json.dumps, lista para guardar: {db_user.recetas_favoritas}")
     
     else:
@@ -557,6 +650,7 @@ async def eliminar_favorita(recipe: dict,db: Session = Depends(get_db), current_
         db.add(db_user) # Asegura que la instancia db_user (con sus cambios) está en la sesión.
         db.commit()
         db.refresh(db_user) 
+        recommender.update_user_taste(db_user.id, recetas_actualizadas_python_list, db_user.recetas_favoritas)
         print(f"Usuario: {current_user.username}. Favoritos guardados correctamente en la DB. Contenido de db_user.recetas_favoritas después de commit: {db_user.recetas_favoritas}")
         # El mensaje de retorno debe ser consistente con lo que espera el frontend.
         # Si la receta no se encontró, el estado de la UI ya se actualizó optimisticamente.
@@ -579,27 +673,27 @@ class RecommendedMenuRequestPayload(BaseModel):
 async def generar_menu_recomendado_endpoint(
     payload: RecommendedMenuRequestPayload, # Usar el nuevo modelo para el payload
     db: Session = Depends(get_db), 
-    current_user: User = Depends(auth.get_current_user) # Asegurar que es models.User
+    current_user: User = Depends(auth.get_current_user), # Asegurar que es models.User
+    x_deadline_seconds: Optional[str] = Header(None),
 ):
     try:
         # La importación diferida puede quedarse o moverse al inicio del archivo si prefieres
         # from app.services.menu_generator import generate_recommended_weekly_menu 
         
-        default_meals = ["desayuno", "comida", "cena"]
-        default_meal_ratios = {"desayuno": 0.30, "comida": 0.40, "cena": 0.30}
-        num_options_per_meal = 3
-
         print(f"Payload recibido en /generar-menu-recomendado: {payload}") # Log para ver qué llega
 
-        menu_dict = generate_recommended_weekly_menu(
+        menu = await run_in_threadpool(
+            profiling.call_profiled,
+            generate_recommended_weekly_menu,
             user=current_user,
             db_session=db,
-            meals_config=default_meals,
-            ratios_config=default_meal_ratios,
-            num_options=num_options_per_meal,
-            target_calories_override=payload.target_calories # Pasar las calorías del payload
+            meals_config=RECOMMENDED_MEALS,
+            ratios_config=RECOMMENDED_MEAL_RATIOS,
+            num_options=RECOMMENDED_NUM_OPTIONS,
+            target_calories_override=payload.target_calories, # Pasar las calorías del payload
+            deadline=deadline.request_deadline(x_deadline_seconds),
         )
-        return menu_dict
+        return _menu_response(menu)
     except ValueError as ve:
         print(f"ValueError en generar_menu_recomendado_endpoint: {ve}")
         raise HTTPException(status_code=400, detail=str(ve))
@@ -607,3 +701,76 @@ async def generar_menu_recomendado_endpoint(
         print(f"Error inesperado generando menú recomendado: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error interno del servidor al generar el menú recomendado.")
 
+
+
+
+class RegenerateDayPayload(BaseModel):
+    dia: str # Ej. "lunes", "miércoles"
+    recomendado: bool = False # True: lógica de /generar-menu-recomendado; False: la de /generate-weekly-menu
+    menu_request: Optional[MenuRequest] = None # Obligatorio si recomendado es False
+    target_calories: Optional[int] = Field(None, gt=0) # Solo para recomendado
+    excluir_urls: List[str] = Field(default_factory=list) # URLs extra a evitar, además de las del menú guardado
+
+class RegenerateMealPayload(RegenerateDayPayload):
+    comida: str # Ej. "cena"
+
+
+def _regenerar(payload: RegenerateDayPayload, current_user: User, db: Session, meals: Optional[List[str]] = None,
+               x_deadline_seconds: Optional[str] = None):
+    try:
+        menu_deadline = deadline.request_deadline(x_deadline_seconds)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    dia = normalize_day_name(payload.dia)
+    if dia not in DIAS_SEMANA:
+        raise HTTPException(status_code=400, detail=f"Día no válido: '{payload.dia}'")
+    if not payload.recomendado and payload.menu_request is None:
+        raise HTTPException(status_code=400, detail="Falta 'menu_request' (o usa recomendado=true).")
+    if meals is None:
+        meals = RECOMMENDED_MEALS if payload.recomendado else payload.menu_request.meals
+
+    # Evitar repetir recetas que ya están en el menú actual del usuario
+    exclude_urls = set(payload.excluir_urls)
+    if current_user.last_generated_menu_json:
+        try:
+            exclude_urls |= recipe_urls_in_menu(saved_menu_days(recipe_store.load_saved_menu(db, current_user.last_generated_menu_json)))
+        except ValueError as e:
+            print(f"Menú guardado ilegible al regenerar ({current_user.username}): {e}")
+
+    try:
+        menu = regenerate_slots(
+            dia, meals, exclude_urls,
+            base_request=payload.menu_request,
+            user=current_user,
+            recommended=payload.recomendado,
+            ratios_config=RECOMMENDED_MEAL_RATIOS,
+            num_options=RECOMMENDED_NUM_OPTIONS,
+            target_calories_override=payload.target_calories,
+            db_session=db,
+            deadline=menu_deadline,
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    return _menu_response(menu, exclude_none=True)
+
+
+# Regenerar un solo día del menú (una búsqueda por comida en lugar de las de toda la semana)
+@app.post("/regenerar-dia", response_model=WeeklyMenuWithOptionsResponse, response_model_exclude_none=True)
+def regenerar_dia_endpoint(
+    payload: RegenerateDayPayload,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+    x_deadline_seconds: Optional[str] = Header(None),
+):
+    return _regenerar(payload, current_user, db, x_deadline_seconds=x_deadline_seconds)
+
+
+# Regenerar una sola comida de un día
+@app.post("/regenerar-comida", response_model=WeeklyMenuWithOptionsResponse, response_model_exclude_none=True)
+def regenerar_comida_endpoint(
+    payload: RegenerateMealPayload,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(auth.get_current_user),
+    x_deadline_seconds: Optional[str] = Header(None),
+):
+    return _regenerar(payload, current_user, db, meals=[payload.comida], x_deadline_seconds=x_deadline_seconds)
@@ -20,6 +20,8 @@ class MenuRequest(BaseModel):
         default_factory=lambda: {"desayuno": 0.3, "comida": 0.4, "cena": 0.3},
         description="Proporción calórica para cada comida (ej. {'desayuno': 0.3, ...}). Debe sumar 1.0"
     )
+    # Elige entre los menús ya generados para la misma petición (ver app/services/menu_cache.py)
+    variety_seed: Optional[int] = Field(None, ge=0, description="Semilla de variedad: mismo valor, mismo menú cacheado")
 
 
 
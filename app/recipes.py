@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, String, Text
+from .base import Base
+
+class Recipe(Base):
+    __tablename__ = "recipes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # uri de Edamam (o la url si no hay uri): la misma receta guardada por muchos usuarios, en
+    # menús o en favoritos, es una sola fila
+    uri = Column(String, unique=True, index=True, nullable=False)
+    # Solo los campos estables (recipe_store.STABLE_FIELDS); lo que cambia entre búsquedas va en la referencia
+    data = Column(Text, nullable=False)
@@ -43,6 +43,7 @@ class RecipeOption(BaseModel):
     label: str
     image: Optional[str] = None
     url: str
+    uri: Optional[str] = None # Identificador estable de Edamam (clave de la tabla de recetas)
     ingredients: List[str] = Field(description="Lista de líneas de ingredientes como strings")
     calories: float # Calorías por ración de la receta
     protein_g: Optional[float] = None
@@ -97,3 +98,15 @@ class FavoritasResponse(BaseModel):
 
 
 
+class BatchAggregationRequest(BaseModel):
+    # Indicar uno de los dos: ids de usuarios (se usa su menú guardado) o menús completos
+    user_ids: Optional[List[int]] = None
+    menus: Optional[List[Dict[str, Any]]] = Field(None, description="Menús con el formato guardado: {'id': ..., 'menu': {día: {comida: {...}}}}")
+    incluir_listas_por_menu: bool = False
+    chunk_size: int = Field(500, ge=1, le=10000)
+
+
+class MicronutrientAnalysisRequest(BaseModel):
+    # Varias semanas seguidas (p. ej. un plan mensual); los días se numeran por semana en la respuesta
+    menus: List[Dict[str, Any]] = Field(..., min_length=1, max_length=52, description="Menús semanales en orden, con el formato guardado: {'menu': {día: {comida: {...}}}}")
+    calorias_referencia: Optional[int] = Field(None, gt=0, le=10000, description="Calorías diarias para ajustar las referencias de energía y macros (por defecto, las del perfil)")
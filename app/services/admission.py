@@ -0,0 +1,238 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services import metrics
+from app.services.cache import TTLCache
+
+# Control de admisión de los endpoints caros, dentro del proceso. Para cada clase de endpoint:
+#  - cubo de tokens por cliente (usuario del token o, sin token, IP): ráfaga BURST, RATE por segundo
+#  - límite global de peticiones en curso (CONCURRENCY) con cola justa entre clientes: al liberarse
+#    un hueco se atiende al siguiente cliente en turno rotatorio, no a quien más peticiones encoló
+#  - 429 con Retry-After si el cubo está vacío, el cliente ya tiene su cola llena o la espera se agota
+# Así un usuario que abusa agota su propio cubo y su cola, y el resto sigue con la latencia de siempre.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+ADMISSION_MAX_QUEUED_PER_CLIENT = int(os.getenv("ADMISSION_MAX_QUEUED_PER_CLIENT", "2"))
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+# Detrás de un proxy de confianza, la IP del cliente es la primera de X-Forwarded-For
+ADMISSION_TRUST_FORWARDED = os.getenv("ADMISSION_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+
+# clase -> (rutas, peticiones/s por cliente, ráfaga, concurrencia global)
+CLASS_DEFAULTS: Dict[str, Tuple[Tuple[str, ...], float, float, int]] = {
+    "generacion": (("/generate-weekly-menu", "/generar-menu-recomendado", "/regenerar-dia", "/regenerar-comida"), 0.2, 5, 4),
+    "ia": (("/ia/alternativa", "/ia/alternativa/stream"), 0.1, 3, 2),
+    "auth": (("/login", "/register"), 0.5, 10, 2),  # bcrypt: CPU
+}
+
+
+def _class_setting(clase: str, name: str, default: float) -> float:
+    return float(os.getenv(f"ADMISSION_{clase.upper()}_{name}", str(default)))
+
+
+class TokenBuckets:
+    """Cubos de tokens por clave, creados llenos en su primer uso y olvidados al rellenarse del todo."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = ADMISSION_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        # Un cubo sin uso durante burst/rate segundos está lleno: da igual olvidarlo
+        self._buckets = TTLCache(max_entries=max_keys, ttl_seconds=burst / rate if rate > 0 else None)
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """0 si hay token (y lo consume); si no, segundos hasta el siguiente."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets.set(key, (tokens - 1, now))
+                return 0.0
+            self._buckets.set(key, (tokens, now))
+            return (1 - tokens) / self.rate
+
+
+class FairLimiter:
+    """
+    Semáforo con cola por cliente. Al liberarse un hueco pasa directamente al primer cliente en
+    turno (rotatorio), que se vuelve a poner al final si le quedan peticiones esperando.
+    Se usa solo desde el event loop, así que no necesita cerrojos.
+    """
+
+    def __init__(self, capacity: int, max_queued_per_client: int = ADMISSION_MAX_QUEUED_PER_CLIENT):
+        self.capacity = capacity
+        self.max_queued_per_client = max_queued_per_client
+        self.active = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()  # cliente -> futures en espera
+        self._hold_seconds = 1.0  # Media móvil de lo que dura una petición, para el Retry-After
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def acquire(self, client: str, timeout: float) -> bool:
+        if self.active < self.capacity and not self._queues:
+            self.active += 1
+            return True
+        queue = self._queues.get(client)
+        if queue is not None and len(queue) >= self.max_queued_per_client:
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client, deque()).append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            if future.done():
+                return True  # El hueco llegó justo al agotarse la espera
+            future.cancel()
+            self._forget(client, future)
+            return False
+        except asyncio.CancelledError:  # El cliente se desconectó mientras esperaba
+            if future.done() and not future.cancelled():
+                self.release(0.0)
+            else:
+                future.cancel()
+                self._forget(client, future)
+            raise
+
+    def _forget(self, client: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(client)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[client]
+
+    def release(self, held_seconds: float) -> None:
+        if held_seconds:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held_seconds
+        while self._queues:
+            client, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            if not future.done():
+                future.set_result(True)  # El hueco pasa al siguiente sin tocar `active`
+                return
+        self.active -= 1
+
+    def retry_after(self) -> float:
+        """Estimación de cuándo habrá hueco: las peticiones por delante entre la concurrencia."""
+        return self._hold_seconds * (self.queued() + 1) / max(1, self.capacity)
+
+
+class EndpointClass:
+    __slots__ = ("name", "paths", "buckets", "limiter")
+
+    def __init__(self, name: str, paths: Tuple[str, ...], rate: float, burst: float, concurrency: int):
+        self.name = name
+        self.paths = paths
+        self.buckets = TokenBuckets(rate, max(1.0, burst))
+        self.limiter = FairLimiter(max(1, concurrency))
+
+
+def _load_classes() -> Dict[str, EndpointClass]:
+    classes = {}
+    for name, (paths, rate, burst, concurrency) in CLASS_DEFAULTS.items():
+        classes[name] = EndpointClass(
+            name,
+            paths,
+            _class_setting(name, "RATE", rate),
+            _class_setting(name, "BURST", burst),
+            int(_class_setting(name, "CONCURRENCY", concurrency)),
+        )
+    return classes
+
+
+classes = _load_classes()
+_by_path = {path: c for c in classes.values() for path in c.paths}
+
+
+def client_id(scope: Dict[str, Any]) -> str:
+    """Usuario del token Bearer si es válido; si no, la IP del cliente."""
+    headers = dict(scope.get("headers") or [])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if authorization.lower().startswith("bearer "):
+        from app.auth import decode_access_token
+
+        payload = decode_access_token(authorization[7:].strip())
+        if payload and payload.get("sub"):
+            return f"usuario:{payload['sub']}"
+    if ADMISSION_TRUST_FORWARDED and b"x-forwarded-for" in headers:
+        return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'desconocida'}"
+
+
+def status() -> List[Dict[str, Any]]:
+    return [
+        {
+            "clase": c.name,
+            "en_curso": c.limiter.active,
+            "en_cola": c.limiter.queued(),
+            "concurrencia": c.limiter.capacity,
+            "peticiones_por_s": c.buckets.rate,
+            "rafaga": c.buckets.burst,
+        }
+        for c in classes.values()
+    ]
+
+
+async def _reject(send, clase: str, motivo: str, retry_after: float) -> None:
+    metrics.inc("admission_rejected", labels={"clase": clase, "motivo": motivo})
+    body = json.dumps({"detail": "Demasiadas peticiones, inténtalo más tarde."}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI: aplica el control de admisión a las rutas de CLASS_DEFAULTS; el resto pasa sin coste."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        endpoint = _by_path.get(scope.get("path")) if scope["type"] == "http" else None
+        if endpoint is None or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        client = client_id(scope)
+        wait = endpoint.buckets.take(client)
+        if wait:
+            await _reject(send, endpoint.name, "cubo", wait)
+            return
+
+        t0 = time.perf_counter()
+        if not await endpoint.limiter.acquire(client, ADMISSION_QUEUE_TIMEOUT_SECONDS):
+            await _reject(send, endpoint.name, "cola", endpoint.limiter.retry_after())
+            return
+        metrics.observe("admission_wait_seconds", time.perf_counter() - t0, labels={"clase": endpoint.name})
+
+        t1 = time.perf_counter()
+        try:
+            # Incluye el envío de la respuesta: un stream de la IA ocupa su hueco hasta terminar
+            await self.app(scope, receive, send)
+        finally:
+            endpoint.limiter.release(time.perf_counter() - t1)
@@ -0,0 +1,312 @@
+import itertools
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services import recipe_store
+from app.services.saved_menu import saved_menu_days, selected_recipe
+from app.services.shopping_list import clean_ingredient
+
+# Columnas de la matriz de nutrición (valores por ración de cada receta seleccionada)
+NUTRITION_COLUMNS = ("calories", "protein_g", "fat_g", "carbs_g")
+CAL, PROT, FAT, CARBS = range(len(NUTRITION_COLUMNS))
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _average(total: float, dias: int) -> float:
+    return round(total / dias, 2) if dias > 0 else 0.0
+
+
+class BatchAggregator:
+    """
+    Agrega listas de la compra y nutrición (calorías/macros) para muchos menús a la vez.
+
+    Cada lote de menús se aplana en arrays (receta -> día -> menú, ingrediente -> menú) y los
+    totales se calculan con `np.bincount`, de modo que el coste es lineal en el número de recetas.
+    El vocabulario de ingredientes y los totales consolidados se mantienen entre lotes.
+    """
+
+    def __init__(self, per_menu_shopping_list: bool = False):
+        self.per_menu_shopping_list = per_menu_shopping_list
+        self.ingredient_index: Dict[str, int] = {}
+        self.ingredient_names: List[str] = []
+        self.ingredient_units: List[set] = []
+        self.ingredient_totals = np.zeros(0)
+        self.nutrition_totals = np.zeros(len(NUTRITION_COLUMNS))
+        self.menus_processed = 0
+        self.days_with_data = 0
+
+    def _ingredient_id(self, name: str, unit: str) -> int:
+        idx = self.ingredient_index.get(name)
+        if idx is None:
+            idx = len(self.ingredient_names)
+            self.ingredient_index[name] = idx
+            self.ingredient_names.append(name)
+            self.ingredient_units.append(set())
+        if unit:
+            self.ingredient_units[idx].add(unit)
+        return idx
+
+    def _format_list(self, ids: np.ndarray, amounts: np.ndarray) -> Dict[str, Dict[str, Any]]:
+        items = {}
+        for idx, amount in zip(ids.tolist(), amounts.tolist()):
+            units = self.ingredient_units[idx]
+            items[self.ingredient_names[idx]] = {
+                "amount": round(amount, 2),
+                "unit": ", ".join(sorted(units)) if units else "unidad(es)",
+            }
+        return dict(sorted(items.items()))
+
+    def process_chunk(self, menus: Sequence[Tuple[Any, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Procesa un lote de (id, menú) donde menú es Día -> TipoComida -> slot guardado o receta.
+        Devuelve un resultado por menú con el mismo formato que /perfil/analisis-nutricional
+        (y su lista de la compra si `per_menu_shopping_list`).
+        """
+        n_menus = len(menus)
+        day_menu: List[int] = []
+        day_names: List[str] = []
+        recipe_day: List[int] = []
+        recipe_values: List[float] = []
+        ingredient_menu: List[int] = []
+        ingredient_ids: List[int] = []
+        ingredient_qty: List[float] = []
+
+        # 1. Aplanar los menús (único bucle en Python, proporcional al número de recetas)
+        for m, (_, menu_items) in enumerate(menus):
+            for dia_nombre, comidas_del_dia in menu_items.items():
+                if not isinstance(comidas_del_dia, dict):
+                    continue
+                day_id = len(day_menu)
+                day_menu.append(m)
+                day_names.append(dia_nombre)
+                for slot_comida in comidas_del_dia.values():
+                    receta = selected_recipe(slot_comida)
+                    if not receta:
+                        continue
+                    recipe_day.append(day_id)
+                    recipe_values.extend(_to_float(receta.get(col)) for col in NUTRITION_COLUMNS)
+                    ingredientes = receta.get("ingredients")
+                    if not isinstance(ingredientes, list):
+                        continue
+                    for raw_ingredient_line in ingredientes:
+                        if not isinstance(raw_ingredient_line, str):
+                            continue
+                        name, qty, unit = clean_ingredient(raw_ingredient_line)
+                        if name and name != "unknown":
+                            ingredient_menu.append(m)
+                            ingredient_ids.append(self._ingredient_id(name, unit))
+                            ingredient_qty.append(qty)
+
+        # 2. Nutrición: recetas -> días -> menús con bincount por columna
+        n_days = len(day_menu)
+        values = np.asarray(recipe_values, dtype=float).reshape(-1, len(NUTRITION_COLUMNS))
+        recipe_day_arr = np.asarray(recipe_day, dtype=np.intp)
+        day_menu_arr = np.asarray(day_menu, dtype=np.intp)
+
+        valid = values[:, CAL] > 0 # Solo cuentan recetas con calorías (datos válidos)
+        valid_days = recipe_day_arr[valid]
+        day_totals = np.column_stack([
+            np.bincount(valid_days, weights=values[valid, k], minlength=n_days)
+            for k in range(len(NUTRITION_COLUMNS))
+        ]) if n_days else np.zeros((0, len(NUTRITION_COLUMNS)))
+        day_has_data = np.bincount(valid_days, minlength=n_days) > 0
+        menu_totals = np.column_stack([
+            np.bincount(day_menu_arr, weights=day_totals[:, k], minlength=n_menus)
+            for k in range(len(NUTRITION_COLUMNS))
+        ]) if n_menus else np.zeros((0, len(NUTRITION_COLUMNS)))
+        menu_days = np.bincount(day_menu_arr[day_has_data], minlength=n_menus)
+
+        self.nutrition_totals += menu_totals.sum(axis=0)
+        self.days_with_data += int(menu_days.sum())
+        self.menus_processed += n_menus
+
+        # 3. Ingredientes: totales consolidados y, opcionalmente, por menú
+        vocab_size = len(self.ingredient_names)
+        ids_arr = np.asarray(ingredient_ids, dtype=np.intp)
+        qty_arr = np.asarray(ingredient_qty, dtype=float)
+        chunk_totals = np.bincount(ids_arr, weights=qty_arr, minlength=vocab_size)
+        if len(self.ingredient_totals) < vocab_size:
+            self.ingredient_totals = np.concatenate(
+                [self.ingredient_totals, np.zeros(vocab_size - len(self.ingredient_totals))]
+            )
+        self.ingredient_totals += chunk_totals
+
+        per_menu_lists: List[Dict[str, Dict[str, Any]]] = [{} for _ in range(n_menus)]
+        if self.per_menu_shopping_list and len(ids_arr):
+            keys = np.asarray(ingredient_menu, dtype=np.int64) * vocab_size + ids_arr
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            sums = np.bincount(inverse, weights=qty_arr)
+            key_menu = unique_keys // vocab_size
+            boundaries = np.searchsorted(key_menu, np.arange(n_menus + 1))
+            for m in range(n_menus):
+                start, end = boundaries[m], boundaries[m + 1]
+                if start < end:
+                    per_menu_lists[m] = self._format_list(unique_keys[start:end] % vocab_size, sums[start:end])
+
+        # 4. Formatear resultados
+        results: List[Dict[str, Any]] = []
+        day_index_by_menu: List[List[int]] = [[] for _ in range(n_menus)]
+        for day_id in np.flatnonzero(day_has_data).tolist():
+            day_index_by_menu[day_menu[day_id]].append(day_id)
+
+        for m, (menu_id, _) in enumerate(menus):
+            totals = menu_totals[m]
+            dias = int(menu_days[m])
+            analisis_diario = {}
+            for day_id in day_index_by_menu[m]:
+                d = day_totals[day_id]
+                analisis_diario[day_names[day_id]] = {
+                    "totalCalorias": round(float(d[CAL]), 2),
+                    "macronutrientes": {
+                        "proteinas_g": round(float(d[PROT]), 2),
+                        "grasas_g": round(float(d[FAT]), 2),
+                        "carbohidratos_g": round(float(d[CARBS]), 2),
+                    }
+                }
+            result = {
+                "id": menu_id,
+                "analisis": {
+                    "analisisSemanal": {
+                        "totalCalorias": round(float(totals[CAL]), 2),
+                        "promedioCaloriasDia": _average(float(totals[CAL]), dias),
+                        "diasConDatos": dias,
+                        "macronutrientes": {
+                            "total_proteinas_g": round(float(totals[PROT]), 2),
+                            "promedio_proteinas_g_dia": _average(float(totals[PROT]), dias),
+                            "total_grasas_g": round(float(totals[FAT]), 2),
+                            "promedio_grasas_g_dia": _average(float(totals[FAT]), dias),
+                            "total_carbohidratos_g": round(float(totals[CARBS]), 2),
+                            "promedio_carbohidratos_g_dia": _average(float(totals[CARBS]), dias),
+                        }
+                    },
+                    "analisisDiario": analisis_diario,
+                },
+            }
+            if self.per_menu_shopping_list:
+                result["lista_compra"] = per_menu_lists[m]
+            results.append(result)
+        return results
+
+    def consolidated(self) -> Dict[str, Any]:
+        """Totales de todos los lotes procesados hasta ahora."""
+        ids = np.flatnonzero(self.ingredient_totals > 0)
+        totals = self.nutrition_totals
+        return {
+            "menus": self.menus_processed,
+            "diasConDatos": self.days_with_data,
+            "nutricion": {
+                "totalCalorias": round(float(totals[CAL]), 2),
+                "total_proteinas_g": round(float(totals[PROT]), 2),
+                "total_grasas_g": round(float(totals[FAT]), 2),
+                "total_carbohidratos_g": round(float(totals[CARBS]), 2),
+                "promedioCaloriasDia": _average(float(totals[CAL]), self.days_with_data),
+            },
+            "lista_compra": self._format_list(ids, self.ingredient_totals[ids]),
+        }
+
+
+def analyze_menu(menu_items: Dict[str, Any]) -> Dict[str, Any]:
+    """Análisis nutricional de un único menú (formato de /perfil/analisis-nutricional)."""
+    return BatchAggregator().process_chunk([(None, menu_items)])[0]["analisis"]
+
+
+def iter_saved_menus(session: Any, user_ids: Optional[Sequence[int]] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[int, Any]]:
+    """
+    Recorre los menús guardados de los usuarios indicados (o de todos si `user_ids` es None)
+    leyendo solo las columnas necesarias, en bloques de `chunk_size`.
+    Produce (user_id, menú) o (user_id, ValueError) si el menú falta o está malformado.
+    """
+    from app.users import User
+
+    def _rows(rows):
+        # Los menús guardan referencias a la tabla de recetas: se rehidratan todos los del
+        # bloque con una sola búsqueda
+        parsed = []
+        for user_id, raw_menu_json in rows:
+            if not raw_menu_json:
+                parsed.append((user_id, ValueError("No hay menú guardado.")))
+                continue
+            try:
+                parsed.append((user_id, json.loads(raw_menu_json)))
+            except json.JSONDecodeError as e:
+                parsed.append((user_id, ValueError(f"JSON malformado: {e}")))
+        validos = [obj for _, obj in parsed if not isinstance(obj, Exception)]
+        hidratados = iter(recipe_store.hydrate_menus(session, validos))
+        for user_id, obj in parsed:
+            if isinstance(obj, Exception):
+                yield user_id, obj
+                continue
+            try:
+                yield user_id, saved_menu_days(next(hidratados))
+            except ValueError as e:
+                yield user_id, e
+
+    query = session.query(User.id, User.last_generated_menu_json)
+    if user_ids is None:
+        rows = query.order_by(User.id).yield_per(chunk_size)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield from _rows(chunk)
+
+    for start in range(0, len(user_ids), chunk_size):
+        chunk_ids = list(user_ids[start:start + chunk_size])
+        menus = dict(_rows(query.filter(User.id.in_(chunk_ids)).all()))
+        for user_id in chunk_ids:
+            if user_id in menus:
+                yield user_id, menus[user_id]
+            else:
+                yield user_id, ValueError("Usuario no encontrado.")
+
+
+def iter_payload_menus(menus: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Any, Any]]:
+    """Menús enviados directamente ({"id": opcional, "menu": {...}}), con el mismo formato que el guardado."""
+    for i, menu in enumerate(menus):
+        menu_id = menu.get("id", i) if isinstance(menu, dict) else i
+        try:
+            yield menu_id, saved_menu_days(menu)
+        except ValueError as e:
+            yield menu_id, e
+
+
+def stream_aggregation(
+    menus: Iterable[Tuple[Any, Any]],
+    per_menu_shopping_list: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Agrega un flujo de (id, menú) por lotes. Produce una línea por menú
+    (o {"id", "error"} si no se pudo leer) y al final {"consolidado": {...}}.
+    """
+    aggregator = BatchAggregator(per_menu_shopping_list=per_menu_shopping_list)
+
+    def _flush(chunk):
+        # Los errores se mantienen en su posición para respetar el orden de entrada
+        validos = [entry for entry in chunk if not isinstance(entry[1], Exception)]
+        resultados = iter(aggregator.process_chunk(validos))
+        for menu_id, menu_items in chunk:
+            if isinstance(menu_items, Exception):
+                yield {"id": menu_id, "error": str(menu_items)}
+            else:
+                yield next(resultados)
+
+    chunk: List[Tuple[Any, Any]] = []
+    for entry in menus:
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            yield from _flush(chunk)
+            chunk = []
+    if chunk:
+        yield from _flush(chunk)
+    yield {"consolidado": aggregator.consolidated()}
@@ -0,0 +1,184 @@
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Caché en memoria con caducidad (TTL) y tamaño máximo (se expulsa la entrada menos usada).
+    Es segura entre hilos, ya que los endpoints síncronos de FastAPI se ejecutan en un threadpool.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # clave -> (expira_en, valor)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry is not None else default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Todas las SqliteCache del proceso, para reabrir sus conexiones en los hijos creados con fork
+_open_caches: "weakref.WeakSet[SqliteCache]" = weakref.WeakSet()
+_inherited_connections: list = []
+
+
+def reopen_after_fork() -> None:
+    """Llamar al empezar un proceso hijo creado con fork que vaya a usar las cachés SQLite."""
+    for cache in list(_open_caches):
+        cache.reopen_after_fork()
+
+
+class SqliteCache:
+    """
+    Caché persistente clave -> texto en un fichero SQLite, con caducidad (TTL) por entrada.
+    Sobrevive a reinicios y puede compartirse entre procesos que usen el mismo fichero.
+    """
+
+    def __init__(self, path: str, table: str = "cache", ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        _open_caches.add(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        conn.commit()
+        return conn
+
+    def reopen_after_fork(self) -> None:
+        """
+        Abre una conexión propia en un proceso hijo. SQLite no admite usar una conexión a través
+        de fork(); la heredada no se cierra (cerrarla también tocaría los cerrojos del fichero),
+        solo se aparta para que el recolector no la cierre.
+        """
+        _inherited_connections.append(self._conn)
+        self._lock = threading.Lock()  # Otro hilo del padre podía tenerlo tomado al hacer fork
+        self._conn = self._connect()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.pop(key)
+            return default
+        return value
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self._conn.commit()
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+        return row[0] if row is not None else default
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def update(self, key: str, fn: Callable[[Optional[str]], str], ttl_seconds: Optional[float] = None) -> str:
+        """
+        Lectura-modificación-escritura atómica entre procesos: `fn` recibe el valor actual
+        (o None si no existe o ha caducado) y devuelve el nuevo.
+        """
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")  # Bloquea escritores de otros procesos
+            try:
+                row = self._conn.execute(
+                    f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                current = row[0] if row is not None and (row[1] is None or row[1] >= time.time()) else None
+                value = fn(current)
+                expires_at = time.time() + ttl if ttl is not None else None
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def try_acquire(self, key: str, ttl_seconds: float) -> bool:
+        """
+        Cerrojo con caducidad compartido entre procesos: devuelve True solo al primero que lo pide
+        (p. ej. para que un único worker haga una tarea de fondo). Si ya está tomado no se toca:
+        un intento fallido no alarga la caducidad del que lo tiene.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")  # Bloquea escritores de otros procesos
+            try:
+                row = self._conn.execute(f"SELECT expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                acquired = row is None or (row[0] is not None and row[0] < now)
+                if acquired:
+                    self._conn.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, "1", now + ttl_seconds),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return acquired
@@ -0,0 +1,310 @@
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.services import cache, metrics, recipe_pool, recipe_store
+from app.services.edamam_service import fetch_recipes_from_edamam
+from app.services.menu_generator import (
+    DIAS_SEMANA,
+    EDAMAM_PAGE_SIZE,
+    RECOMMENDED_MAX_SEARCHES_PER_MEAL,
+    RECOMMENDED_MEAL_RATIOS,
+    RECOMMENDED_MEALS,
+    RECOMMENDED_NUM_OPTIONS,
+    RECOMMENDED_POOL_FACTOR,
+    RECOMMENDED_WINDOW,
+    _recommended_search_params,
+    calorie_window,
+    daily_target_calories_for_user,
+    generate_recommended_weekly_menu,
+)
+
+# Generación de menús recomendados para cohortes completas (altas de organizaciones con miles de
+# usuarios). Etapas: cargar la cohorte, planificar las búsquedas de Edamam que comparten sus
+# ventanas cuantizadas, lanzar cada búsqueda una sola vez, generar los menús en varios procesos y
+# guardarlos en bloque. Ver app/cli/cohort_menus.py.
+COHORT_SEARCH_THREADS = int(os.getenv("COHORT_SEARCH_THREADS", "8"))
+COHORT_WRITE_CHUNK_SIZE = int(os.getenv("COHORT_WRITE_CHUNK_SIZE", "200"))
+
+
+class CohortMember:
+    """Perfil mínimo que necesita generate_recommended_weekly_menu (un User o una fila del CSV)."""
+
+    __slots__ = ("id", "username", "bmr", "actividad", "objetivo", "recetas_favoritas", "target_calories")
+
+    def __init__(self, id=None, username=None, bmr=None, actividad=None, objetivo=None,
+                 recetas_favoritas=None, target_calories=None):
+        self.id = id
+        self.username = username
+        self.bmr = bmr
+        self.actividad = actividad
+        self.objetivo = objetivo
+        self.recetas_favoritas = recetas_favoritas  # Ya rehidratadas: los procesos hijos no usan la BD
+        self.target_calories = target_calories
+
+
+class StageTimer:
+    """Tiempo acumulado por etapa (segundos)."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - inicio
+
+
+# --- Carga de la cohorte ------------------------------------------------------------------
+
+def _int_or_none(value: Any) -> Optional[int]:
+    if value is None or str(value).strip() == "":
+        return None
+    return int(float(value))
+
+
+def load_members_from_db(db: Any, user_ids: Optional[List[int]] = None, chunk_size: int = 500) -> List[CohortMember]:
+    """Usuarios de la BD (todos o `user_ids`), con los favoritos rehidratados en bloque."""
+    from app.users import User
+
+    columns = (User.id, User.username, User.bmr, User.actividad, User.objetivo, User.recetas_favoritas)
+    if user_ids is None:
+        rows = db.query(*columns).order_by(User.id).all()
+    else:
+        rows = []
+        for start in range(0, len(user_ids), chunk_size):
+            rows.extend(db.query(*columns).filter(User.id.in_(user_ids[start:start + chunk_size])).all())
+        rows.sort(key=lambda r: r.id)
+
+    parsed = []
+    for row in rows:
+        try:
+            favoritas = json.loads(row.recetas_favoritas) if row.recetas_favoritas else None
+        except json.JSONDecodeError:
+            print(f"Favoritos ilegibles para el usuario {row.id}; se genera sin gusto", file=sys.stderr)
+            favoritas = None
+        parsed.append((row, favoritas if isinstance(favoritas, list) else None))
+
+    # Una sola pasada por la tabla de recetas para todos los favoritos de la cohorte
+    recipe_store.hydrate_refs(db, [f[recipe_store.REF_KEY] for _, favs in parsed for f in favs or [] if recipe_store.is_ref(f)])
+    return [
+        CohortMember(
+            id=row.id, username=row.username, bmr=row.bmr, actividad=row.actividad, objetivo=row.objetivo,
+            recetas_favoritas=recipe_store.hydrate_favorites(db, favs) if favs else None,
+        )
+        for row, favs in parsed
+    ]
+
+
+def load_members_from_csv(path: str) -> List[CohortMember]:
+    """
+    CSV con cabecera. Columnas reconocidas: id, username, bmr, actividad, objetivo, target_calories.
+    Las filas con `id` de un usuario existente se pueden guardar en la BD; el resto solo va a la salida.
+    """
+    members = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for n, row in enumerate(csv.DictReader(f), start=1):
+            member_id = _int_or_none(row.get("id"))
+            members.append(CohortMember(
+                id=member_id,
+                username=row.get("username") or f"csv-{member_id if member_id is not None else n}",
+                bmr=_int_or_none(row.get("bmr")),
+                actividad=(row.get("actividad") or "").strip() or None,
+                objetivo=(row.get("objetivo") or "").strip() or None,
+                target_calories=_int_or_none(row.get("target_calories")),
+            ))
+    return members
+
+
+# --- Planificación y búsquedas compartidas ------------------------------------------------
+
+def resolve_targets(members: List[CohortMember]) -> None:
+    """Fija las calorías diarias de cada miembro (las mismas se usan para planificar y para generar)."""
+    with contextlib.redirect_stdout(io.StringIO()):  # daily_target_calories_for_user es muy verboso
+        for member in members:
+            member.target_calories = daily_target_calories_for_user(member, member.target_calories)
+
+
+def plan_searches(
+    members: List[CohortMember],
+    meals: List[str] = RECOMMENDED_MEALS,
+    ratios: Dict[str, float] = RECOMMENDED_MEAL_RATIOS,
+) -> Dict[Tuple, Dict[str, Any]]:
+    """
+    Firmas de búsqueda (ventana cuantizada + filtros) que necesita la cohorte, con cuántos
+    usuarios comparten cada una. Usuarios con objetivos parecidos caen en la misma firma.
+    """
+    plan: Dict[Tuple, Dict[str, Any]] = {}
+    for member in members:
+        for meal_name_key in meals:
+            min_cal, max_cal = calorie_window(member.target_calories, ratios[meal_name_key], *RECOMMENDED_WINDOW)
+            qmin, qmax = recipe_pool.quantize_window(min_cal, max_cal)
+            search_params = _recommended_search_params(meal_name_key)
+            key = recipe_pool.pool_key(qmin, qmax, search_params)
+            entry = plan.setdefault(key, {"qmin": qmin, "qmax": qmax, "search_params": search_params, "usuarios": 0})
+            entry["usuarios"] += 1
+    return plan
+
+
+def prefetch_pools(
+    plan: Dict[Tuple, Dict[str, Any]],
+    target_recipes: int,
+    max_searches: int = RECOMMENDED_MAX_SEARCHES_PER_MEAL,
+    threads: int = COHORT_SEARCH_THREADS,
+) -> int:
+    """
+    Llena el pool de cada firma del plan hasta `target_recipes` recetas (como mucho `max_searches`
+    páginas por firma), con varias búsquedas en paralelo. Devuelve el número de búsquedas hechas.
+    """
+
+    def _fill(key: Tuple) -> int:
+        entry = plan[key]
+        searches = 0
+        while searches < max_searches and recipe_pool.pool_store.size(key) < target_recipes:
+            if recipe_pool.search_exhausted(key):
+                break
+            recipes = fetch_recipes_from_edamam(
+                calorie_range_str=f"{entry['qmin']}-{entry['qmax']}",
+                num_recipes_to_get=EDAMAM_PAGE_SIZE,
+                **entry["search_params"]
+            )
+            recipe_pool.record_search_total(key, recipes.total)
+            searches += 1
+            if not recipes:
+                break
+            recipe_pool.pool_store.add(key, recipes)
+        return searches
+
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        return sum(executor.map(_fill, list(plan)))
+
+
+# --- Generación en procesos hijos ---------------------------------------------------------
+
+def _init_worker(pools: Optional[Dict[Tuple, List[Dict[str, Any]]]], verbose: bool) -> None:
+    from app import database
+
+    # Con fork el hijo hereda las conexiones del padre: se descartan sin cerrarlas y se abren
+    # otras (la base de datos y las cachés SQLite compartidas con los workers web: pools,
+    # totales de búsqueda, menús, idempotencia...)
+    database.dispose_engine(close=False)
+    cache.reopen_after_fork()
+    if pools:  # Sin fork (spawn) los pools no se heredan y se reciben aquí
+        for key, recipes in pools.items():
+            recipe_pool.pool_store.add(key, recipes)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+
+
+def _edamam_requests() -> float:
+    return metrics.snapshot()["counters"].get("edamam_requests", 0)
+
+
+def generate_member_menu(member: CohortMember) -> Dict[str, Any]:
+    """Genera el menú recomendado de un miembro (se ejecuta en un proceso hijo)."""
+    inicio = time.perf_counter()
+    peticiones = _edamam_requests()
+    resultado: Dict[str, Any] = {"id": member.id, "username": member.username, "target_calories": member.target_calories}
+    try:
+        menu = generate_recommended_weekly_menu(
+            user=member,
+            db_session=None,
+            meals_config=RECOMMENDED_MEALS,
+            ratios_config=RECOMMENDED_MEAL_RATIOS,
+            num_options=RECOMMENDED_NUM_OPTIONS,
+            target_calories_override=member.target_calories,
+        )
+        resultado["menu"] = menu.to_saved_menu()
+        resultado["slots_sin_recetas"] = sum(1 for _, _, slot in menu.slots() if slot.error)
+    except Exception as e:
+        resultado["error"] = f"{type(e).__name__}: {e}"
+    resultado["segundos"] = time.perf_counter() - inicio
+    resultado["busquedas_edamam"] = _edamam_requests() - peticiones
+    return resultado
+
+
+def generate_menus(
+    members: List[CohortMember],
+    processes: int,
+    pool_keys: Iterable[Tuple] = (),
+    verbose: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Resultados de generate_member_menu en el orden de `members`, según van terminando. Los hijos
+    parten de los pools ya llenos (`pool_keys`): heredados con fork, o copiados si no hay fork.
+    """
+    if processes <= 1:
+        with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+            for member in members:
+                yield generate_member_menu(member)
+        return
+
+    context = multiprocessing.get_context()
+    pools = None
+    if context.get_start_method() != "fork" and isinstance(recipe_pool.pool_store, recipe_pool.RecipePoolStore):
+        pools = {key: recipe_pool.pool_store.get(key) for key in pool_keys}
+    chunksize = max(1, min(16, len(members) // (processes * 4)))
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                             initializer=_init_worker, initargs=(pools, verbose)) as executor:
+        yield from executor.map(generate_member_menu, members, chunksize=chunksize)
+
+
+# --- Escritura en bloque ------------------------------------------------------------------
+
+def write_menus(db: Any, results: List[Dict[str, Any]]) -> int:
+    """
+    Guarda los menús como `last_generated_menu_json` (recetas por referencia) con un solo
+    store_recipes y un UPDATE por lotes. Hace commit. Devuelve cuántos usuarios se actualizaron.
+    """
+    from sqlalchemy import bindparam, update
+
+    from app.users import User
+
+    guardables = [r for r in results if r.get("menu") is not None and r.get("id") is not None]
+    if not guardables:
+        return 0
+    existing = {
+        user_id for (user_id,) in db.query(User.id).filter(User.id.in_([r["id"] for r in guardables]))
+    }
+    guardables = [r for r in guardables if r["id"] in existing]
+    menus = recipe_store.dehydrate_menus(db, [r["menu"] for r in guardables])
+    if menus:
+        # UPDATE de Core (executemany): no pasa por before_update, así que sube data_version aquí
+        users = User.__table__
+        stmt = (
+            update(users)
+            .where(users.c.id == bindparam("b_id"))
+            .values(last_generated_menu_json=bindparam("b_menu"), data_version=users.c.data_version + 1)
+        )
+        db.execute(stmt, [
+            {"b_id": r["id"], "b_menu": json.dumps(menu)}
+            for r, menu in zip(guardables, menus)
+        ])
+    db.commit()
+    return len(menus)
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk: List[Any] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prefetch_target(num_options: int = RECOMMENDED_NUM_OPTIONS) -> int:
+    """Recetas por pool para cubrir una semana con margen para el ranking (igual que el generador)."""
+    return min(recipe_pool.POOL_MAX_RECIPES, len(DIAS_SEMANA) * num_options * RECOMMENDED_POOL_FACTOR)
@@ -0,0 +1,46 @@
+import math
+import os
+import time
+from typing import Optional
+
+# Tiempo máximo para generar un menú. El cliente puede pedir otro con la cabecera
+# X-Deadline-Seconds, limitado a MENU_DEADLINE_MAX_SECONDS. Al agotarse no se lanzan más
+# búsquedas a Edamam y se devuelven los slots ya completados (el resto con error).
+MENU_DEADLINE_SECONDS = float(os.getenv("MENU_DEADLINE_SECONDS", "25"))
+MENU_DEADLINE_MAX_SECONDS = float(os.getenv("MENU_DEADLINE_MAX_SECONDS", "60"))
+# Por debajo de este margen no merece la pena empezar otra llamada a Edamam
+DEADLINE_MIN_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_CALL_SECONDS", "0.5"))
+
+HEADER = "X-Deadline-Seconds"
+
+
+class Deadline:
+    """Instante límite (reloj monótono) que se pasa a los generadores y a las llamadas a Edamam."""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() < DEADLINE_MIN_CALL_SECONDS
+
+    def timeout(self, cap: float) -> float:
+        """Timeout para una llamada: el suyo propio, sin pasarse del tiempo que queda."""
+        return min(cap, self.remaining())
+
+
+def request_deadline(header_value: Optional[str] = None) -> Deadline:
+    """Deadline de una petición: el de la cabecera (acotado) o MENU_DEADLINE_SECONDS. ValueError si no es un número."""
+    if header_value is None or not header_value.strip():
+        return Deadline(MENU_DEADLINE_SECONDS)
+    try:
+        seconds = float(header_value)
+    except ValueError:
+        raise ValueError(f"{HEADER} debe ser un número de segundos")
+    if not math.isfinite(seconds) or seconds <= 0:  # float() acepta "nan" e "inf"
+        raise ValueError(f"{HEADER} debe ser un número finito mayor que 0")
+    return Deadline(min(seconds, MENU_DEADLINE_MAX_SECONDS))
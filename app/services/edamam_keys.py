@@ -0,0 +1,134 @@
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from app import config  # Carga .env
+from app.services import metrics
+
+# Varias credenciales de Edamam para repartir la carga entre planes (cada uno con su límite por
+# minuto). Formato: "app_id:app_key[:account_user],app_id2:app_key2[:account_user2]".
+# Sin EDAMAM_CREDENTIALS se usa el par EDAMAM_APP_ID / EDAMAM_APP_KEY de siempre.
+EDAMAM_CREDENTIALS = os.getenv("EDAMAM_CREDENTIALS", "")
+EDAMAM_ACCOUNT_USER = os.getenv("EDAMAM_ACCOUNT_USER", "TFG")
+# Límite del plan por credencial (0 = sin límite): una credencial que lo alcanza no se usa hasta
+# que su ventana de 60 s se libera, en lugar de esperar a que Edamam conteste 429
+EDAMAM_KEY_REQUESTS_PER_MINUTE = int(os.getenv("EDAMAM_KEY_REQUESTS_PER_MINUTE", "0"))
+# Enfriamiento tras un 429 sin Retry-After, y tras un 401/403 (credencial revocada o mal configurada)
+EDAMAM_KEY_COOLDOWN_SECONDS = float(os.getenv("EDAMAM_KEY_COOLDOWN_SECONDS", "60"))
+EDAMAM_KEY_AUTH_COOLDOWN_SECONDS = float(os.getenv("EDAMAM_KEY_AUTH_COOLDOWN_SECONDS", "900"))
+
+WINDOW_SECONDS = 60.0
+PLACEHOLDER_APP_ID = "YOUR_EDAMAM_APP_ID"
+
+
+class Credential:
+    __slots__ = ("app_id", "app_key", "account_user", "label", "recent", "in_flight", "cooldown_until")
+
+    def __init__(self, app_id: str, app_key: str, account_user: str):
+        self.app_id = app_id
+        self.app_key = app_key
+        self.account_user = account_user
+        # Nombre para métricas y logs: /metricas es público y no debe mostrar identificadores de la cuenta
+        self.label = "clave-" + hashlib.sha256(app_id.encode("utf-8")).hexdigest()[:8]
+        self.recent: deque = deque()  # Instantes de las peticiones del último minuto
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+
+    def load(self, now: float) -> int:
+        while self.recent and self.recent[0] <= now - WINDOW_SECONDS:
+            self.recent.popleft()
+        return len(self.recent)
+
+
+def parse_credentials(raw: str, default_app_id: Optional[str], default_app_key: Optional[str]) -> List[Credential]:
+    credentials = []
+    for entry in raw.replace(";", ",").split(","):
+        parts = [p.strip() for p in entry.split(":")]
+        if len(parts) < 2 or not parts[0] or not parts[1]:
+            if entry.strip():
+                print(f"ADVERTENCIA: entrada de EDAMAM_CREDENTIALS no válida, se ignora ({parts[0] or '?'})")
+            continue
+        credentials.append(Credential(parts[0], parts[1], parts[2] if len(parts) > 2 and parts[2] else EDAMAM_ACCOUNT_USER))
+    if not credentials and default_app_id and default_app_key and default_app_id != PLACEHOLDER_APP_ID:
+        credentials.append(Credential(default_app_id, default_app_key, EDAMAM_ACCOUNT_USER))
+    return credentials
+
+
+class KeyPool:
+    """
+    Reparte las peticiones entre credenciales: elige la menos cargada (peticiones del último minuto
+    y en curso) entre las que no están en enfriamiento ni han llegado a su límite por minuto.
+    """
+
+    def __init__(self, credentials: List[Credential], requests_per_minute: int = EDAMAM_KEY_REQUESTS_PER_MINUTE):
+        self.credentials = credentials
+        self.requests_per_minute = requests_per_minute
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.credentials)
+
+    def acquire(self) -> Optional[Credential]:
+        """Credencial para una petición (ya contabilizada) o None si ninguna está disponible."""
+        now = time.monotonic()
+        with self._lock:
+            best = None
+            best_load = None
+            for credential in self.credentials:
+                if credential.cooldown_until > now:
+                    continue
+                load = credential.load(now)
+                if self.requests_per_minute and load >= self.requests_per_minute:
+                    continue
+                load += credential.in_flight
+                if best is None or load < best_load:
+                    best, best_load = credential, load
+            if best is None:
+                return None
+            best.recent.append(now)
+            best.in_flight += 1
+        metrics.inc("edamam_key_requests", labels={"key": best.label})
+        return best
+
+    def release(self, credential: Credential, status: Optional[int] = None, retry_after: Optional[str] = None) -> None:
+        """Libera la credencial; con 429 o 401/403 la pone en enfriamiento."""
+        cooldown = None
+        if status == 429:
+            cooldown = _retry_after_seconds(retry_after) or EDAMAM_KEY_COOLDOWN_SECONDS
+        elif status in (401, 403):
+            cooldown = EDAMAM_KEY_AUTH_COOLDOWN_SECONDS
+        with self._lock:
+            credential.in_flight -= 1
+            if cooldown is not None:
+                credential.cooldown_until = time.monotonic() + cooldown
+        if status is not None and status >= 400:
+            metrics.inc("edamam_key_errors", labels={"key": credential.label, "status": str(status)})
+        if cooldown is not None:
+            metrics.inc("edamam_key_cooldowns", labels={"key": credential.label})
+            print(f"Credencial de Edamam {credential.label} en enfriamiento {cooldown:.0f}s (HTTP {status})")
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "clave": c.label,
+                    "peticiones_ultimo_minuto": c.load(now),
+                    "en_curso": c.in_flight,
+                    "enfriamiento_s": round(max(0.0, c.cooldown_until - now), 1),
+                }
+                for c in self.credentials
+            ]
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None  # Retry-After con fecha HTTP: se usa el enfriamiento por defecto
+
+
+key_pool = KeyPool(parse_credentials(EDAMAM_CREDENTIALS, os.getenv("EDAMAM_APP_ID"), os.getenv("EDAMAM_APP_KEY")))
@@ -0,0 +1,291 @@
+import codecs
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import re
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.services import metrics
+
+# Decodificación de las respuestas de Edamam a registros compactos. En lugar de response.json()
+# (toda la respuesta, todos los hits y sus totalNutrients como dicts anidados) se leen los hits
+# según llegan, se quedan solo los campos que usan RecipeOption, los pools y el recomendador, y se
+# deja de decodificar al llegar al número pedido. Los nutrientes se guardan en un array de floats
+# con la tupla de códigos compartida entre recetas; el dict de totalNutrients se rehace al pedirlo.
+EDAMAM_DECODE_CHUNK_BYTES = int(os.getenv("EDAMAM_DECODE_CHUNK_BYTES", "65536"))
+
+_HITS_RE = re.compile(r'"hits"\s*:\s*\[')
+_COUNT_RE = re.compile(r'"count"\s*:\s*(\d+)(?=\D)')  # Sin el número partido entre trozos
+_WHITESPACE = " \t\r\n,"
+_decoder = json.JSONDecoder()
+
+# Vocabulario compartido por todas las recetas: código -> (label, unit), y tuplas de códigos internadas
+_nutrient_info: Dict[str, Tuple[str, str]] = {}
+_code_tuples: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+
+def _strings(value: Any) -> Optional[Tuple[str, ...]]:
+    if not isinstance(value, list):
+        return None
+    return tuple(sys.intern(v) if len(v) < 64 else v for v in value if isinstance(v, str))
+
+
+def _number(value: Any) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+class EdamamRecipe:
+    """
+    Objeto 'recipe' de Edamam reducido a lo que usa la app. Se lee como el dict original
+    (get / [] / in con las claves de Edamam), así que los consumidores no cambian.
+    """
+
+    __slots__ = (
+        "uri", "label", "image", "source", "url", "servings", "ingredient_lines", "calories",
+        "total_time", "meal_type", "health_labels", "diet_labels", "cuisine_type", "dish_type",
+        "nutrient_codes", "nutrient_quantities",
+    )
+
+    # Clave de Edamam -> atributo
+    FIELDS = {
+        "uri": "uri", "label": "label", "image": "image", "source": "source", "url": "url",
+        "yield": "servings", "ingredientLines": "ingredient_lines", "calories": "calories",
+        "totalTime": "total_time", "mealType": "meal_type", "healthLabels": "health_labels",
+        "dietLabels": "diet_labels", "cuisineType": "cuisine_type", "dishType": "dish_type",
+    }
+    _LISTS = frozenset(("ingredientLines", "mealType", "healthLabels", "dietLabels", "cuisineType", "dishType"))
+
+    @classmethod
+    def from_dict(cls, recipe: Dict[str, Any]) -> "EdamamRecipe":
+        record = cls.__new__(cls)
+        for key in ("uri", "label", "image", "source", "url"):
+            value = recipe.get(key)
+            setattr(record, cls.FIELDS[key], value if isinstance(value, str) else None)
+        record.servings = _number(recipe.get("yield"))
+        record.calories = _number(recipe.get("calories"))
+        record.total_time = _number(recipe.get("totalTime"))
+        for key in cls._LISTS:
+            setattr(record, cls.FIELDS[key], _strings(recipe.get(key)))
+
+        codes = []
+        quantities = array("d")
+        nutrients = recipe.get("totalNutrients")
+        if isinstance(nutrients, dict):
+            for code, nutrient in nutrients.items():
+                quantity = _number(nutrient.get("quantity")) if isinstance(nutrient, dict) else None
+                if quantity is None:
+                    continue
+                if code not in _nutrient_info:
+                    _nutrient_info[sys.intern(code)] = (str(nutrient.get("label") or code), str(nutrient.get("unit") or ""))
+                codes.append(code)
+                quantities.append(quantity)
+        codes = tuple(codes)
+        record.nutrient_codes = _code_tuples.setdefault(codes, codes) if nutrients is not None else None
+        record.nutrient_quantities = quantities
+        return record
+
+    def total_nutrients(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        if self.nutrient_codes is None:
+            return None
+        nutrients = {}
+        for code, quantity in zip(self.nutrient_codes, self.nutrient_quantities):
+            label, unit = _nutrient_info.get(code, (code, ""))
+            nutrients[code] = {"label": label, "quantity": quantity, "unit": unit}
+        return nutrients
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == "totalNutrients":
+            value = self.total_nutrients()
+        else:
+            attr = self.FIELDS.get(key)
+            value = getattr(self, attr) if attr is not None else None
+            if value is not None and key in self._LISTS:
+                value = list(value)  # Copia: el registro se comparte entre pools y peticiones
+        return default if value is None else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        keys = list(self.FIELDS) + ["totalNutrients"]
+        return {key: value for key in keys if (value := self.get(key)) is not None}
+
+
+class SearchResults(list):
+    """Recetas de una búsqueda, con el total de resultados que declara Edamam ("count", None si no se sabe)."""
+
+    __slots__ = ("total",)
+
+    def __init__(self, recipes: Iterable[EdamamRecipe] = (), total: Optional[int] = None):
+        super().__init__(recipes)
+        self.total = total
+
+
+def compact(recipe: Any) -> Any:
+    """El dict de una receta como EdamamRecipe (los registros y lo que no es un dict se devuelven tal cual)."""
+    return EdamamRecipe.from_dict(recipe) if isinstance(recipe, dict) else recipe
+
+
+def to_json(value: Any) -> Any:
+    """`default` de json.dumps para listas que mezclan dicts y EdamamRecipe."""
+    if isinstance(value, EdamamRecipe):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} no es serializable a JSON")
+
+
+def record_size(record: EdamamRecipe) -> int:
+    """Bytes aproximados del registro (sin contar los strings internados y tuplas compartidas)."""
+    size = sys.getsizeof(record) + sys.getsizeof(record.nutrient_quantities)
+    for attr in ("label", "image", "url", "uri", "ingredient_lines"):
+        value = getattr(record, attr)
+        if value is not None:
+            size += sys.getsizeof(value)
+            if isinstance(value, tuple):
+                size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+
+class HitDecoder:
+    """
+    Decodificador incremental del cuerpo de una búsqueda de Edamam: recibe los bytes por trozos
+    (`feed`) y devuelve los EdamamRecipe de los hits completos. Al llegar a `limit` deja de
+    decodificar (`done`); el resto de la respuesta se puede leer y descartar sin parsear.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.done = False
+        self.count: Optional[int] = None  # "count" de la respuesta si llegó antes que los hits
+        self.decoded = 0
+        self.bytes_decoded = 0
+        self.peak_buffer = 0
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._in_hits = False
+
+    def feed(self, chunk: bytes) -> List[EdamamRecipe]:
+        if self.done:
+            return []
+        self.bytes_decoded += len(chunk)
+        buffer = self._buffer + self._utf8.decode(chunk)
+        self.peak_buffer = max(self.peak_buffer, len(buffer))
+        if not self._in_hits:
+            match = _HITS_RE.search(buffer)
+            if match is None:
+                self._find_count(buffer)
+                self._buffer = buffer[-64:]  # Por si la clave "hits" queda partida entre trozos
+                return []
+            self._find_count(buffer[:match.start()])
+            buffer = buffer[match.end():]
+            self._in_hits = True
+
+        records = []
+        pos, end = 0, len(buffer)
+        while pos < end and not self.done:
+            while pos < end and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= end:
+                break
+            if buffer[pos] == "]":
+                self.done = True
+                break
+            try:
+                hit, pos_next = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Hit incompleto: se espera al siguiente trozo
+            pos = pos_next
+            recipe = hit.get("recipe") if isinstance(hit, dict) else None
+            if isinstance(recipe, dict):
+                records.append(EdamamRecipe.from_dict(recipe))
+                self.decoded += 1
+                if self.decoded >= self.limit:
+                    self.done = True
+        self._buffer = "" if self.done else buffer[pos:]
+        return records
+
+    def _find_count(self, text: str) -> None:
+        if self.count is None:
+            match = _COUNT_RE.search(text)
+            if match:
+                self.count = int(match.group(1))
+
+    def close(self) -> None:
+        """ValueError si la respuesta terminó a medias de un hit (JSON truncado o mal formado)."""
+        if not self.done and self._in_hits and self._buffer.strip(_WHITESPACE + "}"):
+            raise ValueError(f"respuesta de Edamam incompleta ({self.bytes_decoded} bytes)")
+
+
+# --- Informe por menú -------------------------------------------------------------------
+
+class MenuDecodeReport:
+    """Bytes y memoria de las respuestas de Edamam decodificadas durante la generación de un menú."""
+
+    __slots__ = ("requests", "bytes_received", "bytes_decoded", "hits", "record_bytes", "peak_buffer_chars")
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.hits = 0
+        self.record_bytes = 0
+        self.peak_buffer_chars = 0
+
+    def add(self, decoder: HitDecoder, bytes_received: int, records: List[EdamamRecipe]) -> None:
+        self.requests += 1
+        self.bytes_received += bytes_received
+        self.bytes_decoded += decoder.bytes_decoded
+        self.hits += len(records)
+        self.record_bytes += sum(record_size(r) for r in records)
+        self.peak_buffer_chars = max(self.peak_buffer_chars, decoder.peak_buffer)
+
+
+_current_report: contextvars.ContextVar[Optional[MenuDecodeReport]] = contextvars.ContextVar("edamam_decode_report", default=None)
+
+
+def record_request(decoder: HitDecoder, bytes_received: int, records: List[EdamamRecipe]) -> None:
+    metrics.observe("edamam_response_bytes", bytes_received)
+    metrics.inc("edamam_bytes_decoded", decoder.bytes_decoded)
+    metrics.inc("edamam_bytes_skipped", bytes_received - decoder.bytes_decoded)
+    report = _current_report.get()
+    if report is not None:
+        report.add(decoder, bytes_received, records)
+
+
+@contextlib.contextmanager
+def menu_report(kind: str) -> Iterator[MenuDecodeReport]:
+    """Acumula lo decodificado durante el bloque (un menú) y lo publica en /metricas al salir."""
+    report = MenuDecodeReport()
+    token = _current_report.set(report)
+    try:
+        yield report
+    finally:
+        _current_report.reset(token)
+        if report.requests:
+            labels = {"menu": kind}
+            metrics.observe("menu_edamam_bytes_decoded", report.bytes_decoded, labels=labels)
+            metrics.observe("menu_edamam_record_bytes", report.record_bytes, labels=labels)
+            metrics.observe("menu_edamam_peak_buffer_chars", report.peak_buffer_chars, labels=labels)
+            print(f"Menú {kind}: {report.requests} respuestas de Edamam, {report.bytes_decoded}/{report.bytes_received} "
+                  f"bytes decodificados, {report.hits} recetas ({report.record_bytes} bytes), "
+                  f"pico de búfer {report.peak_buffer_chars} caracteres")
+
+
+def reported(kind: str):
+    """Decorador: la función genera un menú y se informa con menu_report(kind)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with menu_report(kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,14 +1,18 @@
 import os
+import threading
 import requests
-from dotenv import load_dotenv
+from app import config  # Carga .env
 from app.models.MenuRequest import MenuRequest
-from typing import List, Dict, Optional, Any # Any para el retorno de datos de receta
+from app.services import edamam_keys, edamam_records, metrics, startup
+from app.services.deadline import Deadline
+from typing import List, Dict, Optional, Any, Tuple # Any para el retorno de datos de receta
 
 
-load_dotenv()
-
-APP_ID = os.getenv("EDAMAM_APP_ID")
-APP_KEY = os.getenv("EDAMAM_APP_KEY")
+# Credenciales: EDAMAM_CREDENTIALS (varias) o EDAMAM_APP_ID/EDAMAM_APP_KEY, ver edamam_keys.py
+# Se puede apuntar a un servidor falso para pruebas de carga (ver app/cli/fake_edamam.py)
+EDAMAM_BASE_URL = os.getenv("EDAMAM_BASE_URL", "https://api.edamam.com/api/recipes/v2")
+# Timeout de cada llamada; con un deadline de petición se recorta a lo que quede
+EDAMAM_TIMEOUT_SECONDS = float(os.getenv("EDAMAM_TIMEOUT_SECONDS", "20"))
 
 # Edamam mealType values: Breakfast, Lunch, Dinner, Snack, Teatime
 EDAMAM_MEAL_TYPE_MAP = {
@@ -19,6 +23,28 @@ EDAMAM_MEAL_TYPE_MAP = {
     "merienda": "Snack",
     # Añade otros mapeos según los uses
 }
+_http_session: Optional[requests.Session] = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Sesión HTTP compartida (reutiliza conexiones keep-alive con Edamam); se crea en el primer uso."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                with startup.timed("edamam_http_session"):
+                    _http_session = requests.Session()
+    return _http_session
+
+
+def close_http_session() -> None:
+    global _http_session
+    if _http_session is not None:
+        _http_session.close()
+        _http_session = None
+
+
 def fetch_recipes_from_edamam(
     calorie_range_str: str, # Ej: "500-700"
     num_recipes_to_get: int,
@@ -26,22 +52,26 @@ def fetch_recipes_from_edamam(
     health_labels: Optional[List[str]] = None,
     excluded_items: Optional[List[str]] = None,
     included_keywords_q: Optional[List[str]] = None, # 'q' para búsqueda de texto
-    edamam_meal_type: Optional[str] = None # Directamente el valor de Edamam (Breakfast, Lunch, etc.)
-) -> List[Dict[str, Any]]:
+    edamam_meal_type: Optional[str] = None, # Directamente el valor de Edamam (Breakfast, Lunch, etc.)
+    deadline: Optional[Deadline] = None,
+) -> edamam_records.SearchResults:
     """
     Obtiene hasta `num_recipes_to_get` recetas de la API de Edamam basadas en los criterios.
-    Devuelve una lista de diccionarios, donde cada diccionario es un objeto 'recipe' de Edamam.
+    Devuelve una lista de edamam_records.EdamamRecipe: el objeto 'recipe' de Edamam con solo los
+    campos que usa la app, que se lee como el diccionario original (get, [], in). Su atributo
+    `total` es el número de resultados que declara Edamam (0: la búsqueda no tiene recetas),
+    o None si no hubo respuesta válida.
+    Con `deadline`, el timeout no pasa del tiempo restante y si ya se agotó no se llama.
+    La credencial se elige en edamam_keys.key_pool (la menos cargada de las disponibles).
     """
-    if not APP_ID or not APP_KEY or APP_ID == "YOUR_EDAMAM_APP_ID": # Comprueba placeholders
-        print("ERROR CRÍTICO: Credenciales de Edamam (APP_ID/APP_KEY) no configuradas.")
-        return []
+    if not edamam_keys.key_pool:
+        print("ERROR CRÍTICO: Credenciales de Edamam (EDAMAM_CREDENTIALS o APP_ID/APP_KEY) no configuradas.")
+        return edamam_records.SearchResults()
 
-    base_url = "https://api.edamam.com/api/recipes/v2"
+    base_url = EDAMAM_BASE_URL
     
     params: Dict[str, Any] = {
         "type": "public",
-        "app_id": APP_ID,
-        "app_key": APP_KEY,
         "calories": calorie_range_str,
         "random": "true", # Para obtener variedad si se hacen múltiples llamadas idénticas
     }
@@ -61,7 +91,8 @@ def fetch_recipes_from_edamam(
     # Campos específicos a solicitar a Edamam para optimizar la respuesta
     # Ajusta según los campos que necesites para RecipeOption
     fields = ["uri", "label", "image", "source", "url", "yield", 
-              "ingredientLines", "calories", "totalTime", "mealType", "totalNutrients"]
+              "ingredientLines", "calories", "totalTime", "mealType", "totalNutrients",
+              "healthLabels", "dietLabels", "cuisineType", "dishType"] # Etiquetas usadas por el recomendador
     params["field"] = fields
 
     # Edamam devuelve un número de 'hits' por página (por defecto 20).
@@ -69,37 +100,81 @@ def fetch_recipes_from_edamam(
     # Se piden los resultados y se procesan los primeros N del lado del cliente.
     # No se necesita `from` y `to` si solo se toma la primera página de resultados.
 
-    # Añadir el encabezado de autenticación si es necesario
-    headers = {
-        "Edamam-Account-User": "TFG"  # Sustituye 'tu_usuario' por el valor correcto
-    }
-    
     print(f"Solicitando a Edamam con params: {params}") # Para depuración
 
+    # Un intento por credencial como mucho: si una responde 429/401 se prueba con la siguiente
+    for _ in range(len(edamam_keys.key_pool)):
+        timeout = EDAMAM_TIMEOUT_SECONDS
+        if deadline is not None:
+            if deadline.expired():
+                metrics.inc("edamam_requests_skipped_deadline")
+                print("Deadline agotado: no se llama a Edamam")
+                return edamam_records.SearchResults()
+            timeout = deadline.timeout(EDAMAM_TIMEOUT_SECONDS)
+
+        credential = edamam_keys.key_pool.acquire()
+        if credential is None:
+            metrics.inc("edamam_no_key_available")
+            print("Ninguna credencial de Edamam disponible (en enfriamiento o en su límite por minuto)")
+            return edamam_records.SearchResults()
+        recipes_data, retry = _fetch_with_credential(credential, base_url, params, timeout, num_recipes_to_get)
+        if not retry:
+            # Hasta num_recipes_to_get (o menos si la API devuelve menos): el decodificador para ahí
+            return recipes_data
+    return edamam_records.SearchResults()
+
+
+def _fetch_with_credential(
+    credential: edamam_keys.Credential,
+    base_url: str,
+    params: Dict[str, Any],
+    timeout: float,
+    limit: int,
+) -> Tuple[edamam_records.SearchResults, bool]:
+    """
+    Una petición a Edamam con `credential`. Devuelve (recetas, reintentar con otra credencial).
+    El cuerpo se decodifica por trozos según llega (edamam_records.HitDecoder) y se deja de
+    parsear al tener `limit` recetas; el resto se lee sin parsear para reutilizar la conexión.
+    """
+    params = dict(params, app_id=credential.app_id, app_key=credential.app_key)
+    headers = {"Edamam-Account-User": credential.account_user}
+    status = None
+    retry_after = None
+
+    metrics.inc("edamam_requests")
     try:
-        response = requests.get(base_url, params=params, headers=headers, timeout=20) # Timeout aumentado
-        response.raise_for_status() # Lanza un HTTPError para respuestas 4xx/5xx
-        data = response.json()
-        
-        # Extraer los datos de las recetas de los "hits"
-        recipes_data = [hit.get("recipe") for hit in data.get("hits", []) if hit.get("recipe")]
-        
-        # Devolver hasta num_recipes_to_get (o menos si la API devuelve menos)
-        return recipes_data[:num_recipes_to_get]
+        with get_http_session().get(base_url, params=params, headers=headers, timeout=timeout, stream=True) as response:
+            status = response.status_code
+            retry_after = response.headers.get("Retry-After")
+            response.raise_for_status() # Lanza un HTTPError para respuestas 4xx/5xx
+
+            decoder = edamam_records.HitDecoder(limit)
+            recipes = edamam_records.SearchResults()
+            received = 0
+            for chunk in response.iter_content(chunk_size=edamam_records.EDAMAM_DECODE_CHUNK_BYTES):
+                received += len(chunk)
+                if not decoder.done:
+                    recipes.extend(decoder.feed(chunk))
+            decoder.close()
+            recipes.total = decoder.count if decoder.count is not None else (0 if decoder.done and not recipes else None)
+            edamam_records.record_request(decoder, received, recipes)
+            return recipes, False
 
     except requests.exceptions.Timeout:
-        print(f"Error: Timeout en la solicitud a Edamam API. URL: {response.url if 'response' in locals() else base_url}")
-        return []
+        print(f"Error: Timeout en la solicitud a Edamam API. URL: {base_url}")
+        return edamam_records.SearchResults(), False
     except requests.exceptions.HTTPError as http_err:
-        print(f"Error HTTP de Edamam API: {http_err}. URL: {http_err.request.url}")
-        print(f"Response text: {http_err.response.text[:500] if http_err.response else 'N/A'}")
-        return []
+        print(f"Error HTTP de Edamam API ({credential.label}): HTTP {status}")
+        print(f"Response text: {http_err.response.text[:500] if http_err.response is not None else 'N/A'}")
+        return edamam_records.SearchResults(), status in (401, 403, 429)
     except requests.exceptions.RequestException as req_err:
         print(f"Error en la solicitud a Edamam API: {req_err}")
-        return []
-    except ValueError as json_err: # Error al decodificar JSON
-        print(f"Error decodificando JSON de Edamam: {json_err}. Text: {response.text[:200] if 'response' in locals() else 'N/A'}")
-        return []
+        return edamam_records.SearchResults(), False
+    except ValueError as json_err: # JSON truncado o mal formado
+        print(f"Error decodificando JSON de Edamam: {json_err}")
+        return edamam_records.SearchResults(), False
+    finally:
+        edamam_keys.key_pool.release(credential, status, retry_after)
 
 # La función `generate_menu` original que tenías es conceptualmente lo que
 # ahora hará `menu_generator.py` al orquestar las llamadas a `Workspace_recipes_from_edamam`.
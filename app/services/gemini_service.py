@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app import config  # Carga .env
+from app.services import startup
+from app.services.cache import SqliteCache, TTLCache
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+IA_CACHE_PATH = os.getenv("IA_CACHE_PATH", "ia_cache.db")
+IA_CACHE_TTL_SECONDS = int(os.getenv("IA_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+PROMPT_ALTERNATIVA = (
+    "Eres un nutricionista experto en hacer recetas saludables. Usuario: {prompt}. "
+    "Responde con una receta alternativa más saludable, enfocada en reducir calorías, grasas y azúcares. "
+    "Incluye información nutricional detallada total(calorías, grasas, azúcares) y las diferencias con la receta tradicional."
+)
+
+_model: Any = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_in_flight: Dict[str, "asyncio.Task[str]"] = {}
+_streams: Dict[str, "_SharedStream"] = {}  # Trozos de las generaciones en streaming de _in_flight
+
+# Dos niveles: memoria (respuesta inmediata) y SQLite (persiste entre reinicios y workers)
+_memory_cache = TTLCache(max_entries=1024, ttl_seconds=IA_CACHE_TTL_SECONDS)
+_persistent_cache: Optional[SqliteCache] = None
+_persistent_cache_lock = threading.Lock()
+
+
+def get_model() -> Any:
+    """
+    Devuelve el modelo de Gemini, creado una sola vez y reutilizado entre peticiones.
+    `google.generativeai` se importa aquí para no cargarlo si nunca se usa la IA.
+    """
+    global _model
+    if _model is None:
+        with startup.timed("gemini_client"):
+            import google.generativeai as genai
+            genai.configure(api_key=GOOGLE_API_KEY)
+            _model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return _model
+
+
+def set_model(model: Any) -> None:
+    """Sustituye el cliente de Gemini (p. ej. por un stub local en pruebas). Debe exponer `generate_content_async`."""
+    global _model
+    _model = model
+    _memory_cache.clear()
+    _in_flight.clear()
+    _streams.clear()
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    return _semaphore
+
+
+def _get_persistent_cache() -> Optional[SqliteCache]:
+    global _persistent_cache
+    if _persistent_cache is None and IA_CACHE_PATH:
+        with _persistent_cache_lock:  # Se crea desde los hilos de to_thread
+            if _persistent_cache is None:
+                _persistent_cache = SqliteCache(IA_CACHE_PATH, table="ia_respuestas", ttl_seconds=IA_CACHE_TTL_SECONDS)
+    return _persistent_cache
+
+
+def normalize_prompt(prompt: str) -> str:
+    """'  Lasaña   de CARNE!! ' -> 'lasana de carne'. Peticiones equivalentes comparten entrada de caché."""
+    texto = unicodedata.normalize("NFKD", prompt).encode("ascii", "ignore").decode("ascii").lower()
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+def cache_key(prompt: str) -> str:
+    return hashlib.sha256(f"{GEMINI_MODEL_NAME}|{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+def _persistent_get(key: str) -> Optional[str]:
+    persistent = _get_persistent_cache()
+    return persistent.get(key) if persistent else None
+
+
+def _persistent_set(key: str, texto: str) -> None:
+    persistent = _get_persistent_cache()
+    if persistent:
+        persistent.set(key, texto)
+
+
+# El SQLite se consulta en un hilo: con varios workers puede esperar al cerrojo de otro proceso
+# (busy_timeout) y eso no debe parar el event loop. La caché en memoria se mira directamente.
+async def get_cached_alternativa(prompt: str) -> Optional[str]:
+    key = cache_key(prompt)
+    texto = _memory_cache.get(key)
+    if texto is None and IA_CACHE_PATH:
+        texto = await asyncio.to_thread(_persistent_get, key)
+        if texto is not None:
+            _memory_cache.set(key, texto)
+    return texto
+
+
+async def store_alternativa(prompt: str, texto: str) -> None:
+    key = cache_key(prompt)
+    _memory_cache.set(key, texto)
+    if IA_CACHE_PATH:
+        await asyncio.to_thread(_persistent_set, key, texto)
+
+
+async def _generate_and_store(prompt: str) -> str:
+    async with _get_semaphore():
+        response = await get_model().generate_content_async(PROMPT_ALTERNATIVA.format(prompt=prompt))
+    texto = response.text
+    await store_alternativa(prompt, texto)
+    return texto
+
+
+async def generar_alternativa(prompt: str) -> str:
+    """
+    Genera (o recupera de caché) la receta alternativa para `prompt`.
+    Si ya hay una generación en curso para el mismo prompt normalizado, se espera a esa
+    en lugar de lanzar otra llamada a Gemini. La generación corre en su propia tarea, así que
+    aunque un cliente se desconecte el resultado termina en caché para los demás.
+    """
+    texto = await get_cached_alternativa(prompt)
+    if texto is not None:
+        return texto
+
+    key = cache_key(prompt)
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate_and_store(prompt))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # Si es una generación en streaming, esta petición también la mantiene viva
+    stream = _streams.get(key)
+    if stream is None:
+        return await asyncio.shield(task)
+    stream.watchers += 1
+    try:
+        return await asyncio.shield(task)
+    finally:
+        stream.leave()
+
+
+class _SharedStream:
+    """
+    Trozos de una generación en streaming, guardados según llegan de Gemini para que cada
+    consumidor los lea a su ritmo. Así el hueco de concurrencia se libera en cuanto Gemini
+    termina, aunque algún cliente lea despacio, y varios clientes con el mismo prompt comparten
+    la generación. Si se van todos antes de que termine, se cancela (no se pagan más tokens).
+    """
+
+    def __init__(self):
+        self.partes: List[str] = []
+        self.finished = False
+        self.watchers = 0
+        self.task: Optional["asyncio.Task[str]"] = None
+        self._changed = asyncio.Condition()
+
+    async def push(self, parte: str) -> None:
+        async with self._changed:
+            self.partes.append(parte)
+            self._changed.notify_all()
+
+    async def finish(self) -> None:
+        async with self._changed:
+            self.finished = True
+            self._changed.notify_all()
+
+    def leave(self) -> None:
+        self.watchers -= 1
+        if self.watchers == 0 and not self.finished and self.task is not None:
+            self.task.cancel()
+
+    async def follow(self) -> AsyncIterator[str]:
+        self.watchers += 1
+        try:
+            i = 0
+            while True:
+                if i < len(self.partes):
+                    i += 1
+                    yield self.partes[i - 1]
+                    continue
+                if self.finished:
+                    break
+                async with self._changed:
+                    await self._changed.wait_for(lambda: i < len(self.partes) or self.finished)
+            await asyncio.shield(self.task)  # Propaga el error de Gemini, si lo hubo
+        finally:
+            self.leave()
+
+
+async def _produce_stream(prompt: str, stream: _SharedStream) -> str:
+    try:
+        async with _get_semaphore():
+            response = await get_model().generate_content_async(PROMPT_ALTERNATIVA.format(prompt=prompt), stream=True)
+            async for chunk in response:
+                parte = chunk.text
+                if parte:
+                    await stream.push(parte)
+        texto = "".join(stream.partes)
+        await store_alternativa(prompt, texto)  # Solo las respuestas completas se guardan en caché
+        return texto
+    finally:
+        await stream.finish()
+
+
+async def stream_alternativa(prompt: str) -> AsyncIterator[str]:
+    """
+    Produce la receta alternativa por trozos a medida que llegan de Gemini.
+    La generación corre en su propia tarea (registrada en _in_flight, como la de
+    generar_alternativa), así que peticiones simultáneas con el mismo prompt normalizado la
+    comparten. Si hay una generación sin streaming en curso se espera a ella y se envía entera.
+    Si todos los consumidores dejan de iterar (clientes desconectados) se abandona el stream.
+    """
+    texto = await get_cached_alternativa(prompt)
+    if texto is not None:
+        yield texto
+        return
+
+    key = cache_key(prompt)
+    task = _in_flight.get(key)
+    stream = _streams.get(key)
+    if task is None:
+        stream = _SharedStream()
+        task = asyncio.ensure_future(_produce_stream(prompt, stream))
+        stream.task = task
+        _in_flight[key] = task
+        _streams[key] = stream
+
+        def _done(_):
+            _in_flight.pop(key, None)
+            _streams.pop(key, None)
+
+        task.add_done_callback(_done)
+    if stream is None:
+        yield await asyncio.shield(task)
+        return
+    async with contextlib.aclosing(stream.follow()) as partes:
+        async for parte in partes:
+            yield parte
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services import metrics
+from app.services.admission import client_id
+from app.services.cache import SqliteCache, TTLCache
+
+# Idempotencia de los endpoints de generación. Una petición repetida (doble clic, reintento del
+# cliente) no lanza otra generación: se engancha a la que está en curso o recibe su resultado.
+#  - Con cabecera Idempotency-Key: el resultado se guarda IDEMPOTENCY_TTL_SECONDS para esa clave
+#    (por cliente y ruta). Reutilizar la clave con otro cuerpo es un error (422).
+#  - Sin cabecera: peticiones idénticas (mismo cliente, ruta y cuerpo) dentro de
+#    IDEMPOTENCY_DUPLICATE_WINDOW_SECONDS se tratan como la misma, solo en AUTO_DEDUP_PATHS.
+#    Regenerar un día o una comida dos veces seguidas es intencionado (otra tirada), así que
+#    esas rutas solo se deduplican si el cliente manda la cabecera.
+# Solo se guardan las respuestas 2xx; un error se comparte con las peticiones que esperaban pero
+# el siguiente reintento vuelve a ejecutarse. Las respuestas repetidas llevan Idempotent-Replayed.
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() in ("1", "true", "yes")
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_DUPLICATE_WINDOW_SECONDS = float(os.getenv("IDEMPOTENCY_DUPLICATE_WINDOW_SECONDS", "10"))
+# Cada entrada es un menú completo (~100 KB): el máximo acota la memoria de la caché local
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "256"))
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH")
+
+AUTO_DEDUP_PATHS = ("/generate-weekly-menu", "/generar-menu-recomendado")
+PATHS = AUTO_DEDUP_PATHS + ("/regenerar-dia", "/regenerar-comida")
+HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+
+# (status, cabeceras, cuerpo, huella de la petición)
+StoredResponse = Tuple[int, List[Tuple[bytes, bytes]], bytes, str]
+
+
+class ResponseStore:
+    """Respuestas guardadas por clave, en memoria o en el SQLite compartido entre workers."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._shared = SqliteCache(path, table="idempotencia") if path else None
+        self._local = TTLCache(max_entries=IDEMPOTENCY_MAX_ENTRIES)
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        if self._shared is None:
+            return self._local.get(key)
+        raw = self._shared.get(key)
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in data["headers"]]
+        return data["status"], headers, data["body"].encode("latin-1"), data["fingerprint"]
+
+    def set(self, key: str, response: StoredResponse, ttl_seconds: float) -> None:
+        if self._shared is None:
+            self._local.set(key, response, ttl_seconds=ttl_seconds)
+            return
+        status, headers, body, fingerprint = response
+        self._shared.set(key, json.dumps({
+            "status": status,
+            "headers": [(k.decode("latin-1"), v.decode("latin-1")) for k, v in headers],
+            "body": body.decode("latin-1"),
+            "fingerprint": fingerprint,
+        }), ttl_seconds=ttl_seconds)
+
+
+store = ResponseStore(SHARED_CACHE_PATH)
+_in_flight: Dict[str, "asyncio.Task[StoredResponse]"] = {}
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _run_captured(app, scope, body: bytes, fingerprint: str) -> StoredResponse:
+    """Ejecuta la petición contra la app con el cuerpo ya leído y devuelve la respuesta completa."""
+    sent = False
+    response: Dict[str, Any] = {"status": 500, "headers": [], "body": []}
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()  # Nadie más lee: la conexión real la atiende el middleware
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = list(message.get("headers") or [])
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], b"".join(response["body"]), fingerprint
+
+
+async def _send_stored(send, stored: StoredResponse, replayed: bool) -> None:
+    status, headers, body, _ = stored
+    if replayed:
+        headers = headers + [(b"idempotent-replayed", b"true")]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_error(send, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """Middleware ASGI para las rutas de PATHS (POST); el resto pasa sin coste."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") != "POST" or scope.get("path") not in PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        idempotency_key = dict(scope.get("headers") or []).get(HEADER, b"").decode("latin-1").strip()
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            await _send_error(send, 400, f"Idempotency-Key no puede superar {MAX_KEY_LENGTH} caracteres.")
+            return
+
+        if not idempotency_key and scope["path"] not in AUTO_DEDUP_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        fingerprint = hashlib.sha1(body).hexdigest()
+        scope_id = f"{scope['path']}|{client_id(scope)}"
+        if idempotency_key:
+            key, ttl, kind = f"{scope_id}|clave|{idempotency_key}", IDEMPOTENCY_TTL_SECONDS, "clave"
+        else:
+            key, ttl, kind = f"{scope_id}|auto|{fingerprint}", IDEMPOTENCY_DUPLICATE_WINDOW_SECONDS, "auto"
+
+        stored = store.get(key) if ttl > 0 else None
+        if stored is not None:
+            if stored[3] != fingerprint:
+                await _send_error(send, 422, "Idempotency-Key ya usada con otra petición.")
+                return
+            metrics.inc("idempotency_replayed", labels={"tipo": kind, "origen": "guardada"})
+            await _send_stored(send, stored, replayed=True)
+            return
+
+        task = _in_flight.get(key)
+        replayed = task is not None
+        if task is None:
+            # En su propia tarea: aunque el primer cliente se desconecte, el resultado queda para los demás
+            task = asyncio.ensure_future(_run_captured(self.app, scope, body, fingerprint))
+            _in_flight[key] = task
+
+            def _done(t: "asyncio.Task[StoredResponse]") -> None:
+                _in_flight.pop(key, None)
+                if ttl > 0 and not t.cancelled() and t.exception() is None and 200 <= t.result()[0] < 300:
+                    store.set(key, t.result(), ttl)
+
+            task.add_done_callback(_done)
+        stored = await asyncio.shield(task)
+        if replayed:
+            if stored[3] != fingerprint:
+                await _send_error(send, 422, "Idempotency-Key ya usada con otra petición.")
+                return
+            metrics.inc("idempotency_replayed", labels={"tipo": kind, "origen": "en_curso"})
+        await _send_stored(send, stored, replayed=replayed)
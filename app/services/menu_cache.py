@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.models.MenuRequest import MenuRequest
+from app.services import metrics
+from app.services.cache import SqliteCache, TTLCache
+from app.services.menu_records import WeeklyMenu
+
+# Caché de menús semanales completos por petición normalizada: dos usuarios que piden el mismo
+# MenuRequest (mismo preset) reciben un menú ya generado sin ninguna llamada a Edamam. Por cada
+# petición se guardan hasta MENU_CACHE_VARIANTS menús distintos y se van rotando; con
+# `variety_seed` el cliente elige la variante (mismo seed -> mismo menú mientras siga fresco).
+MENU_CACHE_TTL_SECONDS = int(os.getenv("MENU_CACHE_TTL_SECONDS", "1800"))  # 0 = desactivada
+MENU_CACHE_VARIANTS = max(1, int(os.getenv("MENU_CACHE_VARIANTS", "3")))
+MENU_CACHE_MAX_KEYS = int(os.getenv("MENU_CACHE_MAX_KEYS", "1000"))
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH")
+
+
+def _norm_list(values: Any) -> list:
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = [values]
+    return sorted({str(v).strip().lower() for v in values if str(v).strip()})
+
+
+def canonical_key(request: MenuRequest) -> str:
+    """
+    Firma de la petición: los campos que cambian el menú, normalizados (orden, mayúsculas, tipos)
+    salvo los nombres de las comidas, que forman parte de la forma de la respuesta.
+    """
+    from app.services.menu_generator import daily_calories_from_request
+
+    canonical = {
+        "calories": daily_calories_from_request(request),
+        "diet": (request.diet or "").strip().lower() or None,
+        "health": _norm_list(request.health),
+        "excluded": _norm_list(request.excluded),
+        "included": _norm_list(request.included),
+        # Tal cual llegan: el generador los usa como claves de la respuesta (y respeta su orden)
+        "meals": list(request.meals or []),
+        "meal_ratios": sorted((k, round(v, 3)) for k, v in (request.meal_ratios or {}).items()),
+        "num_options": request.num_options_per_meal,
+    }
+    return hashlib.sha1(json.dumps(canonical, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class MenuVariantStore:
+    """{firma: {índice de variante: (creado_en, json de la respuesta)}}, en memoria o en SQLite compartido."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._shared = SqliteCache(path, table="menus", ttl_seconds=MENU_CACHE_TTL_SECONDS) if path else None
+        self._local = TTLCache(max_entries=MENU_CACHE_MAX_KEYS, ttl_seconds=MENU_CACHE_TTL_SECONDS)
+        self._lock = threading.Lock()
+
+    def variants(self, key: str) -> Dict[int, Tuple[float, str]]:
+        if self._shared is not None:
+            raw = self._shared.get(key)
+            stored = {int(i): tuple(v) for i, v in json.loads(raw).items()} if raw else {}
+        else:
+            stored = dict(self._local.get(key) or {})
+        now = time.time()
+        return {i: v for i, v in stored.items() if v[0] + MENU_CACHE_TTL_SECONDS > now}
+
+    def put(self, key: str, index: int, body: str) -> None:
+        entry = (time.time(), body)
+        if self._shared is not None:
+            def _merge(current: Optional[str]) -> str:
+                stored = json.loads(current) if current else {}
+                stored[str(index)] = entry
+                return json.dumps(stored)
+            self._shared.update(key, _merge)
+            return
+        with self._lock:
+            stored = dict(self._local.get(key) or {})
+            stored[index] = entry
+            self._local.set(key, stored)
+
+
+store = MenuVariantStore(SHARED_CACHE_PATH)
+_rotation = TTLCache(max_entries=MENU_CACHE_MAX_KEYS)
+_rotation_lock = threading.Lock()
+
+
+def _next_index(key: str) -> int:
+    with _rotation_lock:
+        index = _rotation.get(key, random.randrange(MENU_CACHE_VARIANTS))
+        _rotation.set(key, (index + 1) % MENU_CACHE_VARIANTS)
+    return index
+
+
+def lookup(request: MenuRequest) -> Tuple[str, int, Optional[bytes]]:
+    """
+    (firma, variante, respuesta cacheada o None). Sin `variety_seed` se rota entre variantes; si
+    la que toca aún no existe (o ha caducado) se devuelve None para generarla y guardarla con `save`.
+    """
+    key = canonical_key(request)
+    if request.variety_seed is not None:
+        index = request.variety_seed % MENU_CACHE_VARIANTS
+    else:
+        index = _next_index(key)
+    if MENU_CACHE_TTL_SECONDS <= 0:
+        return key, index, None
+    cached = store.variants(key).get(index)
+    metrics.inc("menu_cache_lookups", labels={"result": "hit" if cached else "miss"})
+    return key, index, cached[1].encode("utf-8") if cached else None
+
+
+def save(key: str, index: int, menu: WeeklyMenu, body: bytes) -> bool:
+    """Guarda la variante salvo que el menú esté incompleto (slots con error o sin opciones)."""
+    if MENU_CACHE_TTL_SECONDS <= 0:
+        return False
+    if any(slot.error or not slot.options for _, _, slot in menu.slots()):
+        return False
+    store.put(key, index, body.decode("utf-8"))
+    return True
@@ -1,9 +1,22 @@
 from app.models.MenuRequest import MenuRequest
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set, Tuple
 from app.services.edamam_service import fetch_recipes_from_edamam, EDAMAM_MEAL_TYPE_MAP
-from app.schemas import RecipeOption, MealSlotWithOptions, DayMealsWithOptions # Ajusta la ruta
+from app.schemas import RecipeOption # Ajusta la ruta
+from app.services.menu_records import MealSlot, WeeklyMenu
+from app.services import edamam_records, metrics, recipe_index, recipe_pool, recommender
+from app.services.deadline import Deadline
 import json
 
+# Edamam devuelve como mucho 20 hits por página
+EDAMAM_PAGE_SIZE = 20
+# Menú recomendado: búsquedas máximas por tipo de comida y tamaño del pool respecto a los huecos
+RECOMMENDED_MAX_SEARCHES_PER_MEAL = 4
+RECOMMENDED_POOL_FACTOR = 2
+# Configuración por defecto del menú recomendado (endpoint y generación por lotes)
+RECOMMENDED_MEALS = ["desayuno", "comida", "cena"]
+RECOMMENDED_MEAL_RATIOS = {"desayuno": 0.30, "comida": 0.40, "cena": 0.30}
+RECOMMENDED_NUM_OPTIONS = 3
+
 def _create_recipe_option_from_data(recipe_data: Dict[str, Any]) -> Optional[RecipeOption]:
     """Helper para crear un objeto RecipeOption desde los datos de Edamam."""
     try:
@@ -63,6 +76,7 @@ def _create_recipe_option_from_data(recipe_data: Dict[str, Any]) -> Optional[Rec
             label=str(recipe_data["label"]),
             image=recipe_data.get("image"),
             url=str(recipe_data["url"]),
+            uri=recipe_data.get("uri"),
             ingredients=[str(line) for line in recipe_data.get("ingredientLines", [])],
             calories=round(calories_per_serving, 2),
             protein_g=protein_g_per_serving,
@@ -80,96 +94,212 @@ def _create_recipe_option_from_data(recipe_data: Dict[str, Any]) -> Optional[Rec
         print(f"Error al procesar datos de receta para RecipeOption: {e}. Datos: {recipe_data}")
         return None
 
-def generate_weekly_menu(base_request: MenuRequest) -> Dict[str, DayMealsWithOptions]:
-    dias_semana = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"]
-    menu_semanal_con_opciones: Dict[str, DayMealsWithOptions] = {}
+DIAS_SEMANA = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"]
 
-    if abs(sum(base_request.meal_ratios.values()) - 1.0) > 0.01:
-        raise ValueError("La suma de las proporciones calóricas debe ser 1.0")
+# Ventana calórica de cada comida: (margen sobre el objetivo, hueco mínimo entre min y max)
+WEEKLY_WINDOW = (0.15, 100)
+RECOMMENDED_WINDOW = (0.20, 150)
 
+
+def daily_calories_from_request(base_request: MenuRequest) -> int:
     # Calorías totales diarias base
     daily_calories = 2000
     if isinstance(base_request.calories, int):
         daily_calories = base_request.calories
     elif isinstance(base_request.calories, str) and base_request.calories.isdigit():
         daily_calories = int(base_request.calories)
+    return daily_calories
+
+
+def calorie_window(daily_calories: int, meal_ratio: float, margin: float, min_gap: int) -> Tuple[int, int]:
+    """(min_cal, max_cal) por ración para una comida que aporta `meal_ratio` de las calorías diarias."""
+    target_cal = int(daily_calories * meal_ratio)
+    min_cal = int(target_cal * (1 - margin))
+    max_cal = int(target_cal * (1 + margin))
+    if min_cal < 50:
+        min_cal = 50
+    if max_cal <= min_cal:
+        max_cal = min_cal + min_gap
+    return min_cal, max_cal
+
+
+def collect_candidates(
+    min_cal: int,
+    max_cal: int,
+    target_count: int,
+    max_searches: int,
+    search_params: Dict[str, Any],
+    exclude_urls: Optional[Set[str]] = None,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[List[Dict[str, Any]], List[RecipeOption]]:
+    """
+    Reúne hasta `target_count` recetas distintas cuyas calorías por ración caen en
+    [min_cal, max_cal]. Primero reutiliza el pool de recetas de la misma búsqueda (ventana
+    cuantizada + filtros) y solo si faltan llama a Edamam, con un máximo de `max_searches`
+    llamadas; lo que se descarga se añade al pool para las siguientes peticiones. Con filtros
+    (dieta, salud, excluidos, incluidos) también se lee el pool sin filtros de la misma
+    ventana, filtrado en local con recipe_index, antes de llamar a Edamam. Si se agota
+    `deadline` se deja de buscar y se devuelve lo reunido hasta entonces. Tampoco se busca más
+    si Edamam ya dijo que no hay resultados o si ya se tienen todos (recipe_pool.search_exhausted).
+    Devuelve los datos crudos de Edamam y sus RecipeOption, en el mismo orden.
+    """
+    qmin, qmax = recipe_pool.quantize_window(min_cal, max_cal)
+    key = recipe_pool.pool_key(qmin, qmax, search_params)
+    candidates_data: List[Dict[str, Any]] = []
+    candidates_options: List[RecipeOption] = []
+    seen_urls = set(exclude_urls or ())
+
+    def _add_candidates(raw_recipes_data: List[Dict[str, Any]]) -> None:
+        for recipe_data in raw_recipes_data:
+            if len(candidates_options) >= target_count:
+                break
+
+            url = recipe_data.get("url")
+            if url in seen_urls:
+                continue
 
-    for dia_nombre in dias_semana:
-        current_day_obj = DayMealsWithOptions()
-        menu_semanal_con_opciones[dia_nombre] = current_day_obj
+            option = _create_recipe_option_from_data(recipe_data)
+            if option and min_cal <= option.calories <= max_cal:
+                candidates_data.append(recipe_data)
+                candidates_options.append(option)
+                seen_urls.add(url)
+
+    _add_candidates(recipe_pool.pooled_recipes(key))
+
+    # Con filtros se aprovecha, solo para leer, el pool sin filtros de la misma ventana y comida,
+    # filtrado en local. No se le añade lo encontrado con filtros: sesgaría los menús de quien
+    # no filtra (y su tamaño contaría para search_exhausted de la búsqueda sin filtros)
+    if (recipe_index.LOCAL_FILTERING and recipe_index.has_filters(search_params)
+            and len(candidates_options) < target_count):
+        base_key = recipe_pool.pool_key(qmin, qmax, {"edamam_meal_type": search_params.get("edamam_meal_type")})
+        _add_candidates(recipe_index.filter_for_search(recipe_pool.pooled_recipes(base_key), search_params))
+
+    for _ in range(max_searches):
+        if len(candidates_options) >= target_count:
+            break
+        if deadline is not None and deadline.expired():
+            break
+        # Sin resultados en Edamam (caché negativa) o todos ya en el pool: repetir no trae nada nuevo
+        if recipe_pool.search_exhausted(key):
+            metrics.inc("recipe_searches_skipped_exhausted")
+            break
+
+        raw_recipes_data = fetch_recipes_from_edamam(
+            calorie_range_str=f"{qmin}-{qmax}",
+            num_recipes_to_get=EDAMAM_PAGE_SIZE, # Se guarda la página completa en el pool
+            deadline=deadline,
+            **search_params
+        )
+        recipe_pool.record_search_total(key, raw_recipes_data.total)
 
-        for meal_name_key in base_request.meals:
-            meal_ratio = base_request.meal_ratios.get(meal_name_key)
-            if meal_ratio is None:
-                continue
+        if not raw_recipes_data:
+            continue
 
-            target_cal = int(daily_calories * meal_ratio)
-            margin = 0.15
-            min_cal = int(target_cal * (1 - margin))
-            max_cal = int(target_cal * (1 + margin))
-            if min_cal < 50:
-                min_cal = 50
-            if max_cal <= min_cal:
-                max_cal = min_cal + 100
-
-            calorie_range = f"{min_cal}-{max_cal}"
-            edamam_type = EDAMAM_MEAL_TYPE_MAP.get(meal_name_key.lower())
-
-            # Intentos para encontrar recetas válidas
-            max_attempts = 50
-            all_valid_recipes = []
-            seen_urls = set()
-
-            for _ in range(max_attempts):
-                raw_recipes_data = fetch_recipes_from_edamam(
-                    calorie_range_str=calorie_range,
-                    num_recipes_to_get=base_request.num_options_per_meal * 2,
-                    diet_filter=base_request.diet,
-                    health_labels=base_request.health,
-                    excluded_items=base_request.excluded,
-                    included_keywords_q=base_request.included,
-                    edamam_meal_type=edamam_type
-                )
-
-                if not raw_recipes_data:
-                    continue
-
-                for recipe_data in raw_recipes_data:
-                    if len(all_valid_recipes) >= base_request.num_options_per_meal:
-                        break
-
-                    url = recipe_data.get("url")
-                    if url in seen_urls:
-                        continue
-
-                    option = _create_recipe_option_from_data(recipe_data)
-                    if option and min_cal <= option.calories <= max_cal:
-                        all_valid_recipes.append(option)
-                        seen_urls.add(url)
-
-                if len(all_valid_recipes) >= base_request.num_options_per_meal:
-                    break
-
-            current_meal_slot_obj = MealSlotWithOptions()
-            if all_valid_recipes:
-                current_meal_slot_obj.options = all_valid_recipes[:base_request.num_options_per_meal]
-            else:
-                current_meal_slot_obj.error = f"No se encontraron recetas dentro de {min_cal}-{max_cal} kcal para '{meal_name_key}'"
+        recipe_pool.pool_store.add(key, raw_recipes_data)
+        _add_candidates(raw_recipes_data)
+
+    return candidates_data, candidates_options
+
+
+def _timeout_error(meal_name_key: str) -> str:
+    metrics.inc("menu_slots_deadline_exceeded")
+    return f"Tiempo agotado antes de encontrar recetas para '{meal_name_key}'"
+
+
+def _infeasible_error(min_cal: int, max_cal: int, search_params: Dict[str, Any], meal_name_key: str) -> Optional[str]:
+    """Error del slot si Edamam ya dijo que la búsqueda (ventana + filtros) no tiene ninguna receta."""
+    qmin, qmax = recipe_pool.quantize_window(min_cal, max_cal)
+    if not recipe_pool.search_infeasible(recipe_pool.pool_key(qmin, qmax, search_params)):
+        return None
+    metrics.inc("menu_slots_infeasible")
+    return f"No existen recetas para '{meal_name_key}' entre {min_cal}-{max_cal} kcal con estos filtros"
+
+
+def _request_search_params(base_request: MenuRequest, meal_name_key: str) -> Dict[str, Any]:
+    return {
+        "diet_filter": base_request.diet,
+        "health_labels": base_request.health,
+        "excluded_items": base_request.excluded,
+        "included_keywords_q": base_request.included,
+        "edamam_meal_type": EDAMAM_MEAL_TYPE_MAP.get(meal_name_key.lower()),
+    }
+
+
+def _recommended_search_params(meal_name_key: str) -> Dict[str, Any]:
+    return {
+        "diet_filter": None,
+        "health_labels": [],
+        "excluded_items": "",
+        "included_keywords_q": None,
+        "edamam_meal_type": EDAMAM_MEAL_TYPE_MAP.get(meal_name_key.lower()),
+    }
+
+
+def _request_slot(
+    base_request: MenuRequest,
+    daily_calories: int,
+    meal_name_key: str,
+    exclude_urls: Optional[Set[str]] = None,
+    deadline: Optional[Deadline] = None,
+) -> Optional[MealSlot]:
+    """Genera un slot (día, comida) con la lógica de generate_weekly_menu."""
+    meal_ratio = base_request.meal_ratios.get(meal_name_key)
+    if meal_ratio is None:
+        return None
+
+    min_cal, max_cal = calorie_window(daily_calories, meal_ratio, *WEEKLY_WINDOW)
+
+    # Intentos para encontrar recetas válidas
+    search_params = _request_search_params(base_request, meal_name_key)
+    _, all_valid_recipes = collect_candidates(
+        min_cal, max_cal,
+        target_count=base_request.num_options_per_meal,
+        max_searches=50,
+        search_params=search_params,
+        exclude_urls=exclude_urls,
+        deadline=deadline,
+    )
+
+    current_meal_slot_obj = MealSlot()
+    infeasible = None if all_valid_recipes else _infeasible_error(min_cal, max_cal, search_params, meal_name_key)
+    if all_valid_recipes:
+        current_meal_slot_obj.options = all_valid_recipes[:base_request.num_options_per_meal]
+    elif infeasible:
+        current_meal_slot_obj.error = infeasible
+    elif deadline is not None and deadline.expired():
+        current_meal_slot_obj.error = _timeout_error(meal_name_key)
+    else:
+        current_meal_slot_obj.error = f"No se encontraron recetas dentro de {min_cal}-{max_cal} kcal para '{meal_name_key}'"
+    return current_meal_slot_obj
+
+
+@edamam_records.reported("semanal")
+def generate_weekly_menu(base_request: MenuRequest, deadline: Optional[Deadline] = None) -> WeeklyMenu:
+    """
+    Menú semanal personalizado. Con `deadline`, al agotarse el tiempo los slots que faltan se
+    rellenan solo con lo que haya en los pools (sin llamar a Edamam) o con un error de tiempo.
+    """
+    menu_semanal_con_opciones = WeeklyMenu(DIAS_SEMANA)
 
-            setattr(current_day_obj, meal_name_key, current_meal_slot_obj)
+    if abs(sum(base_request.meal_ratios.values()) - 1.0) > 0.01:
+        raise ValueError("La suma de las proporciones calóricas debe ser 1.0")
+
+    daily_calories = daily_calories_from_request(base_request)
+    # Los días comparten pool de recetas: se evita repetir la misma receta en la semana
+    used_urls: Set[str] = set()
+
+    for dia_nombre in DIAS_SEMANA:
+        for meal_name_key in base_request.meals:
+            current_meal_slot_obj = _request_slot(base_request, daily_calories, meal_name_key, used_urls, deadline)
+            if current_meal_slot_obj is not None:
+                used_urls.update(option.url for option in current_meal_slot_obj.options or [])
+                menu_semanal_con_opciones.set_slot(dia_nombre, meal_name_key, current_meal_slot_obj)
 
     return menu_semanal_con_opciones
 
-# Nueva función para generar menú recomendado
-def generate_recommended_weekly_menu(
-    user: Any, 
-    db_session: Any, 
-    meals_config: List[str], 
-    ratios_config: Dict[str, float], 
-    num_options: int = 3,
-    target_calories_override: Optional[int] = None # Nuevo parámetro
-) -> Dict[str, DayMealsWithOptions]:
-    
+
+def daily_target_calories_for_user(user: Any, target_calories_override: Optional[int] = None) -> int:
+    """Calorías diarias objetivo: el override si se indica, si no TDEE del perfil ajustado al objetivo."""
     daily_target_calories_final = 0
 
     # Decidir las calorías objetivo
@@ -208,115 +338,143 @@ def generate_recommended_weekly_menu(
             print(f"TDEE Calculado: {tdee:.0f} kcal, Ajuste por objetivo: {calorie_adjustment} kcal")
     
     print(f"Calorías Diarias Objetivo Finales para el menú: {daily_target_calories_final} kcal para usuario {user.username}")
+    return daily_target_calories_final
+
+
+def _recommended_slot_options(
+    taste: Any,
+    daily_target_calories: int,
+    meal_ratio: float,
+    meal_name_key: str,
+    needed: int,
+    max_searches: int,
+    exclude_urls: Optional[Set[str]] = None,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[List[RecipeOption], int, int]:
+    """
+    Reúne candidatas para una comida con búsquedas generales (sin 'q') y las ordena localmente
+    por similitud con el gusto del usuario. Devuelve las `needed` mejores y la ventana calórica.
+    """
+    min_cal, max_cal = calorie_window(daily_target_calories, meal_ratio, *RECOMMENDED_WINDOW)
+    candidates_data, candidates_options = collect_candidates(
+        min_cal, max_cal,
+        target_count=needed * RECOMMENDED_POOL_FACTOR, # Más candidatas que huecos para que el ranking elija
+        max_searches=max_searches,
+        search_params=_recommended_search_params(meal_name_key),
+        exclude_urls=exclude_urls,
+        deadline=deadline,
+    )
+    ranked = [candidates_options[i] for i in recommender.rank_order(taste, candidates_data)][:needed]
+    print(f"{meal_name_key}: {len(candidates_options)} candidatas, {len(ranked)} elegidas (con gusto: {taste is not None})")
+    return ranked, min_cal, max_cal
 
-    # 2. Obtener y procesar recetas favoritas para palabras clave (lógica existente)
-    favorite_keywords = []
-    if user.recetas_favoritas:
-        try:
-            # Asumiendo que recetas_favoritas es una lista de objetos ya parseada si viene de la DB, o un string JSON
-            fav_recipes_data = user.recetas_favoritas
-            if isinstance(user.recetas_favoritas, str):
-                fav_recipes_data = json.loads(user.recetas_favoritas)
-            
-            if isinstance(fav_recipes_data, list):
-                for recipe in fav_recipes_data:
-                    if isinstance(recipe, dict) and recipe.get("label"):
-                        keywords = recipe.get("label").split()[:3]
-                        favorite_keywords.extend([kw.lower() for kw in keywords if len(kw) > 3])
-                favorite_keywords = list(set(favorite_keywords))[:5]
-                print(f"Palabras clave de favoritos para {user.username}: {favorite_keywords}")
-        except Exception as e:
-            print(f"Error al procesar recetas favoritas para keywords ({user.username}): {e}")
-            favorite_keywords = []
+
+# Nueva función para generar menú recomendado
+@edamam_records.reported("recomendado")
+def generate_recommended_weekly_menu(
+    user: Any, 
+    db_session: Any, 
+    meals_config: List[str], 
+    ratios_config: Dict[str, float], 
+    num_options: int = 3,
+    target_calories_override: Optional[int] = None, # Nuevo parámetro
+    deadline: Optional[Deadline] = None,
+) -> WeeklyMenu:
     
-    base_search_params = {
-        "diet_filter": None, 
-        "health_labels": [], 
-        "excluded_items": "",
-    }
+    daily_target_calories_final = daily_target_calories_for_user(user, target_calories_override)
+
+    # 2. Vector de gusto del usuario (TF-IDF de ingredientes/etiquetas de sus favoritas).
+    # Se recalcula solo cuando cambian los favoritos, no en cada llamada.
+    taste = recommender.taste_for_user(user, db_session)
 
-    dias_semana = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"]
-    menu_semanal_con_opciones: Dict[str, DayMealsWithOptions] = {}
+    menu_semanal_con_opciones = WeeklyMenu(DIAS_SEMANA)
 
     if abs(sum(ratios_config.values()) - 1.0) > 0.01:
         # Esto debería validarse antes, pero es una doble comprobación
         raise ValueError("La suma de las proporciones calóricas para comidas debe ser 1.0")
 
-    for dia_nombre in dias_semana:
-        current_day_obj = DayMealsWithOptions()
-        menu_semanal_con_opciones[dia_nombre] = current_day_obj
-
-        for meal_name_key in meals_config:
-            meal_ratio = ratios_config.get(meal_name_key)
-            if meal_ratio is None: 
-                print(f"Advertencia: No se encontró ratio para {meal_name_key}. Se omitirá.")
-                continue
-
-            # Usar las calorías diarias finales para calcular las calorías de esta comida
-            target_cal_meal = int(daily_target_calories_final * meal_ratio)
-            margin = 0.20 
-            min_cal = int(target_cal_meal * (1 - margin))
-            max_cal = int(target_cal_meal * (1 + margin))
-            if min_cal < 50: min_cal = 50
-            if max_cal <= min_cal: max_cal = min_cal + 150
-
-            calorie_range = f"{min_cal}-{max_cal}"
-            edamam_type = EDAMAM_MEAL_TYPE_MAP.get(meal_name_key.lower())
-            
-            current_keywords_q = " ".join(favorite_keywords) if favorite_keywords else None
-            
-            max_attempts = 2 # Reducido para recomendaciones más rápidas
-            all_valid_recipes = []
-            seen_urls = set()
-
-            # Lógica de búsqueda (similar a la original, pero más concisa para el ejemplo)
-            # Intento 1: Con keywords de favoritos (si existen)
-            if current_keywords_q:
-                # print(f"Buscando para {dia_nombre}-{meal_name_key} con keywords: '{current_keywords_q}', rango: {calorie_range}")
-                raw_recipes_data = fetch_recipes_from_edamam(
-                    calorie_range_str=calorie_range, num_recipes_to_get=num_options * 2, 
-                    diet_filter=base_search_params["diet_filter"], health_labels=base_search_params["health_labels"],
-                    excluded_items=base_search_params["excluded_items"], included_keywords_q=current_keywords_q,
-                    edamam_meal_type=edamam_type
-                )
-                if raw_recipes_data:
-                    for recipe_data in raw_recipes_data:
-                        if len(all_valid_recipes) >= num_options: break
-                        url = recipe_data.get("url")
-                        if url in seen_urls: continue
-                        option = _create_recipe_option_from_data(recipe_data)
-                        if option and min_cal <= option.calories <= max_cal:
-                            all_valid_recipes.append(option)
-                            seen_urls.add(url)
-            
-            # Intento 2: Búsqueda general si no se completaron opciones o no había keywords
-            if len(all_valid_recipes) < num_options:
-                needed_more = num_options - len(all_valid_recipes)
-                # print(f"Recbuscando para {dia_nombre}-{meal_name_key} sin keywords o para completar {needed_more} opciones más.")
-                raw_recipes_data = fetch_recipes_from_edamam(
-                    calorie_range_str=calorie_range, num_recipes_to_get=needed_more * 2,
-                    diet_filter=base_search_params["diet_filter"], health_labels=base_search_params["health_labels"],
-                    excluded_items=base_search_params["excluded_items"], included_keywords_q=None,
-                    edamam_meal_type=edamam_type
-                )
-                if raw_recipes_data:
-                    for recipe_data in raw_recipes_data:
-                        if len(all_valid_recipes) >= num_options: break
-                        url = recipe_data.get("url")
-                        if url in seen_urls: continue
-                        option = _create_recipe_option_from_data(recipe_data)
-                        if option and min_cal <= option.calories <= max_cal:
-                            all_valid_recipes.append(option)
-                            seen_urls.add(url)
-
-            current_meal_slot_obj = MealSlotWithOptions()
-            if all_valid_recipes:
-                current_meal_slot_obj.options = all_valid_recipes[:num_options]
+    # 3. Por cada tipo de comida se llena un único pool de candidatas, se ordena por similitud
+    # con el gusto del usuario y se reparte entre los días. Son unas pocas llamadas a Edamam
+    # por comida en lugar de 1-2 por cada día.
+    for meal_name_key in meals_config:
+        meal_ratio = ratios_config.get(meal_name_key)
+        if meal_ratio is None: 
+            print(f"Advertencia: No se encontró ratio para {meal_name_key}. Se omitirá.")
+            continue
+
+        ranked, min_cal, max_cal = _recommended_slot_options(
+            taste, daily_target_calories_final, meal_ratio, meal_name_key,
+            needed=len(DIAS_SEMANA) * num_options,
+            max_searches=RECOMMENDED_MAX_SEARCHES_PER_MEAL,
+            deadline=deadline,
+        )
+        timed_out = deadline is not None and deadline.expired()
+
+        for day_index, dia_nombre in enumerate(DIAS_SEMANA):
+            # Reparto alterno (0, 7, 14... para el lunes) para que las mejores no se concentren al inicio de la semana
+            day_options = ranked[day_index::len(DIAS_SEMANA)][:num_options]
+            current_meal_slot_obj = MealSlot()
+            if day_options:
+                current_meal_slot_obj.options = day_options
+            elif timed_out:
+                current_meal_slot_obj.error = _timeout_error(meal_name_key)
             else:
                 current_meal_slot_obj.error = f"No recetas: {min_cal}-{max_cal} kcal para '{meal_name_key}'"
-            
-            setattr(current_day_obj, meal_name_key, current_meal_slot_obj)
-            # print(f"-> {dia_nombre}, {meal_name_key}: {len(current_meal_slot_obj.options if current_meal_slot_obj.options else [])} opciones. Rango cal: {calorie_range}")
+            menu_semanal_con_opciones.set_slot(dia_nombre, meal_name_key, current_meal_slot_obj)
 
     return menu_semanal_con_opciones
 
+
+@edamam_records.reported("regenerado")
+def regenerate_slots(
+    dia: str,
+    meals: List[str],
+    exclude_urls: Set[str],
+    base_request: Optional[MenuRequest] = None,
+    user: Any = None,
+    recommended: bool = False,
+    ratios_config: Optional[Dict[str, float]] = None,
+    num_options: int = 3,
+    target_calories_override: Optional[int] = None,
+    db_session: Any = None,
+    deadline: Optional[Deadline] = None,
+) -> WeeklyMenu:
+    """
+    Regenera solo las comidas `meals` del día `dia`, con la misma ventana calórica que el menú
+    semanal (personalizado con `base_request`, o recomendado para `user` si `recommended`),
+    excluyendo las recetas de `exclude_urls` (normalmente las del menú actual del usuario).
+    Devuelve un WeeklyMenu con únicamente esos slots del día `dia` rellenos.
+    """
+    menu = WeeklyMenu([dia])
+
+    if recommended:
+        ratios_config = ratios_config or {}
+        daily_target = daily_target_calories_for_user(user, target_calories_override)
+        taste = recommender.taste_for_user(user, db_session)
+        for meal_name_key in meals:
+            meal_ratio = ratios_config.get(meal_name_key)
+            if meal_ratio is None:
+                raise ValueError(f"Comida no válida: '{meal_name_key}'")
+            options, min_cal, max_cal = _recommended_slot_options(
+                taste, daily_target, meal_ratio, meal_name_key,
+                needed=num_options, max_searches=2, exclude_urls=exclude_urls, deadline=deadline,
+            )
+            slot = MealSlot()
+            if options:
+                slot.options = options
+            elif deadline is not None and deadline.expired():
+                slot.error = _timeout_error(meal_name_key)
+            else:
+                slot.error = f"No recetas: {min_cal}-{max_cal} kcal para '{meal_name_key}'"
+            menu.set_slot(dia, meal_name_key, slot)
+    else:
+        if abs(sum(base_request.meal_ratios.values()) - 1.0) > 0.01:
+            raise ValueError("La suma de las proporciones calóricas debe ser 1.0")
+        daily_calories = daily_calories_from_request(base_request)
+        for meal_name_key in meals:
+            slot = _request_slot(base_request, daily_calories, meal_name_key, exclude_urls, deadline)
+            if slot is None:
+                raise ValueError(f"Comida no válida: '{meal_name_key}'")
+            menu.set_slot(dia, meal_name_key, slot)
+
+    return menu
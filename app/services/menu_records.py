@@ -0,0 +1,69 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.schemas import DayMealsWithOptions, MealSlotWithOptions, RecipeOption, WeeklyMenuWithOptionsResponse
+
+
+class MealSlot:
+    """Opciones (o error) de una comida de un día. Las RecipeOption ya vienen validadas al crearse."""
+
+    __slots__ = ("options", "error")
+
+    def __init__(self, options: Optional[List[RecipeOption]] = None, error: Optional[str] = None):
+        self.options = options
+        self.error = error
+
+
+class WeeklyMenu:
+    """
+    Menú interno de los generadores: {día: {comida: MealSlot}}. Se convierte a la respuesta una
+    sola vez, sin volver a validar cada RecipeOption contra el response_model.
+    """
+
+    __slots__ = ("days",)
+
+    def __init__(self, days: Optional[List[str]] = None):
+        self.days: Dict[str, Dict[str, MealSlot]] = {dia: {} for dia in days or []}
+
+    def set_slot(self, dia: str, meal: str, slot: MealSlot) -> None:
+        self.days.setdefault(dia, {})[meal] = slot
+
+    def get_slot(self, dia: str, meal: str) -> Optional[MealSlot]:
+        return self.days.get(dia, {}).get(meal)
+
+    def slots(self) -> Iterator[Tuple[str, str, MealSlot]]:
+        for dia, comidas in self.days.items():
+            for meal, slot in comidas.items():
+                yield dia, meal, slot
+
+    def option_urls(self) -> List[str]:
+        return [option.url for _, _, slot in self.slots() for option in slot.options or []]
+
+    def to_response_model(self) -> WeeklyMenuWithOptionsResponse:
+        """
+        WeeklyMenuWithOptionsResponse montado con model_construct (sin validación): los datos ya
+        son de confianza. Las claves sin tilde (miercoles, sabado) se pasan al campo con alias.
+        """
+        dias = {}
+        for name, field in WeeklyMenuWithOptionsResponse.model_fields.items():
+            comidas = self.days.get(field.alias or name)
+            if comidas is not None:
+                dias[name] = DayMealsWithOptions.model_construct(**{
+                    meal: MealSlotWithOptions.model_construct(options=slot.options, error=slot.error)
+                    for meal, slot in comidas.items()
+                })
+        return WeeklyMenuWithOptionsResponse.model_construct(**dias)
+
+    def to_response_json(self, exclude_none: bool = False) -> bytes:
+        """Mismo JSON que FastAPI generaría con el response_model (y response_model_exclude_none)."""
+        return self.to_response_model().model_dump_json(by_alias=True, exclude_none=exclude_none).encode("utf-8")
+
+    def to_saved_menu(self) -> Dict[str, Any]:
+        """Formato de `last_generated_menu_json` ({"menu": {día: {comida: slot}}}), con la primera opción elegida."""
+        days: Dict[str, Dict[str, Any]] = {}
+        for dia, meal, slot in self.slots():
+            options = [option.model_dump(mode="json") for option in slot.options or []]
+            saved = {"selected": options[0] if options else None, "options": options}
+            if slot.error:
+                saved["error"] = slot.error
+            days.setdefault(dia, {})[meal] = saved
+        return {"menu": days}
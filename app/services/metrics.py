@@ -0,0 +1,75 @@
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+# Número de observaciones recientes que se guardan por métrica para calcular percentiles
+RESERVOIR_SIZE = 1024
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_histograms: Dict[Tuple[str, Tuple], Dict[str, Any]] = {}
+
+
+def _key(name: str, labels: Optional[Dict[str, str]]) -> Tuple[str, Tuple]:
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def inc(name: str, value: float = 1, labels: Optional[Dict[str, str]] = None) -> None:
+    """Incrementa un contador (ej. inc("gemini_stream_cancelled"))."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+    """Registra una observación (ej. una latencia en segundos) en un histograma simple."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = {"count": 0, "sum": 0.0, "min": value, "max": value, "recent": deque(maxlen=RESERVOIR_SIZE)}
+            _histograms[key] = hist
+        hist["count"] += 1
+        hist["sum"] += value
+        hist["min"] = min(hist["min"], value)
+        hist["max"] = max(hist["max"], value)
+        hist["recent"].append(value)
+
+
+def _percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def _label_str(name: str, labels: Tuple) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+def snapshot() -> Dict[str, Any]:
+    """Estado actual de todas las métricas del proceso, listo para devolver como JSON."""
+    with _lock:
+        counters = {_label_str(name, labels): value for (name, labels), value in _counters.items()}
+        histograms = {}
+        for (name, labels), hist in _histograms.items():
+            recent = sorted(hist["recent"])
+            histograms[_label_str(name, labels)] = {
+                "count": hist["count"],
+                "sum": round(hist["sum"], 6),
+                "avg": round(hist["sum"] / hist["count"], 6) if hist["count"] else 0.0,
+                "min": round(hist["min"], 6),
+                "max": round(hist["max"], 6),
+                "p50": round(_percentile(recent, 0.50), 6),
+                "p95": round(_percentile(recent, 0.95), 6),
+                "p99": round(_percentile(recent, 0.99), 6),
+            }
+    return {"counters": counters, "histograms": histograms}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
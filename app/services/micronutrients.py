@@ -0,0 +1,224 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.saved_menu import selected_recipe
+
+# Análisis de micronutrientes a partir de `total_nutrients_raw` de las recetas seleccionadas.
+# Cada receta se convierte en una fila de una matriz de columnas fijas (valores por ración) y los
+# totales por día, por semana y del periodo, y sus porcentajes sobre la ingesta de referencia,
+# se calculan con operaciones sobre la matriz entera, sin bucles por nutriente.
+#
+# Referencias: valores diarios (Daily Values) de la FDA para adultos. Las marcadas con escala se
+# definen para 2000 kcal y se ajustan a las calorías objetivo del usuario.
+# (código Edamam, nombre, unidad, referencia diaria, escala con la energía, tipo)
+#   tipo: "minimo" (conviene llegar), "maximo" (conviene no pasarse), "objetivo" o None (sin alertas)
+NUTRIENTS: Tuple[Tuple[str, str, str, Optional[float], bool, Optional[str]], ...] = (
+    ("ENERC_KCAL", "Energía", "kcal", 2000, True, "objetivo"),
+    ("PROCNT", "Proteínas", "g", 50, True, "minimo"),
+    ("FAT", "Grasas", "g", 78, True, "maximo"),
+    ("FASAT", "Grasas saturadas", "g", 20, True, "maximo"),
+    ("CHOCDF", "Carbohidratos", "g", 275, True, "objetivo"),
+    ("FIBTG", "Fibra", "g", 28, True, "minimo"),
+    ("SUGAR", "Azúcares", "g", None, False, None),
+    ("SUGAR.added", "Azúcares añadidos", "g", 50, True, "maximo"),
+    ("CHOLE", "Colesterol", "mg", 300, False, "maximo"),
+    ("NA", "Sodio", "mg", 2300, False, "maximo"),
+    ("CA", "Calcio", "mg", 1300, False, "minimo"),
+    ("MG", "Magnesio", "mg", 420, False, "minimo"),
+    ("K", "Potasio", "mg", 4700, False, "minimo"),
+    ("FE", "Hierro", "mg", 18, False, "minimo"),
+    ("ZN", "Zinc", "mg", 11, False, "minimo"),
+    ("P", "Fósforo", "mg", 1250, False, "minimo"),
+    ("VITA_RAE", "Vitamina A", "µg", 900, False, "minimo"),
+    ("VITC", "Vitamina C", "mg", 90, False, "minimo"),
+    ("THIA", "Tiamina (B1)", "mg", 1.2, False, "minimo"),
+    ("RIBF", "Riboflavina (B2)", "mg", 1.3, False, "minimo"),
+    ("NIA", "Niacina (B3)", "mg", 16, False, "minimo"),
+    ("VITB6A", "Vitamina B6", "mg", 1.7, False, "minimo"),
+    ("FOLDFE", "Folato", "µg", 400, False, "minimo"),
+    ("VITB12", "Vitamina B12", "µg", 2.4, False, "minimo"),
+    ("VITD", "Vitamina D", "µg", 20, False, "minimo"),
+    ("TOCPHA", "Vitamina E", "mg", 15, False, "minimo"),
+    ("VITK1", "Vitamina K", "µg", 120, False, "minimo"),
+)
+CODES = tuple(n[0] for n in NUTRIENTS)
+COLUMN = {code: i for i, code in enumerate(CODES)}
+REFERENCE_CALORIES = 2000
+
+_BASE_REFERENCE = np.array([np.nan if n[3] is None else n[3] for n in NUTRIENTS], dtype=float)
+_ENERGY_SCALED = np.array([n[4] for n in NUTRIENTS], dtype=bool)
+_MINIMUM = np.array([n[5] == "minimo" for n in NUTRIENTS], dtype=bool)
+_MAXIMUM = np.array([n[5] == "maximo" for n in NUTRIENTS], dtype=bool)
+
+# Alertas sobre el promedio diario: por debajo de este % en los "minimo", por encima de 100% en los "maximo"
+MICRONUTRIENT_LOW_PCT = float(os.getenv("MICRONUTRIENT_LOW_PCT", "70"))
+
+
+def reference_intakes(daily_calories: Optional[float] = None) -> np.ndarray:
+    """Vector de referencias diarias (NaN si no hay), con las de energía y macros ajustadas a `daily_calories`."""
+    reference = _BASE_REFERENCE.copy()
+    if daily_calories and daily_calories > 0:
+        reference[_ENERGY_SCALED] *= daily_calories / REFERENCE_CALORIES
+    return reference
+
+
+def _serving_factor(recipe: Dict[str, Any], raw: Dict[str, Any]) -> Optional[float]:
+    """
+    total_nutrients_raw es de la receta entera y `calories` es por ración: la proporción entre
+    ambas da el número de raciones. None si no se puede saber (la receta no cuenta).
+    """
+    energy = raw.get("ENERC_KCAL")
+    try:
+        total = float(energy["quantity"]) if isinstance(energy, dict) else 0.0
+        per_serving = float(recipe.get("calories") or 0.0)
+    except (TypeError, ValueError, KeyError):
+        return None
+    if total <= 0 or per_serving <= 0:
+        return None
+    return per_serving / total
+
+
+class NutrientMatrix:
+    """
+    Recetas seleccionadas de uno o varios menús semanales, como matriz (recetas x NUTRIENTS) de
+    valores por ración, con el día de cada receta y la semana de cada día.
+    """
+
+    def __init__(self, weeks: Sequence[Dict[str, Any]]):
+        self.day_names: List[str] = []
+        self.day_week: List[int] = []
+        self.recipes_without_data = 0
+        recipe_day: List[int] = []
+        factors: List[float] = []
+        rows: List[int] = []
+        cols: List[int] = []
+        quantities: List[float] = []
+
+        # Único bucle en Python: aplanar (día, receta, nutriente) en arrays de coordenadas
+        for week_index, menu_items in enumerate(weeks):
+            for dia_nombre, comidas_del_dia in menu_items.items():
+                if not isinstance(comidas_del_dia, dict):
+                    continue
+                day_id = len(self.day_names)
+                self.day_names.append(dia_nombre)
+                self.day_week.append(week_index)
+                for slot_comida in comidas_del_dia.values():
+                    receta = selected_recipe(slot_comida)
+                    if not receta:
+                        continue
+                    raw = receta.get("total_nutrients_raw")
+                    factor = _serving_factor(receta, raw) if isinstance(raw, dict) else None
+                    if factor is None:
+                        self.recipes_without_data += 1
+                        continue
+                    row = len(recipe_day)
+                    recipe_day.append(day_id)
+                    factors.append(factor)
+                    for code, nutrient in raw.items():
+                        col = COLUMN.get(code)
+                        if col is None or not isinstance(nutrient, dict):
+                            continue
+                        try:
+                            quantities.append(float(nutrient.get("quantity") or 0.0))
+                        except (TypeError, ValueError):
+                            continue
+                        rows.append(row)
+                        cols.append(col)
+
+        self.n_weeks = len(weeks)
+        self.values = np.zeros((len(recipe_day), len(CODES)))
+        self.values[np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)] = quantities
+        self.values *= np.asarray(factors, dtype=float)[:, None]
+        # Nutrientes que alguna receta trae: el resto no es 0, es desconocido (None en la respuesta)
+        self.known = np.zeros(len(CODES), dtype=bool)
+        self.known[np.asarray(cols, dtype=np.intp)] = True
+        self.recipe_day = np.asarray(recipe_day, dtype=np.intp)
+
+    def day_totals(self) -> np.ndarray:
+        totals = np.zeros((len(self.day_names), len(CODES)))
+        np.add.at(totals, self.recipe_day, self.values)
+        return totals
+
+    def analyze(self, daily_calories: Optional[float] = None) -> Dict[str, Any]:
+        """Totales y % de la referencia por día, por semana (promedio diario) y del periodo."""
+        reference = reference_intakes(daily_calories)
+        day_totals = self.day_totals()
+        day_totals[:, ~self.known] = np.nan
+        day_has_data = np.bincount(self.recipe_day, minlength=len(self.day_names)) > 0
+        day_week = np.asarray(self.day_week, dtype=np.intp)
+
+        week_totals = np.zeros((self.n_weeks, len(CODES)))
+        np.add.at(week_totals, day_week[day_has_data], day_totals[day_has_data])
+        week_days = np.bincount(day_week[day_has_data], minlength=self.n_weeks)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            week_average = week_totals / week_days[:, None]
+            day_pct = day_totals / reference * 100
+            week_pct = week_average / reference * 100
+            total = day_totals.sum(axis=0)
+            days = int(day_has_data.sum())
+            average = total / days if days else np.zeros(len(CODES))
+            average_pct = average / reference * 100
+
+        return {
+            "nutrientes": [
+                {"codigo": code, "nombre": n[1], "unidad": n[2], "referenciaDiaria": _number(ref)}
+                for code, n, ref in zip(CODES, NUTRIENTS, reference.tolist())
+            ],
+            "caloriasReferencia": daily_calories or REFERENCE_CALORIES,
+            "diasConDatos": days,
+            "recetasSinDatos": self.recipes_without_data,
+            "periodo": {
+                "total": _by_code(total),
+                "promedioDia": _by_code(average),
+                "porcentajeReferencia": _by_code(average_pct, 1),
+            },
+            "semanas": [
+                {
+                    "semana": w + 1,
+                    "diasConDatos": int(week_days[w]),
+                    "promedioDia": _by_code(week_average[w]),
+                    "porcentajeReferencia": _by_code(week_pct[w], 1),
+                }
+                for w in range(self.n_weeks)
+            ],
+            "dias": [
+                {
+                    "semana": self.day_week[d] + 1,
+                    "dia": self.day_names[d],
+                    "total": _by_code(day_totals[d]),
+                    "porcentajeReferencia": _by_code(day_pct[d], 1),
+                }
+                for d in np.flatnonzero(day_has_data).tolist()
+            ],
+            "alertas": _alerts(average_pct) if days else [],
+        }
+
+
+def _number(value: float, decimals: int = 2) -> Optional[float]:
+    return None if value != value else round(value, decimals)  # NaN -> None
+
+
+def _by_code(row: np.ndarray, decimals: int = 2) -> Dict[str, Optional[float]]:
+    return {code: _number(v, decimals) for code, v in zip(CODES, np.round(row, decimals).tolist())}
+
+
+def _alerts(average_pct: np.ndarray) -> List[Dict[str, Any]]:
+    with np.errstate(invalid="ignore"):
+        low = _MINIMUM & (average_pct < MICRONUTRIENT_LOW_PCT)
+        high = _MAXIMUM & (average_pct > 100)
+    return [
+        {
+            "codigo": CODES[i],
+            "nombre": NUTRIENTS[i][1],
+            "porcentajeReferencia": _number(float(average_pct[i]), 1),
+            "tipo": "bajo" if low[i] else "exceso",
+        }
+        for i in np.flatnonzero(low | high).tolist()
+    ]
+
+
+def analyze_weeks(weeks: Sequence[Dict[str, Any]], daily_calories: Optional[float] = None) -> Dict[str, Any]:
+    """Análisis de micronutrientes de una lista de menús semanales (día -> comida -> slot guardado)."""
+    return NutrientMatrix(weeks).analyze(daily_calories)
@@ -0,0 +1,274 @@
+import contextvars
+import cProfile
+import heapq
+import hmac
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services.cache import TTLCache
+
+# Perfilado bajo demanda de peticiones sueltas. Desactivado por defecto: si PROFILING_ENABLED no
+# está activo el middleware ni siquiera se añade a la app (coste cero).
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_DEFAULT_MODE = os.getenv("PROFILING_MODE", "sampling")  # "sampling" o "cprofile"
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "5"))
+PROFILING_KEEP_SLOWEST = int(os.getenv("PROFILING_KEEP_SLOWEST", "20"))
+PROFILING_KEEP_RECENT = int(os.getenv("PROFILING_KEEP_RECENT", "20"))
+PROFILING_TOP_FUNCTIONS = int(os.getenv("PROFILING_TOP_FUNCTIONS", "60"))
+
+MODES = ("sampling", "cprofile")
+HEADER = b"x-profile"  # Valor: PROFILING_TOKEN
+MODE_HEADER = b"x-profile-mode"
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if PROFILING_ENABLED and not PROFILING_TOKEN:
+    print("ADVERTENCIA: PROFILING_ENABLED sin PROFILING_TOKEN; el perfilado queda desactivado.")
+    PROFILING_ENABLED = False
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    return bool(PROFILING_ENABLED and token and hmac.compare_digest(token, PROFILING_TOKEN))
+
+
+# --- Almacén: los N perfiles más lentos + los últimos perfilados -----------------------------
+
+class ProfileStore:
+    def __init__(self, keep_slowest: int = PROFILING_KEEP_SLOWEST, keep_recent: int = PROFILING_KEEP_RECENT):
+        self.keep_slowest = keep_slowest
+        self._slowest: List[tuple] = []  # montículo (duración, id, perfil): el más rápido arriba
+        self._recent = TTLCache(max_entries=keep_recent)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Dict[str, Any]) -> None:
+        with self._lock:
+            self._recent.set(profile["id"], profile)
+            entry = (profile["duracion_ms"], profile["id"], profile)
+            if len(self._slowest) < self.keep_slowest:
+                heapq.heappush(self._slowest, entry)
+            elif entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            profile = self._recent.get(profile_id)
+            if profile is None:
+                profile = next((p for _, pid, p in self._slowest if pid == profile_id), None)
+            return profile
+
+    def summary(self) -> Dict[str, List[Dict[str, Any]]]:
+        def _resumen(p):
+            return {k: p[k] for k in ("id", "metodo", "ruta", "status", "modo", "duracion_ms", "inicio", "muestras")}
+
+        with self._lock:
+            slowest = [p for _, _, p in sorted(self._slowest, key=lambda e: e[0], reverse=True)]
+        return {"mas_lentos": [_resumen(p) for p in slowest]}
+
+
+store = ProfileStore()
+
+
+# --- Perfiladores -------------------------------------------------------------------------
+
+# Perfilador cProfile de la petición en curso, para poder perfilar también el trabajo que se
+# manda al threadpool (cProfile solo ve el hilo en el que se activa).
+_current_cprofile: contextvars.ContextVar = contextvars.ContextVar("current_cprofile", default=None)
+
+
+class CProfileSession:
+    """cProfile del hilo del event loop (+ hilos que usen call_profiled). Salida: pstats."""
+
+    mode = "cprofile"
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self._extra: List[cProfile.Profile] = []
+        self._extra_lock = threading.Lock()
+        self.samples = None
+
+    def start(self) -> None:
+        self._token = _current_cprofile.set(self)
+        self.profiler.enable()
+
+    def stop(self) -> None:
+        self.profiler.disable()
+        _current_cprofile.reset(self._token)
+
+    def add_thread_profile(self, profiler: cProfile.Profile) -> None:
+        with self._extra_lock:
+            self._extra.append(profiler)
+
+    def _stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        for extra in self._extra:
+            stats.add(extra)
+        return stats
+
+    def render(self) -> Dict[str, Any]:
+        stats = self._stats()
+        texto = io.StringIO()
+        stats.stream = texto
+        stats.sort_stats("cumulative").print_stats(PROFILING_TOP_FUNCTIONS)
+        return {"texto": texto.getvalue(), "pstats": marshal.dumps(stats.stats)}
+
+
+def call_profiled(fn: Callable, *args, **kwargs):
+    """
+    Ejecuta `fn` en el hilo actual y, si la petición que lo lanzó se está perfilando con cProfile,
+    añade su perfil al de la petición. Pensado para el trabajo que se manda al threadpool.
+    """
+    session = _current_cprofile.get()
+    if session is None:
+        return fn(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Otro perfilador activo en este hilo
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        session.add_thread_profile(profiler)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_APP_DIR):
+        filename = "app" + filename[len(_APP_DIR):]
+    else:
+        filename = os.path.basename(filename)
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({filename})"
+
+
+def _collapse(frame) -> Optional[str]:
+    nombres = []
+    en_app = False
+    while frame is not None:
+        nombres.append(_frame_name(frame))
+        en_app = en_app or frame.f_code.co_filename.startswith(_APP_DIR)
+        frame = frame.f_back
+    return ";".join(reversed(nombres)) if en_app else None
+
+
+class SamplingSession:
+    """
+    Muestreo periódico de pilas (sys._current_frames) del hilo del event loop y de los hilos del
+    threadpool que estén ejecutando código de la app. Salida: pilas colapsadas para flamegraph.pl
+    o speedscope. Con otras peticiones en paralelo también pueden aparecer sus pilas.
+    """
+
+    mode = "sampling"
+
+    def __init__(self, interval_ms: float = PROFILING_SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.loop_thread = threading.get_ident()
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        worker_ids = {t.ident for t in threading.enumerate() if t.name.startswith("AnyIO worker thread")}
+        for ident, frame in sys._current_frames().items():
+            if ident != self.loop_thread and ident not in worker_ids:
+                continue
+            stack = _collapse(frame)
+            if stack:
+                self.counts[stack] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def render(self) -> Dict[str, Any]:
+        lineas = [f"{stack} {count}" for stack, count in self.counts.most_common()]
+        return {"texto": "\n".join(lineas) + ("\n" if lineas else ""), "pstats": None}
+
+
+# --- Middleware ---------------------------------------------------------------------------
+
+# Una sola petición perfilada a la vez por proceso (cProfile no admite dos perfiladores activos)
+_busy = threading.Lock()
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI. Si la petición trae `X-Profile: <PROFILING_TOKEN>` se perfila entera
+    (modo por defecto PROFILING_MODE, o el de `X-Profile-Mode`), se guarda en `store` y se
+    devuelve su id en la cabecera `X-Profile-Id`. El resto de peticiones pasan sin coste extra.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        token = headers.get(HEADER)
+        if token is None or not is_authorized(token.decode("latin-1")):
+            await self.app(scope, receive, send)
+            return
+
+        mode = headers.get(MODE_HEADER, PROFILING_DEFAULT_MODE.encode()).decode("latin-1").lower()
+        if mode not in MODES or not _busy.acquire(blocking=False):
+            await self.app(scope, receive, _with_header(send, b"x-profile-status", b"ocupado" if mode in MODES else b"modo-no-valido"))
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        session = CProfileSession() if mode == "cprofile" else SamplingSession()
+        status = {"code": None}
+
+        inicio = time.time()
+        t0 = time.perf_counter()
+        session.start()
+        try:
+            await self.app(scope, receive, _with_header(send, b"x-profile-id", profile_id.encode(), status))
+        finally:
+            session.stop()
+            _busy.release()
+            duracion_ms = (time.perf_counter() - t0) * 1000
+            store.add({
+                "id": profile_id,
+                "metodo": scope.get("method"),
+                "ruta": scope.get("path"),
+                "status": status["code"],
+                "modo": session.mode,
+                "duracion_ms": round(duracion_ms, 2),
+                "inicio": inicio,
+                "muestras": session.samples,
+                **session.render(),
+            })
+            print(f"Perfil {profile_id} ({session.mode}) {scope.get('method')} {scope.get('path')}: {duracion_ms:.0f} ms")
+
+
+def _with_header(send, name: bytes, value: bytes, status: Optional[Dict[str, Any]] = None):
+    async def _send(message):
+        if message["type"] == "http.response.start":
+            if status is not None:
+                status["code"] = message["status"]
+            message = dict(message, headers=list(message.get("headers", [])) + [(name, value)])
+        await send(message)
+    return _send
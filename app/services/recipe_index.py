@@ -0,0 +1,162 @@
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.services import metrics
+
+# Índice local de las recetas ya descargadas, para aplicar en memoria los filtros de MenuRequest
+# (diet, health, excluded, included) que antes solo podía aplicar Edamam. Así una petición con
+# filtros puede reutilizar las recetas del pool sin filtros de la misma ventana calórica.
+#  - índice invertido: token normalizado de ingredientes/título -> bitset (int) de ids de receta
+#  - etiquetas de salud/dieta: bitset por receta sobre un vocabulario de etiquetas
+LOCAL_FILTERING = os.getenv("RECIPE_LOCAL_FILTERING", "true").lower() in ("1", "true", "yes")
+# Al superarlo se vacía el índice y se vuelve a llenar con las recetas que se sigan usando
+RECIPE_INDEX_MAX_RECIPES = int(os.getenv("RECIPE_INDEX_MAX_RECIPES", "20000"))
+
+
+def _normalize(texto: str) -> str:
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii").lower()
+
+
+def _singular(word: str) -> str:
+    # Lo justo para que "eggs" encuentre "egg" o "tomatoes" encuentre "tomato"
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokens(texto: str) -> List[str]:
+    return [_singular(w) for w in re.findall(r"[a-z]+", _normalize(texto)) if len(w) > 1]
+
+
+def normalize_label(label: str) -> str:
+    """'Gluten-Free' / 'gluten free' -> 'gluten-free' (formato del parámetro health de Edamam)."""
+    return "-".join(re.findall(r"[a-z0-9]+", _normalize(label)))
+
+
+def _phrases(value: Any) -> List[List[str]]:
+    """Cada elemento ("peanut butter") como lista de tokens; los vacíos se ignoran."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return [t for t in (tokens(str(v)) for v in value) if t]
+
+
+class RecipeIndex:
+    """Ids internos por URL, índice invertido de tokens y máscara de etiquetas por receta."""
+
+    def __init__(self, max_recipes: int = RECIPE_INDEX_MAX_RECIPES):
+        self.max_recipes = max_recipes
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[str, int] = {}  # token -> bitset de ids
+        self._label_bits: Dict[str, int] = {}  # etiqueta -> posición del bit
+        self._label_masks: List[int] = []  # id -> máscara de etiquetas
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _add(self, recipe: Dict[str, Any]) -> Optional[int]:
+        url = recipe.get("url")
+        if not url:
+            return None
+        recipe_id = self._ids.get(url)
+        if recipe_id is not None:
+            return recipe_id
+        recipe_id = len(self._ids)
+        self._ids[url] = recipe_id
+
+        bit = 1 << recipe_id
+        words = set(tokens(str(recipe.get("label") or "")))
+        for line in recipe.get("ingredientLines") or recipe.get("ingredients") or []:
+            if isinstance(line, str):
+                words.update(tokens(line))
+        for word in words:
+            self._postings[word] = self._postings.get(word, 0) | bit
+
+        mask = 0
+        for field in ("healthLabels", "dietLabels"):
+            for label in recipe.get(field) or []:
+                if isinstance(label, str):
+                    mask |= 1 << self._label_bits.setdefault(normalize_label(label), len(self._label_bits))
+        self._label_masks.append(mask)
+        return recipe_id
+
+    def _phrase_bits(self, phrase: List[str]) -> int:
+        """Recetas que contienen todos los tokens de la frase."""
+        bits = -1
+        for word in phrase:
+            bits &= self._postings.get(word, 0)
+            if not bits:
+                break
+        return bits
+
+    def filter(
+        self,
+        recipes: Iterable[Dict[str, Any]],
+        diet: Optional[str] = None,
+        health: Optional[Iterable[str]] = None,
+        excluded: Optional[Iterable[str]] = None,
+        included: Optional[Iterable[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Recetas de `recipes` que cumplen los filtros: todas las etiquetas de `diet`/`health`,
+        ningún ingrediente de `excluded` y todas las palabras clave de `included`.
+        """
+        recipes = list(recipes)
+        with self._lock:
+            if len(self._ids) + len(recipes) > self.max_recipes:
+                self._clear()
+            ids = [(recipe, self._add(recipe)) for recipe in recipes]
+
+            required = 0
+            for label in ([diet] if diet else []) + list(health or []):
+                position = self._label_bits.get(normalize_label(label))
+                if position is None:  # Ninguna receta conocida tiene esa etiqueta
+                    return []
+                required |= 1 << position
+
+            excluded_bits = 0
+            for phrase in _phrases(excluded):
+                excluded_bits |= self._phrase_bits(phrase)
+            included_bits = -1
+            for phrase in _phrases(included):
+                included_bits &= self._phrase_bits(phrase)
+
+            allowed = included_bits & ~excluded_bits
+            matches = [
+                recipe for recipe, recipe_id in ids
+                if recipe_id is not None
+                and (allowed >> recipe_id) & 1
+                and self._label_masks[recipe_id] & required == required
+            ]
+        metrics.inc("recipe_index_filtered", len(matches))
+        return matches
+
+
+index = RecipeIndex()
+
+
+def has_filters(search_params: Dict[str, Any]) -> bool:
+    return any(search_params.get(k) for k in ("diet_filter", "health_labels", "excluded_items", "included_keywords_q"))
+
+
+def filter_for_search(recipes: Iterable[Dict[str, Any]], search_params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """RecipeIndex.filter con los parámetros de búsqueda de Edamam (los de fetch_recipes_from_edamam)."""
+    return index.filter(
+        recipes,
+        diet=search_params.get("diet_filter"),
+        health=search_params.get("health_labels"),
+        excluded=search_params.get("excluded_items"),
+        included=search_params.get("included_keywords_q"),
+    )
@@ -0,0 +1,264 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.services import edamam_records, metrics
+from app.services.cache import SqliteCache, TTLCache
+
+# Las ventanas calóricas se redondean a esta rejilla (kcal) antes de consultar Edamam, para que
+# usuarios con objetivos parecidos (2137 vs 2150 kcal) compartan búsqueda y resultados.
+# El filtrado exacto por calorías por ración se sigue haciendo en local.
+CALORIE_BUCKET_SIZE = int(os.getenv("CALORIE_BUCKET_SIZE", "50"))
+POOL_TTL_SECONDS = int(os.getenv("RECIPE_POOL_TTL_SECONDS", str(6 * 3600)))
+POOL_MAX_RECIPES = int(os.getenv("RECIPE_POOL_MAX_RECIPES", "200"))
+POOL_MAX_KEYS = int(os.getenv("RECIPE_POOL_MAX_KEYS", "2000"))
+
+PREWARM_ON_STARTUP = os.getenv("PREWARM_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+PREWARM_DAILY_CALORIES = [int(x) for x in os.getenv("PREWARM_DAILY_CALORIES", "1500,1800,2000,2200,2500").split(",") if x.strip()]
+PREWARM_INTERVAL_SECONDS = int(os.getenv("PREWARM_INTERVAL_SECONDS", str(POOL_TTL_SECONDS // 2)))
+# Un pool con al menos este número de recetas se considera caliente y no se vuelve a pedir
+PREWARM_MIN_RECIPES = int(os.getenv("PREWARM_MIN_RECIPES", "20"))
+
+# Con varios workers (uvicorn --workers N) los pools se guardan en un fichero SQLite compartido para
+# que todos los procesos aprovechen las búsquedas de los demás. Sin definir, cada proceso usa memoria.
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH")
+# Copia local de cada pool compartido, para no decodificar el JSON en cada petición
+SHARED_POOL_LOCAL_TTL_SECONDS = int(os.getenv("SHARED_POOL_LOCAL_TTL_SECONDS", "30"))
+# Total de resultados que Edamam declara para cada búsqueda (firma del pool). Un 0 es una búsqueda
+# imposible (caché negativa) y con el pool ya igual de grande que el total no hay nada nuevo que
+# pedir: en ambos casos no se vuelve a llamar a Edamam hasta que caduque.
+SEARCH_TOTALS_TTL_SECONDS = int(os.getenv("RECIPE_SEARCH_TOTALS_TTL_SECONDS", "3600"))
+
+
+def quantize_window(min_cal: int, max_cal: int, bucket: int = CALORIE_BUCKET_SIZE) -> Tuple[int, int]:
+    """Amplía [min_cal, max_cal] a los múltiplos de `bucket` que lo contienen (ej. 545-737 -> 500-750)."""
+    if bucket <= 1:
+        return min_cal, max_cal
+    qmin = (min_cal // bucket) * bucket
+    qmax = int(math.ceil(max_cal / bucket)) * bucket
+    if qmax <= qmin:
+        qmax = qmin + bucket
+    return qmin, qmax
+
+
+def _as_tuple(value: Any) -> Tuple:
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(sorted(str(v).lower() for v in value))
+
+
+def pool_key(qmin: int, qmax: int, search_params: Dict[str, Any]) -> Tuple:
+    """Firma de una búsqueda: ventana cuantizada + filtros normalizados."""
+    return (
+        qmin, qmax,
+        search_params.get("edamam_meal_type"),
+        (search_params.get("diet_filter") or "").lower() or None,
+        _as_tuple(search_params.get("health_labels")),
+        _as_tuple(search_params.get("excluded_items")),
+        _as_tuple(search_params.get("included_keywords_q")),
+    )
+
+
+class RecipePoolStore:
+    """Pools de recetas crudas de Edamam por firma de búsqueda, con TTL y tamaño máximo por pool."""
+
+    def __init__(self):
+        self._pools = TTLCache(max_entries=POOL_MAX_KEYS, ttl_seconds=POOL_TTL_SECONDS)
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> List[Dict[str, Any]]:
+        return list(self._pools.get(key) or [])
+
+    def add(self, key: Tuple, recipes: Iterable[Dict[str, Any]]) -> None:
+        with self._lock:
+            # Si se supera el máximo se descartan las más antiguas
+            self._pools.set(key, _merge_pool(list(self._pools.get(key) or []), recipes))
+
+    def size(self, key: Tuple) -> int:
+        return len(self._pools.get(key) or [])
+
+    def try_lease(self, name: str, ttl_seconds: float) -> bool:
+        # Un solo proceso: no hay nadie con quien repartir el trabajo
+        return True
+
+
+def _merge_pool(pool: List[Dict[str, Any]], recipes: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    known = {r.get("url") for r in pool}
+    for recipe in recipes:
+        url = recipe.get("url")
+        if url and url not in known:
+            pool.append(recipe)
+            known.add(url)
+    return pool[-POOL_MAX_RECIPES:]
+
+
+class SharedRecipePoolStore:
+    """
+    Misma interfaz que RecipePoolStore, pero los pools viven en un SQLite (WAL) compartido por
+    todos los workers. Las altas son lectura-modificación-escritura atómicas entre procesos.
+    """
+
+    def __init__(self, path: str):
+        self._db = SqliteCache(path, table="recipe_pools", ttl_seconds=POOL_TTL_SECONDS)
+        self._leases = SqliteCache(path, table="leases")
+        self._local = TTLCache(max_entries=POOL_MAX_KEYS, ttl_seconds=SHARED_POOL_LOCAL_TTL_SECONDS)
+
+    @staticmethod
+    def _db_key(key: Tuple) -> str:
+        return json.dumps(key, separators=(",", ":"))
+
+    def get(self, key: Tuple) -> List[Dict[str, Any]]:
+        pool = self._local.get(key)
+        if pool is None:
+            raw = self._db.get(self._db_key(key))
+            pool = [edamam_records.compact(r) for r in json.loads(raw)] if raw else []
+            if pool:  # Un pool vacío no se guarda: otro worker puede llenarlo en cualquier momento
+                self._local.set(key, pool)
+        return list(pool)
+
+    def add(self, key: Tuple, recipes: Iterable[Dict[str, Any]]) -> None:
+        recipes = list(recipes)
+
+        def _merge(current: Optional[str]) -> str:
+            pool = json.loads(current) if current else []
+            return json.dumps(_merge_pool(pool, recipes), default=edamam_records.to_json)
+
+        merged = self._db.update(self._db_key(key), _merge)
+        self._local.set(key, [edamam_records.compact(r) for r in json.loads(merged)])
+
+    def size(self, key: Tuple) -> int:
+        return len(self.get(key))
+
+    def try_lease(self, name: str, ttl_seconds: float) -> bool:
+        """True solo para el primer worker que lo pide en cada periodo de `ttl_seconds`."""
+        return self._leases.try_acquire(name, ttl_seconds)
+
+
+class SearchTotals:
+    """Firma de búsqueda -> total de Edamam, en memoria o en el SQLite compartido."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._shared = SqliteCache(path, table="search_totals", ttl_seconds=SEARCH_TOTALS_TTL_SECONDS) if path else None
+        self._local = TTLCache(max_entries=POOL_MAX_KEYS, ttl_seconds=SEARCH_TOTALS_TTL_SECONDS)
+
+    def get(self, key: Tuple) -> Optional[int]:
+        if self._shared is not None:
+            raw = self._shared.get(SharedRecipePoolStore._db_key(key))
+            return int(raw) if raw is not None else None
+        return self._local.get(key)
+
+    def set(self, key: Tuple, total: int) -> None:
+        if self._shared is not None:
+            self._shared.set(SharedRecipePoolStore._db_key(key), str(total))
+        else:
+            self._local.set(key, total)
+
+
+def _create_pool_store():
+    if SHARED_CACHE_PATH:
+        print(f"Pools de recetas compartidos entre workers en {SHARED_CACHE_PATH}")
+        return SharedRecipePoolStore(SHARED_CACHE_PATH)
+    return RecipePoolStore()
+
+
+pool_store = _create_pool_store()
+
+
+search_totals = SearchTotals(SHARED_CACHE_PATH)
+
+
+def record_search_total(key: Tuple, total: Optional[int]) -> None:
+    """Guarda el total de una búsqueda a Edamam (None: sin respuesta válida, no se guarda nada)."""
+    if total is None or SEARCH_TOTALS_TTL_SECONDS <= 0:
+        return
+    search_totals.set(key, total)
+    if total == 0:
+        metrics.inc("recipe_search_empty")
+
+
+def search_exhausted(key: Tuple) -> bool:
+    """True si otra búsqueda con esta firma no puede traer recetas nuevas (sin resultados o ya todas en el pool)."""
+    total = search_totals.get(key)
+    return total is not None and (total == 0 or pool_store.size(key) >= total)
+
+
+def search_infeasible(key: Tuple) -> bool:
+    """True si Edamam ya dijo que esta búsqueda no tiene ninguna receta."""
+    return search_totals.get(key) == 0
+
+
+def pooled_recipes(key: Tuple) -> List[Dict[str, Any]]:
+    """Recetas ya conocidas para la firma `key`, en orden aleatorio para dar variedad entre usuarios."""
+    recipes = pool_store.get(key)
+    random.shuffle(recipes)
+    metrics.inc("recipe_pool_lookups", labels={"result": "hit" if recipes else "miss"})
+    return recipes
+
+
+def prewarm_combinations(meal_ratios: Dict[str, float], windows: List[Tuple[float, int]]) -> List[Tuple[int, int, str]]:
+    """(qmin, qmax, comida) para las calorías diarias más habituales y las ventanas de cada generador."""
+    from app.services.menu_generator import calorie_window
+
+    combos = set()
+    for daily in PREWARM_DAILY_CALORIES:
+        for meal_name_key, ratio in meal_ratios.items():
+            for margin, min_gap in windows:
+                qmin, qmax = quantize_window(*calorie_window(daily, ratio, margin, min_gap))
+                combos.add((qmin, qmax, meal_name_key))
+    return sorted(combos)
+
+
+def prewarm_pools(stop_event: Optional[threading.Event] = None) -> int:
+    """Llena los pools de las combinaciones más comunes. Devuelve cuántas búsquedas se hicieron."""
+    from app.services.edamam_service import EDAMAM_MEAL_TYPE_MAP, fetch_recipes_from_edamam
+    from app.services.menu_generator import EDAMAM_PAGE_SIZE, RECOMMENDED_WINDOW, WEEKLY_WINDOW
+
+    default_ratios = {"desayuno": 0.3, "comida": 0.4, "cena": 0.3}
+    searches = 0
+    for qmin, qmax, meal_name_key in prewarm_combinations(default_ratios, [WEEKLY_WINDOW, RECOMMENDED_WINDOW]):
+        if stop_event is not None and stop_event.is_set():
+            break
+        search_params = {"edamam_meal_type": EDAMAM_MEAL_TYPE_MAP.get(meal_name_key)}
+        key = pool_key(qmin, qmax, search_params)
+        if pool_store.size(key) >= PREWARM_MIN_RECIPES or search_exhausted(key):
+            continue
+        recipes = fetch_recipes_from_edamam(
+            calorie_range_str=f"{qmin}-{qmax}",
+            num_recipes_to_get=EDAMAM_PAGE_SIZE,
+            **search_params
+        )
+        record_search_total(key, recipes.total)
+        pool_store.add(key, recipes)
+        searches += 1
+    metrics.inc("recipe_pool_prewarm_searches", searches)
+    return searches
+
+
+def start_prewarm_thread() -> Optional[threading.Event]:
+    """Lanza el precalentamiento en segundo plano y lo repite cada PREWARM_INTERVAL_SECONDS."""
+    if not PREWARM_ON_STARTUP:
+        return None
+    stop_event = threading.Event()
+
+    def _run():
+        while not stop_event.is_set():
+            inicio = time.perf_counter()
+            # Con varios workers solo uno precalienta en cada intervalo; el resto usa sus resultados
+            if not pool_store.try_lease("prewarm", PREWARM_INTERVAL_SECONDS):
+                stop_event.wait(PREWARM_INTERVAL_SECONDS)
+                continue
+            try:
+                searches = prewarm_pools(stop_event)
+                print(f"Precalentamiento de pools de recetas: {searches} búsquedas en {time.perf_counter() - inicio:.1f}s")
+            except Exception as e:
+                print(f"Error en el precalentamiento de pools de recetas: {e}")
+            stop_event.wait(PREWARM_INTERVAL_SECONDS)
+
+    threading.Thread(target=_run, name="recipe-pool-prewarm", daemon=True).start()
+    return stop_event
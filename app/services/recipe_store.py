@@ -0,0 +1,255 @@
+import contextlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app.services.cache import TTLCache
+
+# Los menús guardados y los favoritos guardan {"receta_id": N, ...} en lugar de la receta completa.
+# La fila de `recipes` (una por uri de Edamam) tiene solo los campos estables de la receta; lo
+# propio de cada contexto (la url firmada de la imagen, que Edamam cambia en cada búsqueda, los
+# campos que añade el frontend a los favoritos...) se queda en la referencia. Los blobs antiguos
+# (recetas completas) se siguen leyendo sin cambios.
+REF_KEY = "receta_id"
+STABLE_FIELDS = ("uri", "url", "label", "ingredients", "calories", "protein_g", "fat_g", "carbs_g", "total_nutrients_raw")
+RECIPE_CACHE_MAX_ENTRIES = int(os.getenv("RECIPE_CACHE_MAX_ENTRIES", "50000"))
+LOOKUP_CHUNK_SIZE = 500
+STORE_RETRIES = 3
+
+# Las filas no se modifican nunca (lo que difiere va en la referencia), así que se cachean sin caducidad
+_recipes_by_id = TTLCache(max_entries=RECIPE_CACHE_MAX_ENTRIES)
+_rows_by_uri = TTLCache(max_entries=RECIPE_CACHE_MAX_ENTRIES)
+
+
+def recipe_uri(recipe: Dict[str, Any]) -> Optional[str]:
+    """Clave de la fila: uri de Edamam, o la url si no hay (favoritos antiguos guardan recipe_url)."""
+    return recipe.get("uri") or recipe.get("url") or recipe.get("recipe_url")
+
+
+def stable_fields(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: recipe[k] for k in STABLE_FIELDS if recipe.get(k) is not None}
+
+
+def is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and isinstance(value.get(REF_KEY), int)
+
+
+def make_ref(recipe_id: int, row: Dict[str, Any], recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """Referencia a la fila con los campos de `recipe` que la fila no tiene o tiene con otro valor."""
+    ref = {REF_KEY: recipe_id}
+    ref.update((k, v) for k, v in recipe.items() if k not in row or row[k] != v)
+    return ref
+
+
+def resolve_ref(ref: Dict[str, Any], row: Dict[str, Any]) -> Dict[str, Any]:
+    recipe = dict(row)
+    recipe.update((k, v) for k, v in ref.items() if k != REF_KEY)
+    return recipe
+
+
+@contextlib.contextmanager
+def _session(db: Any = None):
+    """Usa la sesión recibida o abre una propia (p. ej. desde el recomendador, que no tiene una)."""
+    if db is not None:
+        yield db
+        return
+    from app.database import SessionLocal
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _chunks(values: List[Any], size: int = LOOKUP_CHUNK_SIZE) -> Iterator[List[Any]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _remember(recipe_id: int, uri: str, row: Dict[str, Any]) -> None:
+    _recipes_by_id.set(recipe_id, row)
+    _rows_by_uri.set(uri, (recipe_id, row))
+
+
+def store_recipes(db: Any, recipes: Iterable[Dict[str, Any]]) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+    """
+    Crea las filas de las recetas cuya uri aún no exista y devuelve {uri: (id, fila)} de todas
+    (las recetas sin uri ni url no tienen fila). Una consulta IN por bloque para las existentes
+    y un INSERT por lote para las nuevas. La primera versión que llega de una receta fija sus
+    campos estables. No hace commit: las filas se confirman con el cambio que las referencia.
+    """
+    from app.recipes import Recipe
+
+    by_uri: Dict[str, Dict[str, Any]] = {}
+    for recipe in recipes:
+        uri = recipe_uri(recipe)
+        if uri:
+            by_uri.setdefault(uri, recipe)
+
+    rows: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    pending = []
+    for uri in by_uri:
+        cached = _rows_by_uri.get(uri)
+        if cached is not None:
+            rows[uri] = cached
+        else:
+            pending.append(uri)
+
+    def _lookup(uris: List[str]) -> None:
+        for chunk in _chunks(uris):
+            for recipe_id, uri, data in db.query(Recipe.id, Recipe.uri, Recipe.data).filter(Recipe.uri.in_(chunk)):
+                row = json.loads(data)
+                rows[uri] = (recipe_id, row)
+                _remember(recipe_id, uri, row)
+
+    _lookup(pending)
+    missing = [uri for uri in pending if uri not in rows]
+    # Otro proceso puede insertar alguna de las mismas recetas a la vez: el savepoint deshace
+    # todo el lote, así que se vuelven a buscar las que ya existen y se reintenta con el resto.
+    for intento in range(STORE_RETRIES):
+        if not missing:
+            break
+        try:
+            with db.begin_nested():
+                new = {uri: stable_fields(by_uri[uri]) for uri in missing}
+                objs = [Recipe(uri=uri, data=json.dumps(row, ensure_ascii=False)) for uri, row in new.items()]
+                db.add_all(objs)
+                db.flush()
+            # No se cachean hasta que estén confirmadas: la transacción aún podría deshacerse
+            for obj in objs:
+                rows[obj.uri] = (obj.id, new[obj.uri])
+            missing = []
+        except IntegrityError:
+            if intento == STORE_RETRIES - 1:
+                raise
+            _lookup(missing)
+            missing = [uri for uri in missing if uri not in rows]
+    return rows
+
+
+def hydrate_refs(db: Any, recipe_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """{id: fila} para los ids pedidos, con consultas IN por bloques y caché en memoria."""
+    from app.recipes import Recipe
+
+    found: Dict[int, Dict[str, Any]] = {}
+    pending = []
+    for recipe_id in set(recipe_ids):
+        cached = _recipes_by_id.get(recipe_id)
+        if cached is not None:
+            found[recipe_id] = cached
+        else:
+            pending.append(recipe_id)
+    if pending:
+        with _session(db) as session:
+            for chunk in _chunks(pending):
+                for recipe_id, uri, data in session.query(Recipe.id, Recipe.uri, Recipe.data).filter(Recipe.id.in_(chunk)):
+                    row = json.loads(data)
+                    _remember(recipe_id, uri, row)
+                    found[recipe_id] = row
+    return found
+
+
+# --- Recorrido de menús guardados y favoritos ------------------------------------------------
+
+def _map_menu_recipes(menu_obj: Any, fn: Callable[[Dict[str, Any]], Any]) -> Any:
+    """Copia de {"menu": {día: {comida: slot}}} aplicando `fn` a 'selected' y a cada opción."""
+    if not isinstance(menu_obj, dict) or not isinstance(menu_obj.get("menu"), dict):
+        return menu_obj
+    new_days = {}
+    for dia, comidas in menu_obj["menu"].items():
+        if not isinstance(comidas, dict):
+            new_days[dia] = comidas
+            continue
+        new_meals = {}
+        for comida, slot in comidas.items():
+            if isinstance(slot, dict):
+                slot = dict(slot)
+                if isinstance(slot.get("selected"), dict):
+                    slot["selected"] = fn(slot["selected"])
+                if isinstance(slot.get("options"), list):
+                    slot["options"] = [fn(o) if isinstance(o, dict) else o for o in slot["options"]]
+            new_meals[comida] = slot
+        new_days[dia] = new_meals
+    return dict(menu_obj, menu=new_days)
+
+
+def _menu_recipes(menu_obj: Any) -> List[Dict[str, Any]]:
+    found: List[Dict[str, Any]] = []
+    _map_menu_recipes(menu_obj, lambda r: found.append(r) or r)
+    return found
+
+
+def _dehydrate(db: Any, recipes: List[Dict[str, Any]]) -> Callable[[Dict[str, Any]], Any]:
+    rows = store_recipes(db, [r for r in recipes if not is_ref(r)])
+
+    def fn(r: Dict[str, Any]) -> Any:
+        if is_ref(r):
+            return r
+        found = rows.get(recipe_uri(r))
+        return make_ref(found[0], found[1], r) if found else r  # Sin uri ni url se guarda completa
+    return fn
+
+
+def _hydrate(db: Any, recipes: List[Dict[str, Any]]) -> Callable[[Dict[str, Any]], Any]:
+    found = hydrate_refs(db, [r[REF_KEY] for r in recipes if is_ref(r)])
+    # Una referencia a una fila inexistente se deja tal cual (no debería ocurrir)
+    return lambda r: resolve_ref(r, found[r[REF_KEY]]) if is_ref(r) and r[REF_KEY] in found else r
+
+
+def inline_refs(value: Any, rows: Dict[int, Dict[str, Any]]) -> Any:
+    """Menú guardado o lista de favoritos con las referencias a `rows` ({id: fila}) sustituidas por la receta."""
+    fn = lambda r: resolve_ref(r, rows[r[REF_KEY]]) if is_ref(r) and r[REF_KEY] in rows else r
+    if isinstance(value, list):
+        return [fn(f) if isinstance(f, dict) else f for f in value]
+    return _map_menu_recipes(value, fn)
+
+
+def dehydrate_menu(db: Any, menu_obj: Any) -> Any:
+    """Menú guardado con las recetas sustituidas por referencias {"receta_id": N, ...} (creando las filas que falten)."""
+    return _map_menu_recipes(menu_obj, _dehydrate(db, _menu_recipes(menu_obj)))
+
+
+def dehydrate_menus(db: Any, menu_objs: List[Any]) -> List[Any]:
+    """Como dehydrate_menu para varios menús, con un solo store_recipes para todas sus recetas."""
+    fn = _dehydrate(db, [r for m in menu_objs for r in _menu_recipes(m)])
+    return [_map_menu_recipes(m, fn) for m in menu_objs]
+
+
+def hydrate_menu(db: Any, menu_obj: Any) -> Any:
+    return hydrate_menus(db, [menu_obj])[0]
+
+
+def hydrate_menus(db: Any, menu_objs: List[Any]) -> List[Any]:
+    """Rehidrata varios menús con una sola búsqueda de todas sus recetas."""
+    fn = _hydrate(db, [r for m in menu_objs for r in _menu_recipes(m)])
+    return [_map_menu_recipes(m, fn) for m in menu_objs]
+
+
+def dehydrate_favorites(db: Any, favoritas: List[Any]) -> List[Any]:
+    fn = _dehydrate(db, [f for f in favoritas if isinstance(f, dict)])
+    return [fn(f) if isinstance(f, dict) else f for f in favoritas]
+
+
+def hydrate_favorites(db: Any, favoritas: Any) -> Any:
+    if not isinstance(favoritas, list):
+        return favoritas
+    fn = _hydrate(db, [f for f in favoritas if isinstance(f, dict)])
+    return [fn(f) if isinstance(f, dict) else f for f in favoritas]
+
+
+def load_saved_menu(db: Any, raw_menu_json: Optional[str]) -> Any:
+    """json.loads del menú guardado + rehidratación. Lanza ValueError si el JSON está malformado."""
+    try:
+        menu_obj = json.loads(raw_menu_json)
+    except (json.JSONDecodeError, TypeError) as e:
+        raise ValueError(f"JSON malformado: {e}")
+    return hydrate_menu(db, menu_obj)
+
+
+def load_favorites(db: Any, raw_favoritas: Optional[str]) -> Any:
+    """json.loads de recetas_favoritas + rehidratación (lista vacía si no hay)."""
+    if not raw_favoritas:
+        return []
+    return hydrate_favorites(db, json.loads(raw_favoritas))
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.services import recipe_store
+from app.services.cache import TTLCache
+from app.services.shopping_list import clean_ingredient
+
+# Dimensión de los vectores (hashing trick): no hace falta un vocabulario fijo y los vectores
+# ya calculados siguen siendo válidos aunque aparezcan ingredientes nuevos.
+VECTOR_DIM = int(os.getenv("RECOMMENDER_VECTOR_DIM", "1024"))
+MAX_RECIPES = int(os.getenv("RECOMMENDER_MAX_RECIPES", "20000"))
+
+# Palabras que no aportan nada al "gusto" de una receta
+STOPWORDS = {
+    "and", "with", "the", "for", "from", "recipe", "recipes", "style", "easy", "best", "quick",
+    "homemade", "fresh", "large", "small", "medium", "whole", "plus", "more", "about",
+    "con", "de", "del", "la", "las", "los", "el", "y", "en", "al", "receta",
+}
+
+
+def _normalize_text(texto: str) -> str:
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii").lower()
+
+
+def _words(texto: str) -> List[str]:
+    return [w for w in re.findall(r"[a-z]+", _normalize_text(texto)) if len(w) > 2 and w not in STOPWORDS]
+
+
+def recipe_tokens(recipe: Dict[str, Any]) -> List[str]:
+    """
+    Tokens de una receta a partir de sus ingredientes, título y etiquetas.
+    Acepta tanto el objeto 'recipe' de Edamam (ingredientLines, healthLabels...) como un
+    RecipeOption serializado (ingredients), que es lo que se guarda en favoritos.
+    """
+    tokens: List[str] = []
+    ingredient_lines = recipe.get("ingredientLines") or recipe.get("ingredients") or []
+    for line in ingredient_lines:
+        if isinstance(line, str):
+            name, _, _ = clean_ingredient(line)
+            if name and name != "unknown":
+                tokens.extend(f"ing:{w}" for w in _words(name))
+    tokens.extend(f"lbl:{w}" for w in _words(str(recipe.get("label") or "")))
+    for field in ("healthLabels", "dietLabels", "cuisineType", "dishType"):
+        for etiqueta in recipe.get(field) or []:
+            if isinstance(etiqueta, str):
+                tokens.append(f"tag:{_normalize_text(etiqueta)}")
+    return tokens
+
+
+def _term_frequencies(tokens: Sequence[str]) -> np.ndarray:
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for token, count in Counter(tokens).items():
+        vector[zlib.crc32(token.encode("utf-8")) % VECTOR_DIM] += 1.0 + math.log(count)
+    return vector
+
+
+def recipe_key(recipe: Dict[str, Any]) -> Optional[str]:
+    return recipe.get("uri") or recipe.get("url") or recipe.get("recipe_url")
+
+
+class RecipeVectorStore:
+    """
+    Matriz NumPy con el vector de frecuencias (TF) de cada receta conocida, más las frecuencias
+    de documento (DF) necesarias para el IDF. Cada receta se vectoriza una sola vez; cuando se
+    llena, se reutilizan las filas más antiguas.
+    """
+
+    def __init__(self, dim: int = VECTOR_DIM, max_recipes: int = MAX_RECIPES):
+        self.dim = dim
+        self.max_recipes = max_recipes
+        self._tf = np.zeros((min(max_recipes, 256), dim), dtype=np.float32)
+        self._df = np.zeros(dim, dtype=np.float64)
+        self._row_by_key: Dict[str, int] = {}
+        self._key_by_row: List[Optional[str]] = []
+        self._next_row = 0
+        self._lock = threading.Lock()
+
+    def _grow(self) -> None:
+        new_size = min(self.max_recipes, len(self._tf) * 2)
+        grown = np.zeros((new_size, self.dim), dtype=np.float32)
+        grown[:len(self._tf)] = self._tf
+        self._tf = grown
+
+    def add(self, recipe: Dict[str, Any]) -> Optional[int]:
+        """Vectoriza la receta si no estaba ya y devuelve su fila."""
+        key = recipe_key(recipe)
+        if not key:
+            return None
+        with self._lock:
+            row = self._row_by_key.get(key)
+            if row is not None:
+                return row
+            vector = _term_frequencies(recipe_tokens(recipe))
+
+            if len(self._key_by_row) < self.max_recipes:
+                row = len(self._key_by_row)
+                if row >= len(self._tf):
+                    self._grow()
+                self._key_by_row.append(key)
+            else:
+                # Matriz llena: se sustituye la fila más antigua
+                row = self._next_row
+                self._next_row = (self._next_row + 1) % self.max_recipes
+                old_key = self._key_by_row[row]
+                if old_key is not None:
+                    self._row_by_key.pop(old_key, None)
+                    self._df -= self._tf[row] > 0
+                self._key_by_row[row] = key
+
+            self._tf[row] = vector
+            self._df += vector > 0
+            self._row_by_key[key] = row
+            return row
+
+    def tf(self, rows: Sequence[int]) -> np.ndarray:
+        with self._lock:
+            return self._tf[np.asarray(rows, dtype=np.intp)].copy()
+
+    def idf(self) -> np.ndarray:
+        n_docs = len(self._key_by_row)
+        return (np.log((1.0 + n_docs) / (1.0 + self._df)) + 1.0).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self._key_by_row)
+
+
+def _tfidf_normalized(tf: np.ndarray, idf: np.ndarray) -> np.ndarray:
+    weighted = tf * idf
+    norms = np.linalg.norm(weighted, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return weighted / norms
+
+
+recipe_vectors = RecipeVectorStore()
+
+# user_id -> (hash de recetas_favoritas, vector TF de gusto). Se actualiza cuando cambian los favoritos.
+_taste_vectors = TTLCache(max_entries=10000)
+
+
+def _favorites_digest(raw_favoritas: Any) -> str:
+    if not isinstance(raw_favoritas, str):
+        raw_favoritas = json.dumps(raw_favoritas, sort_keys=True)
+    return hashlib.sha1(raw_favoritas.encode("utf-8")).hexdigest()
+
+
+def update_user_taste(user_id: Any, favoritas: List[Any], raw_favoritas: Any = None) -> Optional[np.ndarray]:
+    """
+    Recalcula el vector de gusto del usuario (media de los TF de sus favoritas) y lo guarda.
+    Llamar cada vez que cambian sus favoritos.
+    """
+    rows = [recipe_vectors.add(r) for r in favoritas if isinstance(r, dict)]
+    rows = [r for r in rows if r is not None]
+    taste = recipe_vectors.tf(rows).mean(axis=0) if rows else None
+    digest = _favorites_digest(raw_favoritas if raw_favoritas is not None else favoritas)
+    _taste_vectors.set(user_id, (digest, taste))
+    return taste
+
+
+def taste_for_user(user: Any, db: Any = None) -> Optional[np.ndarray]:
+    """Vector de gusto del usuario; solo se reparsean los favoritos si han cambiado desde la última vez."""
+    raw = user.recetas_favoritas
+    if not raw:
+        return None
+    cached = _taste_vectors.get(user.id)
+    if cached is not None and cached[0] == _favorites_digest(raw):
+        return cached[1]
+    try:
+        favoritas = json.loads(raw) if isinstance(raw, str) else raw
+        # Los favoritos guardan referencias a la tabla de recetas
+        favoritas = recipe_store.hydrate_favorites(db, favoritas)
+    except json.JSONDecodeError as e:
+        print(f"Error al procesar recetas favoritas para el vector de gusto ({user.username}): {e}")
+        return None
+    if not isinstance(favoritas, list):
+        return None
+    return update_user_taste(user.id, favoritas, raw)
+
+
+def rank_order(taste: Optional[np.ndarray], candidates: List[Dict[str, Any]]) -> List[int]:
+    """
+    Índices de las recetas candidatas ordenadas por similitud coseno (TF-IDF) con el gusto
+    del usuario, de más a menos parecida. Sin vector de gusto se conserva el orden original.
+    """
+    if taste is None or not candidates:
+        return list(range(len(candidates)))
+    rows = [recipe_vectors.add(c) for c in candidates]
+    indexed = [(i, r) for i, r in enumerate(rows) if r is not None]
+    if not indexed:
+        return list(range(len(candidates)))
+
+    idf = recipe_vectors.idf()
+    matrix = _tfidf_normalized(recipe_vectors.tf([r for _, r in indexed]), idf)
+    taste_vec = _tfidf_normalized(taste[np.newaxis, :], idf)[0]
+    scores = np.full(len(candidates), -1.0)
+    scores[[i for i, _ in indexed]] = matrix @ taste_vec
+    return np.argsort(-scores, kind="stable").tolist()
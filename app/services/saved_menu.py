@@ -0,0 +1,115 @@
+import hashlib
+import json
+import unicodedata
+from typing import Any, Dict, List, Optional, Set
+
+DIAS_SEMANA = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"]
+
+
+def normalize_day_name(dia: str) -> str:
+    """'Miércoles' -> 'miercoles'. Permite comparar días con o sin tilde."""
+    sin_tildes = unicodedata.normalize("NFKD", dia).encode("ascii", "ignore").decode("ascii")
+    return sin_tildes.strip().lower()
+
+
+def menu_version(raw_menu_json: Optional[str]) -> Optional[str]:
+    """
+    Versión del menú guardado: hash del JSON almacenado en `last_generated_menu_json`.
+    Cambia cada vez que se guarda un menú distinto, así que sirve como clave de caché.
+    """
+    if not raw_menu_json:
+        return None
+    return hashlib.sha1(raw_menu_json.encode("utf-8")).hexdigest()
+
+
+def parse_saved_menu(raw_menu_json: str) -> Dict[str, Any]:
+    """
+    Parsea `last_generated_menu_json` y devuelve el diccionario de días
+    ({"lunes": {"desayuno": {...}, ...}, ...}).
+    Lanza ValueError si el JSON está malformado o no tiene la clave "menu".
+    """
+    try:
+        parsed_json_object = json.loads(raw_menu_json)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON malformado: {e}")
+    return saved_menu_days(parsed_json_object)
+
+
+def saved_menu_days(parsed_json_object: Any) -> Dict[str, Any]:
+    """Igual que `parse_saved_menu` pero sobre un objeto ya decodificado ({"menu": {...}})."""
+    if not isinstance(parsed_json_object, dict) or "menu" not in parsed_json_object:
+        raise ValueError("Falta la clave 'menu' principal.")
+
+    menu_items = parsed_json_object["menu"]
+    if not isinstance(menu_items, dict):
+        raise ValueError("La clave 'menu' debe ser un diccionario de días.")
+    return menu_items
+
+
+def selected_recipe(slot_comida: Any) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve la receta elegida de un slot guardado: la 'selected' si existe,
+    si no la primera de 'options'. También acepta el slot siendo directamente la receta.
+    """
+    if not slot_comida or not isinstance(slot_comida, dict):
+        return None
+    if isinstance(slot_comida.get("selected"), dict):
+        return slot_comida["selected"]
+    options = slot_comida.get("options")
+    if isinstance(options, list) and len(options) > 0 and isinstance(options[0], dict):
+        return options[0]
+    if "ingredients" in slot_comida:
+        return slot_comida
+    return None
+
+
+def selected_recipes_by_day(menu_items: Dict[str, Any]) -> Dict[str, Dict[str, Optional[Dict[str, Any]]]]:
+    """Día -> TipoComida -> receta seleccionada (mismo formato que el payload de /generate-shopping-list)."""
+    resultado: Dict[str, Dict[str, Optional[Dict[str, Any]]]] = {}
+    for dia_nombre, comidas_del_dia in menu_items.items():
+        if not isinstance(comidas_del_dia, dict):
+            continue
+        resultado[dia_nombre] = {
+            tipo_comida: selected_recipe(slot_comida)
+            for tipo_comida, slot_comida in comidas_del_dia.items()
+        }
+    return resultado
+
+
+def filter_day_range(menu_items: Dict[str, Any], desde: Optional[str] = None, hasta: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Filtra el menú a los días entre `desde` y `hasta` (ambos incluidos, orden lunes..domingo).
+    Los días que no son de la semana se conservan solo si no se pide ningún rango.
+    Lanza ValueError si algún límite no es un día válido.
+    """
+    if not desde and not hasta:
+        return menu_items
+
+    orden: List[str] = DIAS_SEMANA
+    for limite in (desde, hasta):
+        if limite and normalize_day_name(limite) not in orden:
+            raise ValueError(f"Día no válido: '{limite}'. Usa uno de {orden}")
+
+    inicio = orden.index(normalize_day_name(desde)) if desde else 0
+    fin = orden.index(normalize_day_name(hasta)) if hasta else len(orden) - 1
+    if inicio > fin:
+        raise ValueError(f"Rango de días vacío: '{desde}' es posterior a '{hasta}'")
+
+    dias_permitidos = set(orden[inicio:fin + 1])
+    return {dia: comidas for dia, comidas in menu_items.items() if normalize_day_name(dia) in dias_permitidos}
+
+
+def recipe_urls_in_menu(menu_items: Dict[str, Any]) -> Set[str]:
+    """URLs de todas las recetas del menú (seleccionadas y opciones), para no repetirlas al regenerar."""
+    urls: Set[str] = set()
+    for comidas_del_dia in menu_items.values():
+        if not isinstance(comidas_del_dia, dict):
+            continue
+        for slot_comida in comidas_del_dia.values():
+            if not isinstance(slot_comida, dict):
+                continue
+            recetas = [slot_comida.get("selected"), slot_comida] + list(slot_comida.get("options") or [])
+            for receta in recetas:
+                if isinstance(receta, dict) and isinstance(receta.get("url"), str):
+                    urls.add(receta["url"])
+    return urls
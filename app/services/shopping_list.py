@@ -0,0 +1,109 @@
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.cache import TTLCache
+
+# Diccionario para corregir errores comunes
+CORRECTIONS = {
+    "arlic": "garlic",
+    "iol": "oil",
+    "rapes": "grapes",
+    "tumeric": "turmeric",
+    "/head cauliflower": "cauliflower",
+    "juice /lime": "lime juice",
+    "caldo de pollo": "chicken broth",
+    "white/white wine vinegar": "white wine vinegar"
+}
+
+# Frases que no deben considerarse ingredientes
+DISCARD_PHRASES = [
+    "for brushing vegetables", "into inch florets", "into /inchthick slices",
+    "yield once processed", "with brush stems", "with tails thawed",
+    "the root thinly", "halved lengthways thin", "into small cubes",
+    "into inch pieces", "ribs seeds thinly"
+]
+
+# Filtrado de palabras útiles
+IGNORE_WORDS = {
+    "and", "or", "with", "cut", "sliced", "diced", "peeled", "each", "few",
+    "shakes", "removed", "washed", "dry", "dried", "thinly", "minced", "chopped"
+}
+
+_RE_SYMBOLS = re.compile(r"[\*\-]")
+_RE_PARENS = re.compile(r"\([^)]*\)")
+_RE_FILLERS = re.compile(r"\b(optional|to taste|as desired|depending.*|divided)\b")
+_RE_UNITS = re.compile(r"\b(can|cup|cups|tbsp|tsp|oz|ounce|tablespoon|teaspoon|g|kg|ml|l|container|pkg|bunch|head)\b")
+_RE_QUANTITIES = re.compile(r"\d+\.?\d*\s?(oz|g|ml|kg|lb|cup|cups|tbsp|tsp|tablespoon|teaspoon|container|pkg)?")
+
+
+# Las mismas líneas de ingredientes se repiten en muchísimos menús: se memoriza el resultado
+@lru_cache(maxsize=65536)
+def clean_ingredient(raw: str) -> Tuple[Optional[str], float, str]:
+    raw = raw.strip().lower()
+
+    # Corregir errores ortográficos
+    for wrong, right in CORRECTIONS.items():
+        raw = raw.replace(wrong, right)
+
+    # Eliminar frases no relevantes
+    for phrase in DISCARD_PHRASES:
+        if phrase in raw:
+            return None, 0, ""
+
+    # Limpieza general
+    raw = _RE_SYMBOLS.sub("", raw)
+    raw = _RE_PARENS.sub("", raw)
+    raw = _RE_FILLERS.sub("", raw)
+    raw = _RE_UNITS.sub("", raw)
+    raw = _RE_QUANTITIES.sub("", raw)
+    raw = raw.replace(",", "")
+
+    words = raw.split()
+    if not words:
+        return "unknown", 1.0, ""
+
+    keywords = [w for w in words if len(w) > 2 and w not in IGNORE_WORDS]
+
+    # Heurística para formar el nombre del ingrediente
+    name = " ".join(keywords[-3:]) if keywords else "unknown"
+
+    return name.strip(), 1.0, ""
+
+
+def build_shopping_list(selected_menu_data: Dict[str, Dict[str, Optional[Dict[str, Any]]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Construye la lista de la compra a partir de Día -> TipoComida -> receta seleccionada.
+    Devuelve {ingrediente: {"amount": ..., "unit": ...}} ordenado por nombre de ingrediente.
+    """
+    aggregated_ingredients: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"quantity": 0.0, "units": set()})
+
+    for dia, comidas_del_dia in selected_menu_data.items():
+        for tipo_comida, receta_seleccionada_data in comidas_del_dia.items():
+            # receta_seleccionada_data es un diccionario que debe tener 'ingredients'
+            if receta_seleccionada_data and isinstance(receta_seleccionada_data.get("ingredients"), list):
+                for raw_ingredient_line in receta_seleccionada_data["ingredients"]:
+                    if isinstance(raw_ingredient_line, str): # Asegurar que es una string
+                        name, qty, unit = clean_ingredient(raw_ingredient_line)
+                        if name and name != "unknown": # Ignorar ingredientes no parseados
+                            aggregated_ingredients[name]["quantity"] += qty
+                            if unit: # Añadir la unidad si existe
+                                aggregated_ingredients[name]["units"].add(unit)
+
+    # Formatear la salida final
+    final_list: Dict[str, Dict[str, Any]] = {}
+    for name, data in aggregated_ingredients.items():
+        unit_str = ", ".join(sorted(list(data["units"]))) if data["units"] else "unidad(es)"
+        final_list[name] = {
+            "amount": round(data["quantity"], 2),
+            "unit": unit_str
+        }
+
+    return dict(sorted(final_list.items())) # Ordenar por nombre de ingrediente
+
+
+# Listas ya calculadas: (user_id, versión del menú guardado, desde, hasta) -> lista.
+# Al guardar un menú nuevo cambia la versión, por lo que las entradas antiguas dejan de usarse
+# y acaban expulsadas por tamaño o por TTL.
+shopping_list_cache = TTLCache(max_entries=2048, ttl_seconds=24 * 3600)
@@ -0,0 +1,41 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+
+# Presupuesto de arranque en frío (importar app.main + startup del lifespan), en milisegundos
+COLD_START_BUDGET_MS = float(os.getenv("COLD_START_BUDGET_MS", "1500"))
+
+_process_start = time.perf_counter()
+_lock = threading.Lock()
+_timings: Dict[str, float] = {}
+_ready_ms: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(nombre: str):
+    """Mide cuánto tarda un subsistema en importarse/inicializarse y lo añade al informe de arranque."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _timings[nombre] = _timings.get(nombre, 0.0) + (time.perf_counter() - inicio) * 1000
+
+
+def mark_ready() -> None:
+    """Marca el final del arranque (app importada y lifespan completado)."""
+    _ready_ms["ready"] = (time.perf_counter() - _process_start) * 1000
+
+
+def report() -> Dict[str, Any]:
+    with _lock:
+        timings = {nombre: round(ms, 2) for nombre, ms in _timings.items()}
+    ready_ms = _ready_ms.get("ready")
+    return {
+        "subsistemas_ms": timings,
+        "arranque_ms": round(ready_ms, 2) if ready_ms is not None else None,
+        "presupuesto_ms": COLD_START_BUDGET_MS,
+        "dentro_de_presupuesto": ready_ms is not None and ready_ms <= COLD_START_BUDGET_MS,
+    }
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Integer, String, Text, event
+from sqlalchemy.orm import deferred, object_session
 from .base import Base
 
 class User(Base):
@@ -17,5 +18,15 @@ class User(Base):
     actividad = Column(String, nullable=True)
     objetivo = Column(String, nullable=True)
     bmr = Column(Integer, nullable=True)
-    last_generated_menu_json = Column(Text, nullable=True)
-    recetas_favoritas = Column(Text, nullable=True)
\ No newline at end of file
+    # Los blobs se cargan solo al usarse (juntos): comprobar un ETag no necesita leerlos
+    last_generated_menu_json = deferred(Column(Text, nullable=True), group="blobs")
+    recetas_favoritas = deferred(Column(Text, nullable=True), group="blobs")
+    # Se incrementa en cada escritura del usuario; es la base de los ETag de /perfil, /menu-guardado y /favoritas
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+@event.listens_for(User, "before_update")
+def _bump_data_version(mapper, connection, target):
+    session = object_session(target)
+    if session is None or session.is_modified(target, include_collections=False):
+        target.data_version = (target.data_version or 0) + 1
\ No newline at end of file
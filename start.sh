@@ -1,2 +1,13 @@
 #!/bin/bash
-uvicorn app.main:app --host 0.0.0.0 --port 10000
+# Modo multi-worker: uvicorn arranca un proceso por CPU (o WEB_CONCURRENCY si está definido).
+#  - Los pools de recetas se comparten entre workers a través de SHARED_CACHE_PATH (SQLite en WAL).
+#  - Recarga en caliente sin cortar el servicio: `kill -HUP <pid del proceso principal>` reinicia los
+#    workers uno a uno; cada uno termina sus peticiones en curso (hasta GRACEFUL_TIMEOUT segundos).
+WORKERS="${WEB_CONCURRENCY:-$(nproc 2>/dev/null || echo 1)}"
+export SHARED_CACHE_PATH="${SHARED_CACHE_PATH:-./shared_cache.db}"
+
+exec uvicorn app.main:app \
+    --host 0.0.0.0 \
+    --port "${PORT:-10000}" \
+    --workers "$WORKERS" \
+    --timeout-graceful-shutdown "${GRACEFUL_TIMEOUT:-30}"